@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+batch_upload.py
+=================
+Uploads the exports of several athletes to Strava from a single process. All
+of them share the rate limits of the Strava application, so their uploads are
+scheduled in turns and every athlete can be given their own budget.
+"""
+from configparser import ConfigParser, SectionProxy
+from contextlib import ExitStack
+from pathlib import Path
+
+import fire
+from loguru import logger
+
+from upload_to_strava import Migration, UploadOptions, get_number_of_workers, get_upload_options, \
+    run_migrations, get_strava_client
+from utils.config_handler import init_app
+from utils.constants import CONFIG_PATH, CONFIG_FILE_PATH, ACCOUNTS_FILE_PATH, RATE_LIMIT_FILE_NAME, \
+    ACCOUNT_RATE_LIMIT_FILE_NAME, ACCOUNT_TOKEN_FILE_NAME, FALLBACK_LOG_LEVEL
+from utils.files_handler import check_folder, retrieve_activities_path, get_project_file_path
+from utils.parameters import PATH, TOKEN, SHORT_RATE_LIMIT, LONG_RATE_LIMIT, SYSTEM, LOG_LEVEL
+from utils.rate_limiter import RateLimiter, AccountRateLimiter
+
+
+def read_accounts(accounts_path: str) -> ConfigParser:
+    """ Reads the accounts file, with a section for every athlete.
+
+    Args:
+        accounts_path (str): path to the accounts file.
+
+    Returns:
+        ConfigParser: accounts configuration.
+
+    Raises:
+        ValueError: if the file does not exist or has no accounts.
+    """
+    if not Path(accounts_path).is_file():
+        raise ValueError(f'The accounts file `{accounts_path}` was not found.')
+
+    accounts = ConfigParser()
+    accounts.read(accounts_path)
+    if not accounts.sections():
+        raise ValueError(f'No accounts found in `{accounts_path}`.')
+
+    logger.info('Uploading the exports of {} accounts: {}.', len(accounts.sections()),
+                ', '.join(accounts.sections()))
+    return accounts
+
+
+def get_account_migration(account: SectionProxy,
+                          app_config: ConfigParser,
+                          application_limiter: RateLimiter,
+                          workers: int,
+                          options: UploadOptions) -> Migration:
+    """ Creates the migration of an athlete. Their requests are limited by
+    the `short_limit` and `long_limit` of their section, by default the ones
+    of the application, and by the limits of the application.
+
+    Args:
+        account (SectionProxy): section of the athlete in the accounts file.
+        app_config (ConfigParser): app configuration.
+        application_limiter (RateLimiter): rate limiter of the application.
+        workers (int): number of concurrent uploads.
+        options (UploadOptions): options of the upload.
+
+    Returns:
+        Migration: migration of the athlete, not opened yet.
+    """
+    name = account.name
+    activities_folder = retrieve_activities_path(account.get(PATH), app_config)
+    token = account.get(TOKEN, fallback=None)
+    token_path = get_project_file_path(token) if token else Path(CONFIG_PATH, ACCOUNT_TOKEN_FILE_NAME.format(name))
+
+    account_limiter = RateLimiter(Path(CONFIG_PATH, ACCOUNT_RATE_LIMIT_FILE_NAME.format(name)),
+                                  short_limit=account.getint(SHORT_RATE_LIMIT,
+                                                             fallback=application_limiter.short_limit),
+                                  long_limit=account.getint(LONG_RATE_LIMIT,
+                                                            fallback=application_limiter.long_limit),
+                                  update_limits=False)
+    logger.info('Budget of `{}`: {} requests every 15 minutes and {} per day.',
+                name, account_limiter.short_limit, account_limiter.long_limit)
+
+    client = get_strava_client(app_config, application_limiter, workers, token_path)
+    return Migration(name, activities_folder, client, AccountRateLimiter(account_limiter, application_limiter),
+                     options)
+
+
+def batch_upload(accounts: str = ACCOUNTS_FILE_PATH,
+                 config: str = CONFIG_FILE_PATH,
+                 workers: int = None,
+                 move_files: bool = None,
+                 compress: bool = None,
+                 simplify_tolerance: float = None,
+                 skip_duplicates: bool = None,
+                 poll_uploads: bool = None,
+                 daemon: bool = None,
+                 fit: bool = None,
+                 preflight: bool = None,
+                 max_retries: int = None,
+                 reconcile: bool = None):
+    """ Uploads the workouts of the exports of several athletes. The accounts
+    file has a section for each athlete with the path to their export, the
+    path to their token file, by default `config/token_<athlete>.json`, relative
+    to the project folder, and,
+    optionally, their own limits, `short_limit` and `long_limit`.
+
+    The uploads of all the athletes share the pool of workers and are
+    submitted in turns, so all the exports advance at the same pace. Every
+    request is reserved in the budget of the athlete and in the one of the
+    application, so the whole limit of the application is used without any
+    athlete going over their budget.
+
+    Args:
+        accounts: path to the accounts file.
+        config: path to the configuration file.
+        workers: number of concurrent uploads, shared by all the athletes. By
+         default, the one set in the configuration file, or four if it is not
+         set.
+        move_files: move the workouts to the `processed` and `error` folders
+         after the upload. By default, the one set in the configuration file.
+        compress: upload the TCX files compressed with gzip. By default, the
+         one set in the configuration file.
+        simplify_tolerance: distance in meters that the simplified track can
+         deviate from the original one. By default, the one set in the
+         configuration file.
+        skip_duplicates: detect the duplicated workouts of the exports and do
+         not upload them. By default, the one set in the configuration file.
+        poll_uploads: check the status of the uploads. By default, the one set
+         in the configuration file.
+        daemon: keep running when the daily limits are reached, sleeping
+         until they are reset. By default, the one set in the configuration
+         file.
+        fit: convert the workouts to FIT before uploading them. By default,
+         the one set in the configuration file.
+        preflight: validate the workouts before uploading them and skip the
+         ones that Strava would reject. By default, the one set in the
+         configuration file.
+        max_retries: times that an upload failed with a transient error is
+         retried. By default, the one set in the configuration file.
+        reconcile: skip the workouts that each athlete already has in
+         Strava. By default, the one set in the configuration file.
+    """
+    app_config = init_app(config)
+    application_limiter = RateLimiter(Path(check_folder(CONFIG_PATH), RATE_LIMIT_FILE_NAME))
+    workers = get_number_of_workers(workers, app_config)
+    options = get_upload_options(app_config, move_files, compress, simplify_tolerance,
+                                 skip_duplicates, poll_uploads, daemon, fit, preflight, max_retries,
+                                 reconcile)
+    accounts_config = read_accounts(accounts)
+
+    with ExitStack() as stack:
+        migrations = [stack.enter_context(get_account_migration(accounts_config[name], app_config,
+                                                                application_limiter, workers, options))
+                      for name in accounts_config.sections()]
+        run_migrations(migrations, workers, application_limiter, options.daemon,
+                       app_config.get(SYSTEM, LOG_LEVEL, fallback=FALLBACK_LOG_LEVEL))
+
+
+if __name__ == '__main__':
+    fire.Fire(batch_upload)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+=================
+Benchmark of the migration. It generates a synthetic export and runs the
+analyzer and the uploader against a local stand-in of the Strava API, so the
+throughput can be measured without using the real quota.
+"""
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import fire
+from loguru import logger
+
+from benchmarks.export_generator import generate_export
+from benchmarks.mock_strava import MockStravaServer
+from benchmarks.runner import create_sandbox, run_in_sandbox, benchmark_analyzer, benchmark_upload
+from utils.activity_index import ActivityIndex
+from utils.config_handler import init_app
+from utils.constants import CONFIG_FILE_PATH
+from utils.duplicates import compute_fingerprint
+from utils.parameters import SYSTEM, PATH
+
+
+def get_existing_activities(export_path: str, existing_ratio: float) -> List[Tuple[float, float]]:
+    """ Chooses the workouts of the export that the mock athlete already has
+    in Strava, evenly spread over the export. The export is listed without
+    the cache of the application, so nothing is written outside the sandbox.
+
+    Args:
+        export_path (str): path to the synthetic export.
+        existing_ratio (float): ratio of the workouts already in Strava.
+
+    Returns:
+        list: start time and elapsed seconds of the existing activities.
+    """
+    if existing_ratio <= 0:
+        return list()
+    step = max(round(1 / existing_ratio), 1)
+    fingerprints = [compute_fingerprint(export_path, activity)
+                    for activity in list(ActivityIndex(export_path))[::step]]
+    return [(fingerprint['start_time'], fingerprint['duration_s'] or 0) for fingerprint in fingerprints
+            if fingerprint['start_time'] is not None]
+
+
+def run_benchmarks(activities: int = 200,
+                   min_points: int = 600,
+                   max_points: int = 3600,
+                   archive: bool = False,
+                   workers: int = None,
+                   latency: float = 0.05,
+                   processing_time: float = 0,
+                   compress: bool = False,
+                   simplify_tolerance: float = 0,
+                   fit: bool = False,
+                   preflight: bool = False,
+                   existing_ratio: float = 0,
+                   poll_uploads: bool = True,
+                   config: str = CONFIG_FILE_PATH,
+                   keep: bool = False):
+    """ Runs the benchmarks and saves the results in `benchmark_results.json`
+    inside the log folder. The export, the caches and the state of the runs
+    are created in a temporal folder.
+
+    Args:
+        activities (int): number of synthetic workouts.
+        min_points (int): minimum number of points of a workout.
+        max_points (int): maximum number of points of a workout.
+        archive (bool): generate the export as a ZIP archive.
+        workers (int): number of processes of the analyzer and uploads in
+         flight of the uploader. By default, the ones of each script.
+        latency (float): seconds added by the mock server to every request.
+        processing_time (float): seconds the mock server takes to process an upload.
+        compress (bool): upload the TCX files compressed.
+        simplify_tolerance (float): distance tolerance in meters to simplify the
+         tracks, 0 to upload them complete.
+        fit (bool): convert the workouts to FIT before uploading them.
+        preflight (bool): validate the workouts before uploading them.
+        existing_ratio (float): ratio of the workouts that the athlete already
+         has in Strava. If it is set, the export is reconciled with them
+         before uploading it.
+        poll_uploads (bool): check the status of the uploads.
+        config (str): path to the configuration file, only used for the logs.
+        keep (bool): keep the temporal folder for inspection.
+    """
+    app_config = init_app(config)
+    sandbox = tempfile.mkdtemp(prefix='strava_benchmark_')
+    results = {'parameters': {'activities': activities, 'min_points': min_points, 'max_points': max_points,
+                              'archive': archive, 'workers': workers, 'latency': latency,
+                              'processing_time': processing_time, 'compress': compress,
+                              'simplify_tolerance': simplify_tolerance, 'fit': fit,
+                              'preflight': preflight, 'existing_ratio': existing_ratio,
+                              'poll_uploads': poll_uploads}}
+
+    try:
+        export_path = str(Path(sandbox, 'export.zip' if archive else 'Workouts'))
+        start = time.perf_counter()
+        generate_export(export_path, activities, min_points, max_points, archive=archive)
+        results['generation_seconds'] = time.perf_counter() - start
+
+        sandbox_config = create_sandbox(sandbox, export_path, {'compress': compress,
+                                                               'simplify_tolerance': simplify_tolerance,
+                                                               'fit': fit,
+                                                               'preflight': preflight,
+                                                               'reconcile': existing_ratio > 0,
+                                                               'poll_uploads': poll_uploads})
+
+        logger.info('Running the analyzer benchmark.')
+        results['analyzer'] = run_in_sandbox(benchmark_analyzer, sandbox, config=sandbox_config, workers=workers)
+
+        logger.info('Running the upload benchmark.')
+        existing_activities = get_existing_activities(export_path, existing_ratio)
+        with MockStravaServer(latency=latency, processing_time=processing_time,
+                              existing_activities=existing_activities) as server:
+            results['upload'] = run_in_sandbox(benchmark_upload, sandbox, config=sandbox_config,
+                                               server_url=server.url, workers=workers)
+            results['upload']['server'] = dict(server.stats)
+    finally:
+        if keep:
+            logger.info('The benchmark files are kept in `{}`.', sandbox)
+        else:
+            shutil.rmtree(sandbox, ignore_errors=True)
+
+    for name in ('analyzer', 'upload'):
+        if 'error' in results[name]:
+            logger.error('The {} benchmark failed: {}', name, results[name]['error'])
+    analyzer, upload = results['analyzer'], results['upload']
+    if 'cold' in analyzer:
+        logger.info('Analyzer: {:.1f} activities/s without cache, {:.1f} activities/s with cache. '
+                    'Peak memory: {:.1f} MB.', analyzer['cold']['activities_per_second'],
+                    analyzer['warm']['activities_per_second'], analyzer['peak_rss_mb'] or 0)
+    if 'stages' in upload:
+        logger.info('Upload: {:.1f} activities/s submitted, {:.1f} activities/s processed. '
+                    'Peak memory: {:.1f} MB.', upload['submitted_per_second'] or 0,
+                    upload['activities_per_second'] or 0, upload['peak_rss_mb'] or 0)
+        for stage, stats in upload['stages'].items():
+            logger.info('- {}: {} calls, {:.3f} s mean, {:.3f} s total.', stage, stats['calls'],
+                        stats['mean_seconds'], stats['seconds'])
+
+    file_path = f'{app_config.get(SYSTEM, PATH)}/benchmark_results.json'
+    with open(file_path, 'w') as file:
+        logger.info('Saving the benchmark results in `{}`', file_path)
+        json.dump(results, file, indent=4)
+
+
+if __name__ == '__main__':
+    fire.Fire(run_benchmarks)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/export_generator.py
+=================
+Generator of synthetic Endomondo exports. Each workout is written as a pair of
+JSON and TCX files with the same format as the real export, so the whole
+migration can be measured without personal data.
+"""
+import json
+import math
+import random
+import zipfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from utils.files_handler import check_folder
+
+# Relative frequency of each sport and its speed in km/h, None for the indoor ones
+DEFAULT_SPORTS = {
+    'RUNNING': (0.45, 11),
+    'CYCLING_SPORT': (0.2, 25),
+    'WALKING': (0.15, 5),
+    'MOUNTAIN_BIKING': (0.05, 15),
+    'TREADMILL_RUNNING': (0.05, None),
+    'WEIGHT_TRAINING': (0.05, None),
+    'SWIMMING': (0.05, None)
+}
+START_POSITION = (40.4168, -3.7038)
+JSON_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.0'
+POINT_TIME_FORMAT = '%a %b %d %H:%M:%S UTC %Y'
+TCX_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+METERS_PER_DEGREE = 111320
+
+TCX_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+             '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" ' \
+             'xmlns:ns2="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n' \
+             '<Activities><Activity Sport="{sport}"><Id>{start}</Id>' \
+             '<Lap StartTime="{start}"><TotalTimeSeconds>{duration}</TotalTimeSeconds>' \
+             '<DistanceMeters>{distance:.1f}</DistanceMeters><Track>\n'
+TCX_FOOTER = '</Track></Lap></Activity></Activities></TrainingCenterDatabase>\n'
+
+
+def generate_track(rng: random.Random,
+                   start_time: datetime,
+                   points_number: int,
+                   interval: int,
+                   speed: Optional[float]) -> List[Dict]:
+    """ Generates the points of a workout as a random walk. The indoor workouts
+    have no position.
+
+    Args:
+        rng (Random): random generator.
+        start_time (datetime): start time of the workout.
+        points_number (int): number of points.
+        interval (int): seconds between points.
+        speed (float): speed in km/h, None for the indoor workouts.
+
+    Returns:
+        list(dict): points with time, position, altitude, distance in
+        kilometers and heart rate.
+    """
+    latitude, longitude = START_POSITION
+    latitude += rng.uniform(-0.05, 0.05)
+    longitude += rng.uniform(-0.05, 0.05)
+    heading = rng.uniform(0, 2 * math.pi)
+    altitude = rng.uniform(0, 800)
+    distance = 0.0
+
+    points = list()
+    for index in range(points_number):
+        point = {
+            'time': start_time + timedelta(seconds=index * interval),
+            'heart_rate': int(rng.gauss(140, 12)),
+        }
+        if speed is not None:
+            step = speed / 3.6 * interval * rng.uniform(0.8, 1.2)
+            heading += rng.gauss(0, 0.3)
+            latitude += step * math.cos(heading) / METERS_PER_DEGREE
+            longitude += step * math.sin(heading) / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+            altitude += rng.gauss(0, 0.5)
+            distance += step / 1000
+            point.update(latitude=latitude, longitude=longitude, altitude=altitude, distance_km=distance)
+        points.append(point)
+
+    return points
+
+
+def to_json(sport: str, points: List[Dict], interval: int) -> str:
+    """ Writes the workout with the format of the Endomondo JSON, a list of
+    single key dictionaries with the points as last field.
+    """
+    start_time = points[0]['time']
+    duration = len(points) * interval
+    distance = points[-1].get('distance_km', 0)
+    json_points = list()
+    for point in points:
+        json_point = list()
+        if 'latitude' in point:
+            json_point.append({'location': [[{'latitude': point['latitude']},
+                                             {'longitude': point['longitude']}]]})
+            json_point.append({'distance_km': round(point['distance_km'], 4)})
+            json_point.append({'altitude': round(point['altitude'], 1)})
+        json_point.append({'timestamp': point['time'].strftime(POINT_TIME_FORMAT)})
+        json_point.append({'heart_rate_bpm': point['heart_rate']})
+        json_points.append(json_point)
+
+    return json.dumps([
+        {'name': 'Synthetic workout'},
+        {'sport': sport},
+        {'source': 'benchmark'},
+        {'created_date': start_time.strftime(JSON_TIME_FORMAT)},
+        {'start_time': start_time.strftime(JSON_TIME_FORMAT)},
+        {'end_time': (start_time + timedelta(seconds=duration)).strftime(JSON_TIME_FORMAT)},
+        {'duration_s': duration},
+        {'distance_km': round(distance, 3)},
+        {'calories_kcal': round(duration / 60 * 10, 1)},
+        {'heart_rate_avg_bpm': sum(point['heart_rate'] for point in points) // len(points)},
+        {'points': json_points}
+    ])
+
+
+def to_tcx(sport: str, points: List[Dict], interval: int) -> str:
+    """ Writes the workout with the format of the Endomondo TCX. """
+    lines = [TCX_HEADER.format(sport='Running' if sport == 'RUNNING' else 'Other',
+                               start=points[0]['time'].strftime(TCX_TIME_FORMAT),
+                               duration=len(points) * interval,
+                               distance=points[-1].get('distance_km', 0) * 1000)]
+    for point in points:
+        lines.append(f'<Trackpoint><Time>{point["time"].strftime(TCX_TIME_FORMAT)}</Time>')
+        if 'latitude' in point:
+            lines.append(f'<Position><LatitudeDegrees>{point["latitude"]:.6f}</LatitudeDegrees>'
+                         f'<LongitudeDegrees>{point["longitude"]:.6f}</LongitudeDegrees></Position>'
+                         f'<AltitudeMeters>{point["altitude"]:.1f}</AltitudeMeters>'
+                         f'<DistanceMeters>{point["distance_km"] * 1000:.1f}</DistanceMeters>')
+        lines.append(f'<HeartRateBpm><Value>{point["heart_rate"]}</Value></HeartRateBpm></Trackpoint>\n')
+    lines.append(TCX_FOOTER)
+    return ''.join(lines)
+
+
+def _choose_sport(rng: random.Random, sports: Dict[str, Tuple[float, Optional[float]]]) -> str:
+    """ Selects a sport according to their frequency. """
+    names = list(sports)
+    return rng.choices(names, weights=[sports[name][0] for name in names])[0]
+
+
+def generate_export(path: str,
+                    activities: int = 100,
+                    min_points: int = 600,
+                    max_points: int = 3600,
+                    interval: int = 1,
+                    sports: Optional[Dict[str, Tuple[float, Optional[float]]]] = None,
+                    archive: bool = False,
+                    seed: int = 0) -> str:
+    """ Generates a synthetic export. The workouts are named with their start
+    time, as in the real export, one every day going back from today.
+
+    Args:
+        path (str): folder where the workouts are written. If `archive` is set,
+         path of the ZIP file.
+        activities (int): number of workouts.
+        min_points (int): minimum number of points of a workout.
+        max_points (int): maximum number of points of a workout.
+        interval (int): seconds between points.
+        sports (dict): frequency and speed in km/h of each sport. By default,
+         `DEFAULT_SPORTS`.
+        archive (bool): write the export as a ZIP archive with the workouts
+         in the `Workouts` folder.
+        seed (int): seed of the random generator, so the export is reproducible.
+
+    Returns:
+        str: path to the export.
+    """
+    rng = random.Random(seed)
+    sports = sports or DEFAULT_SPORTS
+    last_start = datetime.now(timezone.utc).replace(hour=8, minute=0, second=0, microsecond=0, tzinfo=None)
+
+    zip_file = None
+    if archive:
+        check_folder(Path(path).parent)
+        zip_file = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+    else:
+        check_folder(path)
+
+    logger.info('Generating {} synthetic workouts in `{}`.', activities, path)
+    try:
+        for index in range(activities):
+            start_time = last_start - timedelta(days=index, minutes=rng.randint(0, 600))
+            sport = _choose_sport(rng, sports)
+            points = generate_track(rng, start_time, rng.randint(min_points, max_points),
+                                    interval, sports[sport][1])
+            name = start_time.strftime(JSON_TIME_FORMAT)
+            files = {f'{name}.json': to_json(sport, points, interval), f'{name}.tcx': to_tcx(sport, points, interval)}
+            for file_name, content in files.items():
+                if zip_file:
+                    zip_file.writestr(f'Workouts/{file_name}', content)
+                else:
+                    Path(path, file_name).write_text(content, encoding='utf-8')
+    finally:
+        if zip_file:
+            zip_file.close()
+
+    return str(path)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/mock_strava.py
+=================
+Local stand-in of the Strava API for the benchmarks. It answers the uploads
+and the upload status requests, reports the rate limit usage in the headers
+as Strava does and adds a configurable latency to every request. It also
+lists the activities that the athlete already has, to reconcile the export.
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+from loguru import logger
+
+from utils.strava import StravaSession
+
+STRAVA_URL = 'https://www.strava.com'
+UPLOAD_STATUS_PATH = re.compile(r'^/api/v3/uploads/(\d+)$')
+ACTIVITIES_PATH = '/api/v3/athlete/activities'
+SHORT_WINDOW = 15 * 60
+LONG_WINDOW = 24 * 60 * 60
+
+
+class MockStravaServer:
+    """ HTTP server that mimics the upload endpoints of the Strava API.
+
+    The uploads are processed after `processing_time` seconds. Until then, the
+    status requests answer that the activity is still being processed. The
+    requests over the limits are answered with a 429, as Strava does.
+    """
+
+    def __init__(self,
+                 latency: float = 0.05,
+                 processing_time: float = 0,
+                 short_limit: int = 100000,
+                 long_limit: int = 1000000,
+                 duplicate_ratio: float = 0,
+                 existing_activities: Optional[List[Tuple[float, float]]] = None,
+                 read_permission: bool = True):
+        """
+        Args:
+            latency (float): seconds added to every request.
+            processing_time (float): seconds until an upload is processed.
+            short_limit (int): requests allowed every 15 minutes.
+            long_limit (int): requests allowed per day.
+            duplicate_ratio (float): ratio of uploads rejected as duplicates.
+            existing_activities (list): start time and elapsed seconds of the
+             activities that the athlete already has.
+            read_permission (bool): if the athlete granted the permission to
+             read the activities. Otherwise, they cannot be listed.
+        """
+        self.latency = latency
+        self.processing_time = processing_time
+        self.short_limit = short_limit
+        self.long_limit = long_limit
+        self.duplicate_ratio = duplicate_ratio
+        self.existing_activities = sorted(existing_activities or [], reverse=True)
+        self.read_permission = read_permission
+        self.stats = {'uploads': 0, 'status_checks': 0, 'activity_lists': 0, 'rate_limited': 0,
+                      'bytes_received': 0}
+        self._uploads: Dict[int, Tuple[float, bool]] = dict()
+        self._upload_ids = itertools.count(1)
+        self._requests = list()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._get_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-strava', daemon=True)
+
+    @property
+    def url(self) -> str:
+        """ Base URL of the server. """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self) -> 'MockStravaServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """ Starts serving in a background thread. """
+        self._thread.start()
+        logger.debug('Mock Strava server listening in {}.', self.url)
+
+    def stop(self) -> None:
+        """ Stops the server. """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count_request(self) -> Tuple[bool, str]:
+        """ Registers a request in the rate limit windows.
+
+        Returns:
+            bool, str: if the request is within the limits and the value of
+            the usage header.
+        """
+        # The windows reset at the natural quarters of the hour and at midnight UTC
+        now = time.time()
+        short_start, long_start = now - now % SHORT_WINDOW, now - now % LONG_WINDOW
+        with self._lock:
+            self._requests = [request for request in self._requests if request >= long_start]
+            short_usage = sum(1 for request in self._requests if request >= short_start)
+            long_usage = len(self._requests)
+            allowed = short_usage < self.short_limit and long_usage < self.long_limit
+            if allowed:
+                self._requests.append(now)
+                short_usage += 1
+                long_usage += 1
+            else:
+                self.stats['rate_limited'] += 1
+        return allowed, f'{short_usage},{long_usage}'
+
+    def _submit(self, size: int) -> Dict[str, Any]:
+        """ Registers a new upload. """
+        with self._lock:
+            upload_id = next(self._upload_ids)
+            self.stats['uploads'] += 1
+            self.stats['bytes_received'] += size
+            duplicate = self.duplicate_ratio > 0 and upload_id % round(1 / self.duplicate_ratio) == 0
+            self._uploads[upload_id] = (time.time(), duplicate)
+        return self._get_status(upload_id)
+
+    def _get_status(self, upload_id: int) -> Optional[Dict[str, Any]]:
+        """ Obtains the status of an upload, None if it does not exist. """
+        with self._lock:
+            if upload_id not in self._uploads:
+                return None
+            submitted_at, duplicate = self._uploads[upload_id]
+
+        status = {'id': upload_id, 'id_str': str(upload_id), 'external_id': None,
+                  'error': None, 'status': 'Your activity is still being processed.', 'activity_id': None}
+        if time.time() - submitted_at >= self.processing_time:
+            if duplicate:
+                status.update(error=f'activity.tcx duplicate of activity {upload_id}',
+                              status='There was an error processing your activity.')
+            else:
+                status.update(status='Your activity is ready.', activity_id=upload_id)
+        return status
+
+    def _list_activities(self, query: str) -> List[Dict[str, Any]]:
+        """ Lists a page of the existing activities between the dates of
+        the query, from the most recent one.
+        """
+        parameters = {key: values[0] for key, values in parse_qs(query).items()}
+        after, before = float(parameters.get('after', 0)), float(parameters.get('before', 'inf'))
+        page, per_page = int(parameters.get('page', 1)), int(parameters.get('per_page', 30))
+        with self._lock:
+            self.stats['activity_lists'] += 1
+        activities = [(activity_id, start_time, elapsed_time) for activity_id, (start_time, elapsed_time)
+                      in enumerate(self.existing_activities, 1) if after < start_time < before]
+        return [{'id': activity_id, 'elapsed_time': elapsed_time,
+                 'start_date': datetime.fromtimestamp(start_time, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+                for activity_id, start_time, elapsed_time in activities[(page - 1) * per_page:page * per_page]]
+
+    def _get_handler(self):
+        """ Creates the request handler bound to this server. """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _answer(self, code: int, body: Any, usage: str) -> None:
+                content = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.send_header('X-RateLimit-Limit', f'{server.short_limit},{server.long_limit}')
+                self.send_header('X-RateLimit-Usage', usage)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def _handle(self, method: str) -> None:
+                size = int(self.headers.get('Content-Length') or 0)
+                if size:
+                    self.rfile.read(size)
+                time.sleep(server.latency)
+
+                allowed, usage = server._count_request()
+                if not allowed:
+                    self._answer(429, {'message': 'Rate Limit Exceeded',
+                                       'errors': [{'resource': 'Application', 'field': 'rate limit',
+                                                   'code': 'exceeded'}]}, usage)
+                    return
+
+                url = urlsplit(self.path)
+                status_match = UPLOAD_STATUS_PATH.match(self.path)
+                if method == 'POST' and self.path.split('?')[0] == '/api/v3/uploads':
+                    self._answer(201, server._submit(size), usage)
+                elif method == 'GET' and status_match:
+                    with server._lock:
+                        server.stats['status_checks'] += 1
+                    status = server._get_status(int(status_match.group(1)))
+                    if status is None:
+                        self._answer(404, {'message': 'Record Not Found', 'errors': []}, usage)
+                    else:
+                        self._answer(200, status, usage)
+                elif method == 'GET' and url.path == ACTIVITIES_PATH and not server.read_permission:
+                    self._answer(401, {'message': 'Authorization Error',
+                                       'errors': [{'resource': 'AccessToken', 'field': 'activity:read_permission',
+                                                   'code': 'missing'}]}, usage)
+                elif method == 'GET' and url.path == ACTIVITIES_PATH:
+                    self._answer(200, server._list_activities(url.query), usage)
+                else:
+                    self._answer(404, {'message': 'Record Not Found', 'errors': []}, usage)
+
+            def do_GET(self) -> None:
+                self._handle('GET')
+
+            def do_POST(self) -> None:
+                self._handle('POST')
+
+            def log_message(self, *args) -> None:
+                # Requests are not logged, the benchmarks would measure the console
+                pass
+
+        return Handler
+
+
+class MockStravaSession(StravaSession):
+    """ Session that sends the requests for the Strava API to the mock
+    server. It is passed to the stravalib client, that always builds the URLs
+    with the Strava domain, and keeps the pooling and retries of the real one.
+    """
+
+    def __init__(self, server_url: str, pool_size: int):
+        """
+        Args:
+            server_url (str): base URL of the mock server.
+            pool_size (int): connections kept open.
+        """
+        super().__init__(pool_size)
+        self.server_url = server_url
+
+    def request(self, method: str, url: str, *args, **kwargs) -> requests.Response:
+        if url.startswith(STRAVA_URL):
+            url = self.server_url + url[len(STRAVA_URL):]
+        return super().request(method, url, *args, **kwargs)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/runner.py
+=================
+Execution of the benchmarks. Every benchmark runs in a new process inside a
+sandbox folder, so the caches, the rate limit state and the peak memory of a
+run do not affect the others nor the real configuration.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from configparser import ConfigParser
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available in Windows, the memory is not reported
+    resource = None
+
+from utils.constants import FALLBACK_WORKERS, HTTP_POOL_HEADROOM, PROJECT_PATH_VARIABLE
+from utils.files_handler import check_folder
+from utils.parameters import SYSTEM, STRAVA, ACTIVITIES, UPLOAD, PATH, LOG_LEVEL, CLIENT_ID, SECRET, \
+    MOVE_FILES, SKIP_DUPLICATES
+
+SANDBOX_CONFIG_FILE = 'config/config.ini'
+
+
+class StageTimer:
+    """ Measures the time spent in the functions of the pipeline. The
+    functions are replaced in their module by a wrapper that accumulates the
+    number of calls and the time of each stage, also from several threads.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._stages: Dict[str, Dict[str, float]] = dict()
+        self._lock = threading.Lock()
+
+    def wrap(self, owner: Any, name: str, stage: Optional[str] = None) -> None:
+        """ Replaces the function of the module or class by a timed one.
+
+        Args:
+            owner: module or class containing the function.
+            name (str): name of the function.
+            stage (str): name of the stage in the report. By default, the name
+             of the function.
+        """
+        function = getattr(owner, name)
+        stage = stage or name
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._add(stage, start, time.perf_counter())
+
+        setattr(owner, name, timed)
+
+    def _add(self, stage: str, start: float, end: float) -> None:
+        """ Accumulates a call of the stage. """
+        with self._lock:
+            stats = self._stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                    'last_end': 0.0})
+            stats['calls'] += 1
+            stats['seconds'] += end - start
+            stats['max_seconds'] = max(stats['max_seconds'], end - start)
+            stats['last_end'] = max(stats['last_end'], end - self.start)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """ Returns the calls, total, mean and maximum time of each stage, and
+        when the last call of the stage finished since the timer was created.
+        """
+        with self._lock:
+            return {stage: dict(stats, mean_seconds=stats['seconds'] / stats['calls'])
+                    for stage, stats in self._stages.items()}
+
+
+def get_peak_rss() -> Dict[str, Optional[float]]:
+    """ Obtains the peak resident memory in megabytes of the current process
+    and of the largest of its finished children.
+    """
+    if resource is None:
+        return {'peak_rss_mb': None, 'peak_rss_children_mb': None}
+
+    # Linux reports kilobytes and macOS bytes
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        'peak_rss_children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    }
+
+
+def create_sandbox(sandbox: str, export_path: str, upload_options: Dict[str, Any]) -> str:
+    """ Creates the folders and the configuration of the sandbox. The
+    benchmarks are executed with the sandbox as project folder, so the state
+    of the runs is saved in `<sandbox>/config`.
+
+    Args:
+        sandbox (str): folder of the sandbox.
+        export_path (str): path to the synthetic export.
+        upload_options (dict): options of the upload section.
+
+    Returns:
+        str: path to the configuration file of the sandbox.
+    """
+    config_path = Path(sandbox, SANDBOX_CONFIG_FILE)
+    check_folder(config_path.parent)
+
+    config = ConfigParser()
+    config[SYSTEM] = {LOG_LEVEL: 'INFO', PATH: str(Path(sandbox, 'logs'))}
+    config[STRAVA] = {CLIENT_ID: '0', SECRET: 'benchmark'}
+    config[ACTIVITIES] = {PATH: export_path}
+    config[UPLOAD] = {MOVE_FILES: 'false', SKIP_DUPLICATES: 'false'}
+    config[UPLOAD].update({key: str(value).lower() for key, value in upload_options.items()})
+    with open(config_path, 'w') as file:
+        config.write(file)
+
+    return str(config_path)
+
+
+def _run_in_sandbox(function: Callable, kwargs: Dict[str, Any],
+                    results: multiprocessing.Queue, start_method: str) -> None:
+    """ Entry point of the benchmark process. The pools of the benchmark use
+    the start method of the application, not the one of this process.
+    """
+    multiprocessing.set_start_method(start_method, force=True)
+    try:
+        result = function(**kwargs)
+        result.update(get_peak_rss())
+        results.put(result)
+    except Exception as error:
+        results.put({'error': repr(error)})
+        raise
+
+
+def run_in_sandbox(function: Callable, sandbox: str, **kwargs) -> Dict[str, Any]:
+    """ Executes a benchmark in a new process, started from scratch so its
+    peak memory is not affected by the previous benchmarks.
+
+    Args:
+        function (Callable): benchmark function, returning a dictionary.
+        sandbox (str): folder of the sandbox.
+        kwargs: arguments of the benchmark.
+
+    Returns:
+        dict: results of the benchmark along with the peak memory.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_in_sandbox,
+                              args=(function, kwargs, results, multiprocessing.get_start_method()))
+    # The new process resolves the project folder from the environment when importing the constants
+    previous_path = os.environ.get(PROJECT_PATH_VARIABLE)
+    os.environ[PROJECT_PATH_VARIABLE] = sandbox
+    try:
+        process.start()
+    finally:
+        if previous_path is None:
+            del os.environ[PROJECT_PATH_VARIABLE]
+        else:
+            os.environ[PROJECT_PATH_VARIABLE] = previous_path
+    result = results.get()
+    process.join()
+    return result
+
+
+def benchmark_analyzer(config: str, workers: Optional[int] = None) -> Dict[str, Any]:
+    """ Measures the analyzer of activity types, first without cache and then
+    with the cache of the first execution.
+
+    Args:
+        config (str): path to the configuration file of the sandbox.
+        workers (int): number of processes of the analyzer.
+
+    Returns:
+        dict: duration and activities per second of both executions.
+    """
+    from endomondo_analyzer import analyze_activity_types
+    from utils.files_handler import get_activity_files_names, retrieve_activities_path
+    from utils.config_handler import init_app
+
+    app_config = init_app(config)
+    start = time.perf_counter()
+    activities = len(get_activity_files_names(retrieve_activities_path(None, app_config)))
+    results = {'activities': activities, 'discovery_seconds': time.perf_counter() - start}
+
+    for run in ('cold', 'warm'):
+        start = time.perf_counter()
+        analyze_activity_types(config=config, workers=workers)
+        seconds = time.perf_counter() - start
+        results[run] = {'seconds': seconds, 'activities_per_second': activities / seconds}
+
+    return results
+
+
+def benchmark_upload(config: str, server_url: str, workers: Optional[int] = None) -> Dict[str, Any]:
+    """ Measures the uploader against the mock server. The Strava client is
+    replaced by one whose requests go to the mock server, and every stage of
+    the upload is timed.
+
+    Args:
+        config (str): path to the configuration file of the sandbox.
+        server_url (str): URL of the mock Strava server.
+        workers (int): number of uploads in flight.
+
+    Returns:
+        dict: duration, activities per second and time of each stage.
+    """
+    from stravalib import Client
+
+    import upload_to_strava
+    from benchmarks.mock_strava import MockStravaSession
+    from utils.upload_poller import UploadPoller
+
+    def get_mock_client(app_config, rate_limiter=None, concurrency=FALLBACK_WORKERS, token_path=None) -> Client:
+        return Client(access_token='benchmark', rate_limiter=rate_limiter,
+                      requests_session=MockStravaSession(server_url, concurrency + HTTP_POOL_HEADROOM))
+
+    upload_to_strava.get_strava_client = get_mock_client
+    timer = StageTimer()
+    # The FIT conversion runs in other processes, it is reported in the metrics of the run
+    for name in ('get_activity_index', 'retrieve_json_header', 'simplify_activity',
+                 'compress_activity', 'upload_activity'):
+        timer.wrap(upload_to_strava, name)
+    timer.wrap(UploadPoller, '_check', 'status_check')
+
+    upload_to_strava.upload(config=config, workers=workers)
+    seconds = time.perf_counter() - timer.start
+    stages = timer.report()
+
+    activities = stages.get('upload_activity', {}).get('calls', 0)
+    submission_seconds = stages.get('upload_activity', {}).get('last_end', seconds)
+    return {
+        'activities': activities,
+        'seconds': seconds,
+        'activities_per_second': activities / seconds if seconds else None,
+        'submitted_per_second': activities / submission_seconds if submission_seconds else None,
+        'stages': stages
+    }
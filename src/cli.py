@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+cli.py
+=================
+Single entry point of the migrator, with a subcommand for every script. Only
+the module of the command executed is imported, so the commands that do not
+use the Strava API, such as `plan` or `stats`, start without loading it. The
+configuration is found from the location of the sources, so the commands can
+be run from any folder, for instance `python src/cli.py upload --daemon`.
+"""
+import sys
+from importlib import import_module
+from typing import List, Optional
+
+# Module, function and description of every command
+COMMANDS = {
+    'auth': ('request_auth', 'request_code_id', 'Authorizes the application to upload to the Strava account.'),
+    'analyze': ('endomondo_analyzer', 'analyze_activity_types', 'Counts the activity types of the export.'),
+    'check': ('validate_export', 'validate_export', 'Finds the workouts that Strava would reject.'),
+    'stats': ('export_statistics', 'compute_statistics', 'Computes the totals of the export per sport and year.'),
+    'plan': ('migration_plan', 'plan', 'Estimates the duration of the migration with the rate limits.'),
+    'upload': ('upload_to_strava', 'upload', 'Uploads the workouts of the export to Strava.'),
+    'batch': ('batch_upload', 'batch_upload', 'Uploads the exports of several athletes.'),
+    'benchmark': ('benchmark', 'run_benchmarks', 'Measures the throughput against a local mock of Strava.')
+}
+HELP_FLAGS = ('-h', '--help', 'help')
+
+
+def print_usage() -> None:
+    """ Prints the available commands. """
+    print('Usage: cli.py COMMAND [ARGUMENTS]\n\nCommands:')
+    for command, (_, _, description) in COMMANDS.items():
+        print(f'  {command:<10} {description}')
+    print('\nRun `cli.py COMMAND --help` to see the arguments of a command.')
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """ Runs the command given in the arguments with Fire, as the scripts do
+    when executed on their own.
+
+    Args:
+        argv (list): command and its arguments. By default, the ones of the
+         command line.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in HELP_FLAGS:
+        print_usage()
+        return
+    if argv[0] not in COMMANDS:
+        print(f'Unknown command `{argv[0]}`.\n', file=sys.stderr)
+        print_usage()
+        sys.exit(2)
+
+    import fire
+
+    module_name, function_name, _ = COMMANDS[argv[0]]
+    function = getattr(import_module(module_name), function_name)
+    fire.Fire(function, command=argv[1:], name=argv[0])
+
+
+if __name__ == '__main__':
+    main()
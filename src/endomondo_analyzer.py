@@ -1,54 +1,142 @@
 # -*- coding: utf-8 -*-
 """
-upload_to_strava.py
+endomondo_analyzer.py
 =================
-Main class of the application. This file is the one executed to upload the
-endomondo activities to strava from the export folder.
+Analyzer of the Endomondo export. This file is executed to count the types of
+the activities of the export, to check how they will be mapped to Strava.
 """
 import json
+import os
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 import fire
 from loguru import logger
 from tqdm import tqdm
 
-from parsers.endomondo import retrieve_json_data, get_activity_type
+from parsers.endomondo import retrieve_json_header, get_activity_type
 from utils.config_handler import init_app
-from utils.files_handler import retrieve_activities_path, get_activity_files_names
+from utils.constants import CONFIG_PATH, CONFIG_FILE_PATH, ANALYZER_CACHE_FILE_NAME, ANALYZER_CHUNKS_PER_WORKER
+from utils.file_cache import FileCache
+from utils.files_handler import retrieve_activities_path, get_activity_files_names, check_folder, \
+    get_activity_file_path, get_activity_file_signature
+from utils.metrics import metrics, reset_worker_metrics
 from utils.parameters import SYSTEM, PATH
 
 
+def count_activity_types(activities_folder: str,
+                         activities: List[Tuple[str, Dict]]
+                         ) -> Tuple[Counter, List[Tuple[str, Dict, Optional[str]]], Dict]:
+    """ Obtains the activity type of a group of workouts. It is executed in
+    the workers of the process pool, so the metrics of the worker are returned
+    to be merged in the main process. The workouts that cannot be read are
+    counted as invalid without stopping the rest.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activities (list): name of the workouts along with the signature of
+         their JSON file for the cache.
+
+    Returns:
+        Counter, list, dict: number of times each activity type was found, the
+        type of every workout, to be added to the cache, None for the invalid
+        ones, and the metrics.
+    """
+    activity_types = Counter()
+    results = list()
+    for activity, signature in activities:
+        try:
+            with metrics.time('read_header_seconds'):
+                activity_data = retrieve_json_header(activities_folder, activity)
+                activity_type = get_activity_type(activity_data)
+        except (OSError, AttributeError, ValueError) as error:
+            logger.warning('The activity `{}` could not be read: {}', activity, error)
+            metrics.increment('invalid_files')
+            activity_type = None
+        else:
+            activity_types[activity_type] += 1
+        results.append((activity, signature, activity_type))
+
+    return activity_types, results, metrics.pop()
+
+
 def analyze_activity_types(path: str = None,
-                           config: str = '../config/config.ini'):
+                           config: str = CONFIG_FILE_PATH,
+                           workers: int = None):
     """ This method generates a file with the type of activities and the number
     of times that have been performed.
 
+    The workouts are read in a pool of processes and their type is saved in a
+    cache, so the next executions only read the new or modified workouts. The
+    invalid workouts are not cached, so they are read again once fixed.
+
     Args:
-        path (str): path to the folder containing the activities.
+        path (str): path to the folder containing the activities or to the
+         ZIP archive of the export.
         config (str): path to the configuration file.
+        workers (int): number of processes. By default, the number of CPUs.
     """
     app_config = init_app(config)
     activities_folder = retrieve_activities_path(path, app_config)
 
-    activity_files = get_activity_files_names(activities_folder)
+    with metrics.time('list_files_seconds'):
+        activity_files = get_activity_files_names(activities_folder)
+
+    cache = FileCache(Path(check_folder(CONFIG_PATH), ANALYZER_CACHE_FILE_NAME))
+    activities_found = Counter()
+    pending_activities = list()
+
+    for activity in activity_files:
+        file_path = get_activity_file_path(activities_folder, activity, 'json')
+        signature = get_activity_file_signature(activities_folder, activity, 'json')
+        activity_type = cache.get(file_path, signature)
+        if activity_type is None:
+            pending_activities.append((activity, signature))
+        else:
+            activities_found[activity_type] += 1
+
+    logger.info('{} activities found in the cache. Reading {} activities.',
+                len(activity_files) - len(pending_activities), len(pending_activities))
+    metrics.increment('cache_hits', len(activity_files) - len(pending_activities))
+    metrics.increment('cache_misses', len(pending_activities))
 
-    activities_found = list()
+    invalid_number = 0
+    if pending_activities:
+        workers = workers or os.cpu_count() or 1
+        chunks_number = workers * ANALYZER_CHUNKS_PER_WORKER
+        chunks = [pending_activities[index::chunks_number] for index in range(chunks_number)]
 
-    for activity in tqdm(activity_files):
-        # Load json first to obtain the data that will be sent along the tcx
-        activity_data = retrieve_json_data(activities_folder, activity)
-        activity_type = get_activity_type(activity_data)
-        activities_found.append(activity_type)
+        # The types read are cached even if the analysis is interrupted
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=reset_worker_metrics) as executor:
+                futures = [executor.submit(count_activity_types, activities_folder, chunk)
+                           for chunk in chunks if chunk]
+                with tqdm(total=len(pending_activities)) as progress_bar:
+                    for future in as_completed(futures):
+                        # Merge the counter of the worker and save the types in the cache
+                        activity_types, results, worker_metrics = future.result()
+                        activities_found.update(activity_types)
+                        metrics.merge(worker_metrics)
+                        for activity, signature, activity_type in results:
+                            if activity_type is None:
+                                invalid_number += 1
+                                continue
+                            cache.set(get_activity_file_path(activities_folder, activity, 'json'),
+                                      activity_type, signature)
+                        progress_bar.update(len(results))
+        finally:
+            cache.save()
 
-    # Extract the unique values and the number of times that are found
-    unique_activities = list(Counter(activities_found).keys())
-    number_unique_activities = list(Counter(activities_found).values())
-    unique_activities_number = dict(zip(unique_activities, number_unique_activities))
+    if invalid_number:
+        logger.warning('{} activities could not be read and were not counted.', invalid_number)
 
     file_path = f'{app_config.get(SYSTEM, PATH)}/unique_activities_number.json'
     with open(file_path, 'w') as file:
         logger.info('Saving file with the number of activities in `{}`', file_path)
-        json.dump(unique_activities_number, file, indent=4)
+        json.dump(dict(activities_found), file, indent=4)
+    metrics.save()
 
 
 if __name__ == '__main__':
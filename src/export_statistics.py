@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+export_statistics.py
+=================
+Computes the totals of the export before migrating it: distance, moving time,
+elevation gain and time in every heart rate zone per sport and year. The
+export is converted once into a columnar workout store, so later analyses
+only read the new or modified workouts.
+"""
+import json
+from typing import Any, Dict, List
+
+import fire
+from loguru import logger
+
+from utils.config_handler import init_app
+from utils.constants import CONFIG_FILE_PATH, WORKOUT_STORE_FILE_NAME, STATISTICS_FILE_NAME, FALLBACK_MAX_HEART_RATE
+from utils.files_handler import retrieve_activities_path, get_activity_index, get_export_file_path
+from utils.metrics import metrics
+from utils.parameters import SYSTEM, PATH, ACTIVITIES, MAX_HEART_RATE
+from utils.workout_stats import compute_workout_stats, aggregate_stats
+from utils.workout_store import WorkoutStore
+
+
+def compute_statistics(path: str = None,
+                       config: str = CONFIG_FILE_PATH,
+                       workers: int = None,
+                       max_heart_rate: float = None) -> List[Dict[str, Any]]:
+    """ Generates a file with the statistics of the workouts per sport and
+    year. The workouts are read into the workout store, `workout_store.npz`
+    beside the export, the first time, and the statistics are computed from
+    it with vectorized operations.
+
+    Args:
+        path (str): path to the folder containing the activities or to the
+         ZIP archive of the export.
+        config (str): path to the configuration file.
+        workers (int): number of processes used to read the workouts. By
+         default, the number of CPUs.
+        max_heart_rate (float): maximum heart rate of the athlete, that sets
+         the heart rate zones. By default, the one set in the configuration
+         file.
+
+    Returns:
+        list(dict): statistics per sport and year.
+    """
+    app_config = init_app(config)
+    activities_folder = retrieve_activities_path(path, app_config)
+    if max_heart_rate is None:
+        max_heart_rate = app_config.getfloat(ACTIVITIES, MAX_HEART_RATE, fallback=FALLBACK_MAX_HEART_RATE)
+
+    with metrics.time('list_files_seconds'):
+        activity_index = get_activity_index(activities_folder)
+
+    store = WorkoutStore(get_export_file_path(activities_folder, WORKOUT_STORE_FILE_NAME))
+    with metrics.time('store_update_seconds'):
+        read_number = store.update(activities_folder, activity_index, workers)
+        store.save()
+    logger.info('{} workouts in the store, {} of them read in this execution.', len(store), read_number)
+
+    with metrics.time('statistics_seconds'):
+        statistics = aggregate_stats(store, compute_workout_stats(store, max_heart_rate))
+
+    for row in statistics:
+        logger.info('{year} {sport}: {workouts} workouts, {distance_km} km, {moving_time_h} h moving, '
+                    '{elevation_gain_m} m climbed. Heart rate zones (h): {heart_rate_zones_h}.', **row)
+
+    file_path = f'{app_config.get(SYSTEM, PATH)}/{STATISTICS_FILE_NAME}'
+    with open(file_path, 'w') as file:
+        logger.info('Saving file with the statistics of the workouts in `{}`', file_path)
+        json.dump(statistics, file, indent=4)
+    metrics.save()
+    return statistics
+
+
+if __name__ == '__main__':
+    fire.Fire(compute_statistics)
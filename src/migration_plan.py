@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+migration_plan.py
+=================
+Estimates how long the migration of an export will take with the rate limits
+of the Strava API, from the activities pending in the manifest and the
+current usage of the limits. No request is done to Strava.
+"""
+from pathlib import Path
+from typing import Any, Dict
+
+import fire
+from loguru import logger
+
+from utils.config_handler import init_app
+from utils.constants import CONFIG_PATH, CONFIG_FILE_PATH, RATE_LIMIT_FILE_NAME, MANIFEST_FILE_NAME, FALLBACK_POLL_UPLOADS
+from utils.files_handler import get_activity_index, retrieve_activities_path, check_folder, \
+    get_export_file_path
+from utils.manifest import Manifest
+from utils.parameters import UPLOAD, POLL_UPLOADS
+from utils.planner import get_requests_per_activity, plan_migration
+from utils.rate_limiter import RateLimiter
+
+
+def plan(path: str = None,
+         config: str = CONFIG_FILE_PATH,
+         poll_uploads: bool = None) -> Dict[str, Any]:
+    """ Reports the activities pending to be uploaded, the requests to the
+    Strava API they need, the number of days with uploads and when the
+    migration will finish if it runs without stopping, for instance, with
+    `upload_to_strava.py --daemon`.
+
+    Args:
+        path: path to the folder containing the activities or to the ZIP
+         archive of the export.
+        config: path to the configuration file.
+        poll_uploads: the status of the uploads is checked. By default, the
+         one set in the configuration file.
+
+    Returns:
+        dict: pending activities, requests, days and finish date.
+    """
+    app_config = init_app(config)
+    rate_limiter = RateLimiter(Path(check_folder(CONFIG_PATH), RATE_LIMIT_FILE_NAME))
+    if poll_uploads is None:
+        poll_uploads = app_config.getboolean(UPLOAD, POLL_UPLOADS, fallback=FALLBACK_POLL_UPLOADS)
+
+    activities_folder = retrieve_activities_path(path, app_config)
+    activity_index = get_activity_index(activities_folder)
+    processed_activities, submitted_number, retries_number = set(), 0, 0
+    manifest_path = get_export_file_path(activities_folder, MANIFEST_FILE_NAME)
+    if manifest_path.is_file():
+        with Manifest(manifest_path) as manifest:
+            processed_activities = manifest.get_processed()
+            submitted_number = len(manifest.get_submitted()) if poll_uploads else 0
+            retries_number = len(manifest.get_retries())
+
+    # The failed uploads scheduled to be retried are pending again
+    pending_number = len(activity_index) - sum(1 for activity in processed_activities
+                                               if activity in activity_index) + retries_number
+    # The uploads submitted in previous executions only need their status check
+    requests = pending_number * get_requests_per_activity(poll_uploads) + submitted_number
+    usage = rate_limiter.usage()
+    migration_plan = plan_migration(requests, usage)
+
+    logger.info('{} activities pending and {} uploads to check.', pending_number, submitted_number)
+    logger.info('Rate limit usage. 15 minutes: {short_usage}/{short_limit}. Daily: {long_usage}/{long_limit}.',
+                **usage)
+    logger.info('The migration needs {} requests during {} days and will finish on {}.',
+                migration_plan.requests, migration_plan.days, migration_plan.finish_date)
+    return {
+        'pending_activities': pending_number,
+        'submitted_uploads': submitted_number,
+        'requests': migration_plan.requests,
+        'days': migration_plan.days,
+        'finish_date': migration_plan.finish_date
+    }
+
+
+if __name__ == '__main__':
+    fire.Fire(plan)
@@ -4,29 +4,126 @@ parsers/endomondo.py
 =================
 Utility class to retrieve the data from the Endomondo json.
 """
+import io
 import json
-from typing import Dict, List
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Iterable, Optional, TextIO
 
+import numpy as np
+from dateutil.parser import parse
 from loguru import logger
 
+from utils.files_handler import open_activity_file
+
+HEADER_FIELDS = ('sport', 'start_time', 'distance_km', 'duration_s')
+READ_CHUNK_SIZE = 16 * 1024
+# The points are the last and heaviest field of the workout, nothing useful for the header comes after
+POINTS_FIELD = re.compile(r'\{\s*"points"')
+WHITESPACE = ' \t\n\r,'
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%a %b %d %H:%M:%S UTC %Y')
+
 
 def retrieve_json_data(folder_path: str, file_name: str) -> List[Dict]:
     """ Opens the JSON file from Endomondo and returns the data in a dict.
 
     Args:
-        folder_path (str): path to the workouts folder.
+        folder_path (str): path to the workouts folder or export archive.
         file_name (str): name of the file to open.
 
     Returns:
         activity_data (List[Dict]): list of dictionaries with the information
          of the workout.
     """
-    with open(f'{folder_path}{file_name}.json') as file:
+    with open_activity_file(folder_path, file_name, 'json') as file:
         activity_data = json.load(file)
 
     return activity_data
 
 
+def retrieve_json_header(folder_path: str,
+                         file_name: str,
+                         fields: Iterable[str] = HEADER_FIELDS) -> List[Dict]:
+    """ Opens the JSON file from Endomondo and reads it incrementally until the
+    requested fields are found. The GPS points are not loaded, so it is
+    much faster than `retrieve_json_data` when only the summary is needed.
+
+    Args:
+        folder_path (str): path to the workouts folder or export archive.
+        file_name (str): name of the file to open.
+        fields (list): fields of the workout to search.
+
+    Returns:
+        activity_data (List[Dict]): list of dictionaries with the information
+         of the workout read until all the fields were found, with the same
+         format as `retrieve_json_data`.
+    """
+    with io.TextIOWrapper(open_activity_file(folder_path, file_name, 'json'), encoding='utf-8') as file:
+        activity_data = read_json_header(file, fields)
+
+    return activity_data
+
+
+def read_json_header(file: TextIO, fields: Iterable[str] = HEADER_FIELDS) -> List[Dict]:
+    """ Decodes the elements of the Endomondo workout list one by one, reading
+    the file by chunks, and stops as soon as the fields have been found or the
+    points of the workout are reached.
+
+    Args:
+        file (TextIO): opened JSON file.
+        fields (list): fields of the workout to search.
+
+    Returns:
+        activity_data (List[Dict]): list of dictionaries decoded from the file.
+
+    Raises:
+        JSONDecodeError: if the file is not a valid Endomondo workout.
+    """
+    decoder = json.JSONDecoder()
+    missing_fields = set(fields)
+    activity_data = list()
+
+    buffer = file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise json.JSONDecodeError('The workout is not a list of fields', buffer, 0)
+    position = 1
+    end_of_file = False
+
+    while missing_fields:
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+
+        # An element is only complete if something follows it or the file is over
+        if len(buffer) - position < READ_CHUNK_SIZE and not end_of_file:
+            chunk = file.read(READ_CHUNK_SIZE)
+            end_of_file = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        if position >= len(buffer) or buffer[position] == ']' or POINTS_FIELD.match(buffer, position):
+            break
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if end_of_file:
+                raise
+            # The element is bigger than the buffer
+            chunk = file.read(READ_CHUNK_SIZE)
+            end_of_file = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        activity_data.append(element)
+        if isinstance(element, dict):
+            missing_fields.difference_update(element.keys())
+        position = end
+
+    return activity_data
+
+
 def get_activity_type(activity_data: List[Dict]) -> str:
     """ Retrieves the Endomondo activity type from the JSON data.
 
@@ -50,3 +147,120 @@ def get_activity_type(activity_data: List[Dict]) -> str:
 
     logger.debug('The Endomondo activity type is: {}', activity_type)
     return activity_type
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """ Parses the dates of the Endomondo JSON, that are in UTC, into timestamps.
+
+    Args:
+        value (str): date from the workout, such as `2020-11-21 17:43:14.0` or
+         `Sat Nov 21 17:43:14 UTC 2020`.
+
+    Returns:
+        float: timestamp of the date, None if it could not be parsed.
+    """
+    if not value:
+        return None
+
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+
+    try:
+        date = parse(value)
+    except (ValueError, OverflowError):
+        logger.warning('The date `{}` could not be parsed.', value)
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def get_activity_summary(activity_data: List[Dict]) -> Dict[str, Any]:
+    """ Retrieves the summary of the workout from the JSON data.
+
+    Args:
+        activity_data (list): list of dictionaries with the information of the workout,
+         generated by `parsers.endomondo.retrieve_json_data` or
+         `parsers.endomondo.retrieve_json_header`.
+
+    Returns:
+        dict: sport, start time (as timestamp), duration in seconds and
+        distance in kilometers of the workout. The missing values are None.
+    """
+    fields = dict()
+    for field in activity_data:
+        if isinstance(field, dict):
+            for key, value in field.items():
+                fields.setdefault(key, value)
+
+    return {
+        'sport': fields.get('sport'),
+        'start_time': parse_time(fields.get('start_time')),
+        'duration_s': fields.get('duration_s'),
+        'distance_km': fields.get('distance_km')
+    }
+
+
+def get_activity_points(activity_data: List[Dict]) -> List[Dict[str, Any]]:
+    """ Retrieves the points of the workout from the JSON data. Each point of
+    the export is a list of single key dictionaries, that is merged into one
+    dictionary with the location split into latitude and longitude.
+
+    Args:
+        activity_data (list): list of dictionaries with the information of the workout,
+         generated by `parsers.endomondo.retrieve_json_data`.
+
+    Returns:
+        list(dict): points of the workout, with keys such as `latitude`,
+        `longitude`, `timestamp`, `altitude`, `distance_km` or `heart_rate_bpm`.
+    """
+    raw_points = list()
+    for field in activity_data:
+        if isinstance(field, dict) and 'points' in field:
+            raw_points = field['points'] or list()
+            break
+
+    points = list()
+    for raw_point in raw_points:
+        point = dict()
+        for value in raw_point:
+            point.update(value)
+
+        location = point.pop('location', None)
+        if location:
+            for coordinate in location[0]:
+                point.update(coordinate)
+        points.append(point)
+
+    return points
+
+
+def get_points_arrays(points: list) -> Dict[str, np.ndarray]:
+    """ Converts the points of the Endomondo JSON into arrays, with the same
+    fields and units as `parsers.tcx.get_trackpoints_arrays`.
+
+    Args:
+        points (list): points of the workout, from `get_activity_points`.
+
+    Returns:
+        dict: arrays with the time (as timestamp), latitude, longitude,
+        altitude, distance in meters, heart rate and cadence of the points.
+    """
+    def get_array(key: str, scale: float = 1) -> np.ndarray:
+        values = [point.get(key) for point in points]
+        return np.array([value * scale if isinstance(value, (int, float)) else np.nan for value in values],
+                        dtype=float)
+
+    times = [parse_time(point.get('timestamp')) for point in points]
+    return {
+        'time': np.array([np.nan if value is None else value for value in times], dtype=float),
+        'latitude': get_array('latitude'),
+        'longitude': get_array('longitude'),
+        'altitude': get_array('altitude'),
+        'distance': get_array('distance_km', 1000),
+        'heart_rate': get_array('heart_rate_bpm'),
+        'cadence': get_array('cadence')
+    }
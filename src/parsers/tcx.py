@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+parsers/tcx.py
+=================
+Utility class to retrieve the data from the Endomondo TCX files.
+"""
+from datetime import datetime
+from typing import Dict, IO, List, Optional, Tuple
+from xml.etree import ElementTree
+
+import numpy as np
+from dateutil.parser import isoparse
+
+TCX_NAMESPACE = 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2'
+EXTENSIONS_NAMESPACE = 'http://www.garmin.com/xmlschemas/ActivityExtension/v2'
+NAMESPACES = {'tcx': TCX_NAMESPACE, 'ext': EXTENSIONS_NAMESPACE}
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def read_tcx(file: IO[bytes]) -> ElementTree.ElementTree:
+    """ Parses the TCX file incrementally. The namespaces of the document are
+    registered, so the file can be written again with the same prefixes.
+
+    Args:
+        file (IO[bytes]): opened TCX file.
+
+    Returns:
+        ElementTree: parsed document.
+
+    Raises:
+        ParseError: if the file is not a valid XML.
+    """
+    parser = ElementTree.XMLPullParser(events=('start-ns', 'start'))
+    root = None
+    # Endomondo adds blank lines before the XML declaration
+    chunk = file.read(READ_CHUNK_SIZE).lstrip()
+    while chunk:
+        parser.feed(chunk)
+        for event, value in parser.read_events():
+            if event == 'start-ns':
+                try:
+                    ElementTree.register_namespace(*value)
+                except ValueError:
+                    # Prefixes like `ns3` are reserved, ElementTree generates an equivalent one
+                    pass
+            elif root is None:
+                root = value
+        chunk = file.read(READ_CHUNK_SIZE)
+    parser.close()
+
+    if root is None:
+        raise ElementTree.ParseError('The TCX file is empty.')
+    return ElementTree.ElementTree(root)
+
+
+def get_tracks(tree: ElementTree.ElementTree) -> List[ElementTree.Element]:
+    """ Obtains the tracks of all the laps of the activity, in order. """
+    return tree.getroot().findall('.//tcx:Track', NAMESPACES)
+
+
+def get_trackpoints(tree: ElementTree.ElementTree) -> List[ElementTree.Element]:
+    """ Obtains the trackpoints of all the tracks of the activity, in order. """
+    return [trackpoint for track in get_tracks(tree)
+            for trackpoint in track.findall('tcx:Trackpoint', NAMESPACES)]
+
+
+def _get_float(element: ElementTree.Element, path: str) -> float:
+    """ Obtains the value of the child element as float, NaN if missing. """
+    value = element.findtext(path, namespaces=NAMESPACES)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _get_timestamp(element: ElementTree.Element) -> float:
+    """ Obtains the time of the trackpoint as timestamp, NaN if missing. """
+    value = element.findtext('tcx:Time', namespaces=NAMESPACES)
+    try:
+        return isoparse(value).timestamp()
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def get_trackpoints_arrays(trackpoints: List[ElementTree.Element]) -> Dict[str, np.ndarray]:
+    """ Converts the trackpoints into arrays, one per field. The missing
+    values are set as NaN, so all the arrays are aligned with the trackpoints.
+
+    Args:
+        trackpoints (list): trackpoint elements.
+
+    Returns:
+        dict: arrays with the time (as timestamp), latitude, longitude,
+        altitude, distance, heart rate and cadence of the trackpoints.
+    """
+    return {
+        'time': np.array([_get_timestamp(point) for point in trackpoints], dtype=float),
+        'latitude': np.array([_get_float(point, 'tcx:Position/tcx:LatitudeDegrees')
+                              for point in trackpoints], dtype=float),
+        'longitude': np.array([_get_float(point, 'tcx:Position/tcx:LongitudeDegrees')
+                               for point in trackpoints], dtype=float),
+        'altitude': np.array([_get_float(point, 'tcx:AltitudeMeters') for point in trackpoints], dtype=float),
+        'distance': np.array([_get_float(point, 'tcx:DistanceMeters') for point in trackpoints], dtype=float),
+        'heart_rate': np.array([_get_float(point, 'tcx:HeartRateBpm/tcx:Value')
+                                for point in trackpoints], dtype=float),
+        'cadence': np.array([_get_float(point, 'tcx:Cadence') for point in trackpoints], dtype=float)
+    }
+
+
+def get_start_time(tree: ElementTree.ElementTree) -> datetime:
+    """ Obtains the start time of the activity from its id.
+
+    Raises:
+        ValueError: if the activity has no valid id.
+    """
+    return isoparse(tree.getroot().findtext('.//tcx:Activity/tcx:Id', namespaces=NAMESPACES))
+
+
+def inspect_tcx(file: IO[bytes]) -> Tuple[int, Optional[float]]:
+    """ Counts the trackpoints of the TCX file and obtains its start time
+    without building the document, as each element is discarded once read,
+    so the whole export can be checked quickly.
+
+    Args:
+        file (IO[bytes]): opened TCX file.
+
+    Returns:
+        int, float: number of trackpoints with time and start time of the
+        activity as timestamp, from its id or else from its first trackpoint.
+        None if neither is valid.
+
+    Raises:
+        ParseError: if the file is not a valid XML.
+    """
+    parser = ElementTree.XMLPullParser(events=('end',))
+    activity_id_tag = f'{{{TCX_NAMESPACE}}}Id'
+    track_tag = f'{{{TCX_NAMESPACE}}}Track'
+    trackpoint_tag = f'{{{TCX_NAMESPACE}}}Trackpoint'
+    time_tag = f'{{{TCX_NAMESPACE}}}Time'
+    trackpoints, start_time, first_time, is_empty = 0, None, None, True
+    chunk = file.read(READ_CHUNK_SIZE).lstrip()
+    while chunk:
+        is_empty = False
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            if element.tag == trackpoint_tag:
+                time = element.findtext(time_tag)
+                if time is not None:
+                    trackpoints += 1
+                    first_time = first_time or time
+                element.clear()
+            elif element.tag == track_tag:
+                element.clear()
+            elif element.tag == activity_id_tag and start_time is None:
+                start_time = element.text
+        chunk = file.read(READ_CHUNK_SIZE)
+    parser.close()
+
+    if is_empty:
+        raise ElementTree.ParseError('The TCX file is empty.')
+    for time in (start_time, first_time):
+        try:
+            return trackpoints, isoparse(time).timestamp()
+        except (TypeError, ValueError):
+            continue
+    return trackpoints, None
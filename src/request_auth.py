@@ -1,92 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+request_auth.py
+=================
+Authorizes the application to upload activities to the Strava account. It
+opens the authorization page in the browser, receives the redirection in a
+local server and exchanges the code for the access token at once, so the
+token file is ready for the upload when the command finishes.
+"""
+import secrets
+import threading
 import webbrowser
-from http.server import BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from socketserver import TCPServer
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
 
 import fire
 from loguru import logger
 from stravalib import Client
 
 from utils.config_handler import init_app
-from utils.constants import CONFIG_PATH, FALLBACK_PORT, CODE_ID_FILE_NAME
-from utils.files_handler import check_folder
-from utils.parameters import SYSTEM, PORT
-from utils.strava import get_client_id
+from utils.constants import CONFIG_PATH, CONFIG_FILE_PATH, FALLBACK_PORT, CODE_ID_FILE_NAME, TOKEN_FILE_NAME, \
+    FALLBACK_AUTH_TIMEOUT, AUTH_REQUEST_TIMEOUT, AUTH_CALLBACK_PATH, AUTH_SCOPE, AUTH_READ_SCOPE, READ_SCOPES, \
+    FALLBACK_RECONCILE
+from utils.files_handler import check_folder, get_project_file_path
+from utils.parameters import SYSTEM, PORT, UPLOAD, RECONCILE
+from utils.strava import get_client_id, exchange_code_for_token
+
+
+class AuthServer(ThreadingHTTPServer):
+    """ Local server that receives the redirection of the authorization page.
+    It keeps the code or the error of the first authorization call whose
+    state matches the one sent to Strava. Every request is handled in its own
+    thread, so the connections that the browser opens in advance and leaves
+    idle do not block the redirection.
+    """
+
+    def __init__(self, port: int, state: str):
+        """
+        Args:
+            port (int): port where the redirection is received.
+            state (str): random value sent to Strava along with the
+             authorization request, that it returns in the redirection.
+        """
+        super().__init__(('127.0.0.1', port), StravaAuthHandler)
+        self.lock = threading.Lock()
+        self.state = state
+        self.code_id: Optional[str] = None
+        self.scope: Optional[str] = None
+        self.error: Optional[str] = None
+        self.finished = threading.Event()
+
+    def set_result(self, code_id: Optional[str] = None, scope: Optional[str] = None,
+                   error: Optional[str] = None) -> None:
+        """ Keeps the result of the first authorization call. """
+        with self.lock:
+            if not self.finished.is_set():
+                self.code_id, self.scope, self.error = code_id, scope, error
+                self.finished.set()
 
 
 class StravaAuthHandler(BaseHTTPRequestHandler):
+    # Seconds to wait for a request, the connections opened in advance by the browser are dropped
+    timeout = AUTH_REQUEST_TIMEOUT
+
     def do_GET(self):
         """ Handles the redirection of the authorization page and parses the
-        get request to obtain the code id. The code id is written in the
-        temporary path (`TEMP_SAVE_PATH`) with the name (`CODE_ID_FILE_NAME`)
-        specified in utils/constants.py.
+        query to obtain the code id. The rest of requests, such as the one
+        of the icon of the page, are ignored.
         """
-        path = self.path
-        web_path, parameters = path.split('?')
-        # Parse if is an authorization call
-        if web_path == '/authorization':
-            logger.info('Received authorization call')
-            code_id = None
-
-            # Search for code_id
-            parameters = parameters.split('&')
-            for parameter in parameters:
-                key, value = parameter.split('=')
-                if key == 'code':
-                    code_id = value
-                    logger.info('code_id: {}', code_id)
-                    break
-
-            # If found save
-            if code_id:
-                file_path = Path(check_folder(CONFIG_PATH), CODE_ID_FILE_NAME)
-                with open(file_path, 'w+') as file:
-                    file.write(code_id)
-                    logger.info('Writing received code_id in {}.', CONFIG_PATH)
-                self.send_response(200)
-
-            else:
-                logger.warning('code id not found in the request.')
-                self.send_response(500)
-
-        # Ignore request
+        url = urlsplit(self.path)
+        if url.path != AUTH_CALLBACK_PATH:
+            self._answer(404, 'Not found.')
+            return
+
+        parameters = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if parameters.get('state') != self.server.state:
+            logger.warning('Ignoring an authorization call with an unknown state.')
+            self._answer(400, 'Unknown authorization request.')
+            return
+
+        logger.info('Received authorization call')
+        scopes = parameters.get('scope', '').split(',')
+        error = None
+        if 'error' in parameters:
+            error = f'The authorization was denied: {parameters["error"]}.'
+        elif not parameters.get('code'):
+            error = 'The code id was not found in the authorization call.'
+        elif AUTH_SCOPE not in scopes:
+            error = f'The permission to upload activities (`{AUTH_SCOPE}`) was not granted.'
+
+        if error:
+            self._answer(400, f'{error} Run the authorization again.')
+        else:
+            self._answer(200, 'Authorization received. You can close this tab.')
+        if error is None:
+            self.server.set_result(parameters['code'], parameters.get('scope'))
         else:
-            self.send_response(200)
+            self.server.set_result(error=error)
+
+    def _answer(self, status: int, message: str) -> None:
+        """ Sends a plain text response. """
+        body = message.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
+    def log_message(self, format: str, *args) -> None:
+        logger.debug('Authorization server: {}', format % args)
 
-def request_code_id(config: str = '../config/config.ini'):
-    """ Method that handles the authentication process to request the code id.
-    The execution will open the browser to authorize the application to write new
-    activities and retrieve the `code_id` that is later used to get an access token
-    and import the data.
 
-    Once the code is retrieved the application has to be close using CTRL+C.
+def wait_authorization(server: AuthServer, timeout: float) -> None:
+    """ Serves the requests in a background thread until the authorization
+    call is received or the timeout expires, then stops the server.
+
+    Args:
+        server (AuthServer): authorization server.
+        timeout (float): seconds to wait.
+
+    Raises:
+        TimeoutError: if the authorization call was not received in time.
+    """
+    thread = threading.Thread(target=server.serve_forever, name='auth-server', daemon=True)
+    thread.start()
+    try:
+        if not server.finished.wait(timeout):
+            raise TimeoutError(f'The authorization was not received in {timeout:.0f} seconds.')
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def request_code_id(config: str = CONFIG_FILE_PATH,
+                    token: str = None,
+                    timeout: float = FALLBACK_AUTH_TIMEOUT,
+                    open_browser: bool = True,
+                    reconcile: bool = None) -> str:
+    """ Method that handles the authentication process. The execution will
+    open the browser to authorize the application to write new activities,
+    retrieve the `code_id` in a local server and exchange it for the access
+    token, that is saved in the token file. The permission to read the
+    activities is only requested if the export is reconciled with them.
+
+    The server stops by itself once the authorization is received or after
+    the timeout, so the command can be scripted to onboard several athletes.
 
     Args:
         config (str): path to the configuration file.
+        token (str): path to the token file, absolute or relative to the
+         project folder. By default, `config/token.json`.
+        timeout (float): seconds to wait for the authorization.
+        open_browser (bool): open the authorization page in the browser.
+         Otherwise, its URL is only shown in the logs.
+        reconcile (bool): also request the permission to read the
+         activities, needed to reconcile the export with the ones already in
+         Strava. By default, the one set in the configuration file.
+
+    Returns:
+        str: path to the token file.
+
+    Raises:
+        TimeoutError: if the authorization was not received in time.
+        ValueError: if the authorization was denied.
     """
     app_config = init_app(config)
-    # Create server
+    token_path = get_project_file_path(token) if token else Path(CONFIG_PATH, TOKEN_FILE_NAME)
     port = app_config.getint(SYSTEM, PORT, fallback=FALLBACK_PORT)
-    server = TCPServer(('', port), StravaAuthHandler)
-    logger.debug('The server port is: {}', port)
+    if reconcile is None:
+        reconcile = app_config.getboolean(UPLOAD, RECONCILE, fallback=FALLBACK_RECONCILE)
+    scope = [AUTH_SCOPE, AUTH_READ_SCOPE] if reconcile else [AUTH_SCOPE]
+    # The state ties the redirection to this request
+    state = secrets.token_urlsafe(16)
 
     # Create first auth request
-    client = Client()
-    client_id = get_client_id(app_config)
-    url = client.authorization_url(client_id=client_id,
-                                   redirect_uri=f'http://127.0.0.1:{port}/authorization',
-                                   scope='activity:write')
-    webbrowser.open(url)
-    del client
-
-    # Catch redirection to extract the code
+    url = Client().authorization_url(client_id=get_client_id(app_config),
+                                     redirect_uri=f'http://127.0.0.1:{port}{AUTH_CALLBACK_PATH}',
+                                     scope=scope, state=state)
+
+    with AuthServer(port, state) as server:
+        logger.debug('The server port is: {}', port)
+        logger.info('Authorize the application in: {}', url)
+        if open_browser:
+            webbrowser.open(url)
+        # Catch redirection to extract the code
+        wait_authorization(server, timeout)
+        logger.info('Closing server.')
+
+    if server.error:
+        raise ValueError(server.error)
+    if reconcile and not set(server.scope.split(',')) & set(READ_SCOPES):
+        logger.warning('The permission to read the activities (`{}`) was not granted, so the export cannot be '
+                       'reconciled with the activities already in Strava.', AUTH_READ_SCOPE)
+
     try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    logger.info('Closing server.')
-    server.server_close()
+        exchange_code_for_token(app_config, server.code_id, token_path, server.scope)
+    except Exception:
+        logger.exception('The code id could not be exchanged for the access token.')
+        if token is None:
+            # The upload exchanges it for the default token file, as the previous versions did
+            file_path = Path(check_folder(CONFIG_PATH), CODE_ID_FILE_NAME)
+            file_path.write_text(server.code_id)
+            logger.info('The code id is saved in `{}` to be exchanged in the first upload.', file_path)
+        raise
+
+    return str(token_path)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,6 @@
 # Endomondo-Strava activities equivalence
+from typing import Tuple
+
 from loguru import logger
 
 _ACTIVITIES = {
@@ -21,6 +23,21 @@ _ACTIVITIES = {
     'SOCCER': 'Soccer'
 }
 
+# Sport and sub sport of the FIT files for each Strava activity type
+_FIT_SPORTS = {
+    'Walk': (11, 0),
+    'Run': (1, 0),
+    'Workout': (10, 0),
+    'Ride': (2, 0),
+    'VirtualRun': (1, 1),
+    'Rowing': (15, 0),
+    'VirtualRide': (2, 6),
+    'WeightTraining': (10, 20),
+    'Swim': (5, 0),
+    'Soccer': (7, 0)
+}
+FIT_GENERIC_SPORT = (0, 0)
+
 
 def transform_activity(endomondo_activity: str) -> str:
     """ Transform the Endomondo activity type to Strava activity type.
@@ -35,3 +52,16 @@ def transform_activity(endomondo_activity: str) -> str:
     strava_activity = _ACTIVITIES.get(endomondo_activity)
     logger.debug('{} transformed to {}.', endomondo_activity, strava_activity)
     return strava_activity
+
+
+def transform_fit_sport(strava_activity: str) -> Tuple[int, int]:
+    """ Transform the Strava activity type to the sport and sub sport of the
+    FIT files.
+
+    Args:
+        strava_activity (str): Strava activity type, from `transform_activity`.
+
+    Returns:
+        tuple(int, int): FIT sport and sub sport, generic if unknown.
+    """
+    return _FIT_SPORTS.get(strava_activity, FIT_GENERIC_SPORT)
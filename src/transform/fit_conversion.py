@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+transform/fit_conversion.py
+=================
+Conversion of the Endomondo workouts into FIT files before uploading them.
+FIT is a binary format around ten times smaller than TCX, so the uploads are
+lighter and faster to process by Strava. The track is read from the TCX or,
+if it is missing or empty, from the points of the JSON.
+"""
+import os
+from pathlib import Path
+from typing import Dict, Optional
+from xml.etree import ElementTree
+
+import numpy as np
+from loguru import logger
+
+from parsers.endomondo import retrieve_json_data, get_activity_type, get_activity_summary, \
+    get_activity_points, get_points_arrays
+from parsers.tcx import read_tcx, get_trackpoints, get_trackpoints_arrays
+from transform.endomondo_strava import transform_activity, transform_fit_sport
+from transform.tcx_simplify import get_trackpoints_mask
+from utils.files_handler import open_activity_file, get_activity_file_mtime, get_variant_extension
+from utils.fit_encoder import FitEncoder, encode_values, to_fit_timestamp, to_semicircles
+
+# Global message numbers and values of the FIT profile
+FILE_ID, SESSION, LAP, RECORD, EVENT, ACTIVITY = 0, 18, 19, 20, 21, 34
+TIMESTAMP = 253
+ACTIVITY_FILE, DEVELOPMENT_MANUFACTURER = 4, 255
+TIMER_EVENT, LAP_EVENT, SESSION_EVENT, ACTIVITY_EVENT = 0, 9, 8, 26
+START, STOP, STOP_ALL = 0, 1, 4
+
+# Fields of the records: name of the array, number, base type, scale and offset
+RECORD_FIELDS = (
+    ('latitude', 0, 'sint32', None, 0),
+    ('longitude', 1, 'sint32', None, 0),
+    ('altitude', 2, 'uint16', 5, 500),
+    ('heart_rate', 3, 'uint8', 1, 0),
+    ('cadence', 4, 'uint8', 1, 0),
+    ('distance', 5, 'uint32', 100, 0)
+)
+
+
+def read_track(activities_folder: str, activity: str) -> Optional[Dict[str, np.ndarray]]:
+    """ Reads the track of the activity from the TCX. If it cannot be read or
+    has no trackpoints with time, the track is read from the points of the
+    JSON.
+
+    Returns:
+        dict: arrays of the trackpoints, None if neither file has them.
+    """
+    try:
+        with open_activity_file(activities_folder, activity, 'tcx') as file:
+            arrays = get_trackpoints_arrays(get_trackpoints(read_tcx(file)))
+        if not np.isnan(arrays['time']).all():
+            return arrays
+    except (OSError, KeyError, ElementTree.ParseError):
+        logger.debug('The TCX of `{}` could not be read. Using the JSON points.', activity)
+
+    points = get_activity_points(retrieve_json_data(activities_folder, activity))
+    return get_points_arrays(points) if points else None
+
+
+def encode_activity(arrays: Dict[str, np.ndarray], sport: int, sub_sport: int,
+                    summary_distance: Optional[float] = None) -> Optional[bytes]:
+    """ Encodes the track as a FIT activity with a single lap and session.
+    Only the fields with data are written, and the points without time are
+    discarded.
+
+    Args:
+        arrays (dict): arrays of the trackpoints.
+        sport (int): FIT sport.
+        sub_sport (int): FIT sub sport.
+        summary_distance (float): distance in meters of the workout, used if
+         the points have no distance.
+
+    Returns:
+        bytes: content of the FIT file, None if no point has time.
+    """
+    has_time = ~np.isnan(arrays['time'])
+    if not has_time.any():
+        return None
+    arrays = {name: values[has_time] for name, values in arrays.items()}
+    timestamps = to_fit_timestamp(arrays['time'])
+    start, end = float(np.min(timestamps)), float(np.max(timestamps))
+    elapsed_time = end - start
+    distances = arrays['distance'][~np.isnan(arrays['distance'])]
+    total_distance = float(np.max(distances)) if len(distances) else summary_distance
+
+    encoder = FitEncoder()
+    encoder.add_messages(FILE_ID, [(0, 'enum', encode_values(ACTIVITY_FILE, 'enum')),
+                                   (1, 'uint16', encode_values(DEVELOPMENT_MANUFACTURER, 'uint16')),
+                                   (2, 'uint16', encode_values(0, 'uint16')),
+                                   (3, 'uint32z', encode_values(1, 'uint32z')),
+                                   (4, 'uint32', encode_values(start, 'uint32'))])
+    encoder.add_messages(EVENT, [(TIMESTAMP, 'uint32', encode_values(start, 'uint32')),
+                                 (0, 'enum', encode_values(TIMER_EVENT, 'enum')),
+                                 (1, 'enum', encode_values(START, 'enum'))])
+
+    record_fields = [(TIMESTAMP, 'uint32', encode_values(timestamps, 'uint32'))]
+    for name, number, base_type, scale, offset in RECORD_FIELDS:
+        values = arrays[name]
+        if np.isnan(values).all():
+            continue
+        if scale is None:
+            values = to_semicircles(values)
+        record_fields.append((number, base_type, encode_values(values, base_type, scale or 1, offset)))
+    encoder.add_messages(RECORD, record_fields)
+
+    encoder.add_messages(EVENT, [(TIMESTAMP, 'uint32', encode_values(end, 'uint32')),
+                                 (0, 'enum', encode_values(TIMER_EVENT, 'enum')),
+                                 (1, 'enum', encode_values(STOP_ALL, 'enum'))])
+    summary_fields = [(TIMESTAMP, 'uint32', encode_values(end, 'uint32')),
+                      (2, 'uint32', encode_values(start, 'uint32')),
+                      (7, 'uint32', encode_values(elapsed_time, 'uint32', 1000)),
+                      (8, 'uint32', encode_values(elapsed_time, 'uint32', 1000)),
+                      (9, 'uint32', encode_values(np.nan if total_distance is None else total_distance,
+                                                  'uint32', 100))]
+    encoder.add_messages(LAP, summary_fields + [(0, 'enum', encode_values(LAP_EVENT, 'enum')),
+                                                (1, 'enum', encode_values(STOP, 'enum')),
+                                                (25, 'enum', encode_values(sport, 'enum'))])
+    encoder.add_messages(SESSION, summary_fields + [(0, 'enum', encode_values(SESSION_EVENT, 'enum')),
+                                                    (1, 'enum', encode_values(STOP, 'enum')),
+                                                    (5, 'enum', encode_values(sport, 'enum')),
+                                                    (6, 'enum', encode_values(sub_sport, 'enum')),
+                                                    (25, 'uint16', encode_values(0, 'uint16')),
+                                                    (26, 'uint16', encode_values(1, 'uint16'))])
+    encoder.add_messages(ACTIVITY, [(TIMESTAMP, 'uint32', encode_values(end, 'uint32')),
+                                    (0, 'uint32', encode_values(elapsed_time, 'uint32', 1000)),
+                                    (1, 'uint16', encode_values(1, 'uint16')),
+                                    (2, 'enum', encode_values(0, 'enum')),
+                                    (3, 'enum', encode_values(ACTIVITY_EVENT, 'enum')),
+                                    (4, 'enum', encode_values(STOP, 'enum'))])
+    return encoder.to_bytes()
+
+
+def get_source_mtime(activities_folder: str, activity: str) -> float:
+    """ Obtains the latest modification time of the files the FIT file is
+    converted from, the JSON and, if it exists, the TCX.
+    """
+    mtimes = [get_activity_file_mtime(activities_folder, activity, 'json')]
+    try:
+        mtimes.append(get_activity_file_mtime(activities_folder, activity, 'tcx'))
+    except OSError:
+        pass
+    return max(mtimes)
+
+
+def convert_activity(activities_folder: str,
+                     activity: str,
+                     output_folder: str,
+                     simplify_tolerance: float = 0) -> Optional[Path]:
+    """ Writes the activity as a FIT file in the output folder, with the
+    sport of the Endomondo workout. The tolerance of the simplification is part
+    of the name of the file, that is reused while it is newer than the JSON
+    and the TCX of the export. It is executed in the conversion processes, ahead of the
+    uploads.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activity (str): name of the activity.
+        output_folder (str): folder where the FIT files are saved.
+        simplify_tolerance (float): distance tolerance in meters to simplify
+         the track, zero to keep all the points.
+
+    Returns:
+        Path: path to the FIT file, None if the activity has no track with
+        time, so the TCX is uploaded instead.
+    """
+    fit_path = Path(output_folder, f'{activity}.{get_variant_extension("fit", simplify_tolerance)}')
+    if fit_path.is_file() and fit_path.stat().st_mtime >= get_source_mtime(activities_folder, activity):
+        logger.trace('Using the FIT file `{}`.', fit_path)
+        return fit_path
+
+    try:
+        activity_data = retrieve_json_data(activities_folder, activity)
+        arrays = read_track(activities_folder, activity)
+    except (OSError, KeyError, ValueError):
+        logger.warning('The workout `{}` could not be read. It will not be converted to FIT.', activity)
+        return None
+    if arrays is None:
+        logger.debug('The workout `{}` has no track. It will not be converted to FIT.', activity)
+        return None
+
+    points_number = len(arrays['time'])
+    if simplify_tolerance > 0:
+        keep = get_trackpoints_mask(arrays, simplify_tolerance)
+        arrays = {name: values[keep] for name, values in arrays.items()}
+
+    sport, sub_sport = transform_fit_sport(transform_activity(get_activity_type(activity_data)))
+    distance_km = get_activity_summary(activity_data)['distance_km']
+    content = encode_activity(arrays, sport, sub_sport,
+                              distance_km * 1000 if isinstance(distance_km, (int, float)) else None)
+    if content is None:
+        logger.debug('The points of `{}` have no time. It will not be converted to FIT.', activity)
+        return None
+
+    # Write to a temporal file so an interrupted write is never used
+    temporal_path = fit_path.with_name(f'{fit_path.name}.tmp')
+    with open(temporal_path, 'wb') as file:
+        file.write(content)
+    os.replace(temporal_path, fit_path)
+
+    logger.debug('Converted `{}` to FIT with {} of {} points in {} bytes.',
+                 activity, len(arrays['time']), points_number, len(content))
+    return fit_path
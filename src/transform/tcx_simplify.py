@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+transform/tcx_simplify.py
+=================
+Reduction of the trackpoints of the TCX files before uploading them. The
+track is simplified with the Douglas-Peucker algorithm, so only the points
+needed to keep its shape within a distance tolerance are uploaded.
+"""
+import os
+from pathlib import Path
+from typing import Optional
+from xml.etree import ElementTree
+
+import numpy as np
+from loguru import logger
+
+from parsers.tcx import read_tcx, get_tracks, get_trackpoints, get_trackpoints_arrays, NAMESPACES
+from utils.constants import EARTH_RADIUS, MAX_TRACKPOINT_INTERVAL
+from utils.files_handler import open_activity_file, get_activity_file_mtime, get_variant_extension
+
+
+def project_coordinates(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """ Projects the coordinates in degrees into a plane in meters using the
+    equirectangular projection around the mean latitude. Enough for the
+    distances between consecutive points of a workout.
+
+    Args:
+        latitude (np.ndarray): latitudes in degrees.
+        longitude (np.ndarray): longitudes in degrees.
+
+    Returns:
+        np.ndarray: array of shape (n, 2) with the projected points.
+    """
+    latitude = np.radians(latitude)
+    longitude = np.radians(longitude)
+    x = EARTH_RADIUS * longitude * np.cos(np.mean(latitude))
+    y = EARTH_RADIUS * latitude
+    return np.column_stack((x, y))
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """ Simplifies the line with the Douglas-Peucker algorithm. The recursion is
+    replaced with a stack and the distances of each segment are computed at once.
+
+    Args:
+        points (np.ndarray): array of shape (n, 2) with the points in meters.
+        tolerance (float): maximum distance in meters between the original and
+         the simplified line.
+
+    Returns:
+        np.ndarray: boolean mask with the points to keep.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        segment = points[end] - points[start]
+        relative = points[start + 1:end] - points[start]
+        segment_length = np.hypot(*segment)
+        if segment_length == 0:
+            distances = np.hypot(relative[:, 0], relative[:, 1])
+        else:
+            distances = np.abs(segment[0] * relative[:, 1] - segment[1] * relative[:, 0]) / segment_length
+
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return keep
+
+
+def get_trackpoints_mask(arrays: dict, tolerance: float) -> np.ndarray:
+    """ Selects the trackpoints to keep. Apart from the ones selected by the
+    Douglas-Peucker algorithm, the points without position are kept and at
+    least one point is kept every `MAX_TRACKPOINT_INTERVAL` seconds, so the
+    heart rate and cadence series are not left with long gaps.
+
+    Args:
+        arrays (dict): arrays of the trackpoints, from `parsers.tcx.get_trackpoints_arrays`.
+        tolerance (float): distance tolerance in meters.
+
+    Returns:
+        np.ndarray: boolean mask with the trackpoints to keep.
+    """
+    has_position = ~(np.isnan(arrays['latitude']) | np.isnan(arrays['longitude']))
+    keep = ~has_position
+
+    positioned_indexes = np.flatnonzero(has_position)
+    if len(positioned_indexes):
+        points = project_coordinates(arrays['latitude'][has_position], arrays['longitude'][has_position])
+        keep[positioned_indexes[douglas_peucker(points, tolerance)]] = True
+
+    times = arrays['time']
+    if len(times) and not np.all(np.isnan(times)):
+        intervals = np.floor((times - np.nanmin(times)) / MAX_TRACKPOINT_INTERVAL)
+        keep |= np.concatenate(([True], np.diff(intervals) != 0))
+
+    return keep
+
+
+def remove_whitespace(element: ElementTree.Element) -> None:
+    """ Removes the indentation of the document to make it compact. """
+    for child in element.iter():
+        if child.text is not None and not child.text.strip():
+            child.text = None
+        if child.tail is not None and not child.tail.strip():
+            child.tail = None
+
+
+def simplify_activity(activities_folder: str,
+                      activity: str,
+                      output_folder: str,
+                      tolerance: float) -> Optional[Path]:
+    """ Writes a compact version of the TCX of the activity in the output
+    folder, keeping only the trackpoints needed to follow the track within the
+    tolerance. The tolerance is part of the name of the file, that is reused
+    while it is newer than the export.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activity (str): name of the activity.
+        output_folder (str): folder where the simplified files are saved.
+        tolerance (float): distance tolerance in meters.
+
+    Returns:
+        Path: path to the simplified TCX, None if the file could not be parsed.
+    """
+    simplified_path = Path(output_folder, f'{activity}.{get_variant_extension("tcx", tolerance)}')
+    if simplified_path.is_file() and \
+            simplified_path.stat().st_mtime >= get_activity_file_mtime(activities_folder, activity, 'tcx'):
+        logger.trace('Using the simplified file `{}`.', simplified_path)
+        return simplified_path
+
+    try:
+        with open_activity_file(activities_folder, activity, 'tcx') as file:
+            tree = read_tcx(file)
+    except ElementTree.ParseError:
+        logger.warning('The TCX of `{}` could not be parsed. It will not be simplified.', activity)
+        return None
+
+    trackpoints = get_trackpoints(tree)
+    keep = get_trackpoints_mask(get_trackpoints_arrays(trackpoints), tolerance)
+
+    # Remove the discarded trackpoints from their tracks
+    discarded = {id(trackpoint) for trackpoint, kept in zip(trackpoints, keep) if not kept}
+    for track in get_tracks(tree):
+        for trackpoint in track.findall('tcx:Trackpoint', NAMESPACES):
+            if id(trackpoint) in discarded:
+                track.remove(trackpoint)
+    remove_whitespace(tree.getroot())
+
+    # Write to a temporal file so an interrupted write is never used
+    temporal_path = simplified_path.with_name(f'{simplified_path.name}.tmp')
+    tree.write(temporal_path, encoding='UTF-8', xml_declaration=True)
+    os.replace(temporal_path, simplified_path)
+
+    logger.debug('Simplified `{}` from {} to {} trackpoints.', activity, len(trackpoints), int(keep.sum()))
+    return simplified_path
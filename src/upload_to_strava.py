@@ -5,101 +5,1031 @@ upload_to_strava.py
 Main class of the application. This file is the one executed to upload the
 endomondo activities to strava from the export folder.
 """
+import multiprocessing
 import shutil
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from configparser import ConfigParser
 from pathlib import Path
-from time import mktime, strptime
+from typing import Any, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 
 import fire
+import requests
 from loguru import logger
+from stravalib import Client, exc
 from tqdm import tqdm
 
-from parsers.endomondo import retrieve_json_data, get_activity_type
+from parsers.endomondo import retrieve_json_header, get_activity_type
 from transform.endomondo_strava import transform_activity
-from utils.config_handler import init_app
-from utils.constants import CONFIG_PATH
-from utils.files_handler import get_activity_files_names, retrieve_activities_path, check_folder
-from utils.strava import get_strava_client, upload_activity, handle_rate_limit
+from transform.fit_conversion import convert_activity
+from transform.tcx_simplify import simplify_activity
+from utils.activity_index import ActivityIndex, get_activity_timestamp
+from utils.compression import compress_activity
+from utils.config_handler import init_app, configure_worker_logger
+from utils.constants import CONFIG_PATH, CONFIG_FILE_PATH, FALLBACK_WORKERS, RATE_LIMIT_FILE_NAME, FALLBACK_MOVE_FILES, \
+    MANIFEST_FILE_NAME, LEGACY_PROCESSED_FILE_NAME, FALLBACK_COMPRESS, FALLBACK_SIMPLIFY_TOLERANCE, \
+    FALLBACK_SKIP_DUPLICATES, FALLBACK_POLL_UPLOADS, POLL_RESULTS_INTERVAL, DUPLICATE, FALLBACK_DAEMON, \
+    PROGRESS_ETA_INTERVAL, FALLBACK_FIT, FALLBACK_PREFLIGHT, FALLBACK_MAX_RETRIES, TRANSIENT_ERRORS, \
+    FALLBACK_RECONCILE, REMOTE_INDEX_FILE_NAME, EXISTING_ACTIVITY, AUTH_READ_SCOPE, READ_SCOPES, FALLBACK_LOG_LEVEL
+from utils.duplicates import build_fingerprints, find_duplicates
+from utils.events import events
+from utils.export_archive import is_export_archive
+from utils.files_handler import get_activity_index, retrieve_activities_path, check_folder, \
+    get_export_file_path, open_activity_file, get_variant_extension
+from utils.manifest import Manifest, UPLOADED, SUBMITTED
+from utils.metrics import metrics, reset_worker_metrics
+from utils.parameters import UPLOAD, WORKERS, MOVE_FILES, COMPRESS, SIMPLIFY_TOLERANCE, SKIP_DUPLICATES, \
+    POLL_UPLOADS, DAEMON, FIT, PREFLIGHT, MAX_RETRIES, RECONCILE, SYSTEM, LOG_LEVEL
+from utils.planner import get_requests_per_activity, plan_migration
+from utils.preflight import validate_activities
+from utils.rate_limiter import RateLimiter, AccountRateLimiter
+from utils.reconciliation import RemoteIndex
+from utils.retry_queue import RetryQueue, is_transient_error, get_retry_delay
+from utils.strava import get_strava_client, upload_activity, get_data_type, get_granted_scopes, UploadResult
+from utils.upload_poller import UploadPoller
 
 
-def upload(path: str = None,
-           config: str = '../config/config.ini'):
+def get_number_of_workers(workers: Optional[int], app_config: ConfigParser) -> int:
+    """ Retrieves the number of uploads that will be kept in flight. The
+    `workers` argument takes preference over the value in the configuration
+    file, that should be under the "upload" section. If neither is set, four
+    uploads are kept in flight.
+
+    Args:
+        workers (int): command line argument that could be set.
+        app_config (ConfigParser): app configuration.
+
+    Returns:
+        int: number of concurrent uploads.
+
+    Raises:
+        ValueError: if the number of workers is lower than one.
     """
+    if workers is None:
+        workers = app_config.getint(UPLOAD, WORKERS, fallback=FALLBACK_WORKERS)
+
+    if workers < 1:
+        raise ValueError(f'The number of workers must be at least one. Workers: `{workers}`')
+
+    logger.info('Uploading with {} concurrent workers.', workers)
+    return workers
+
+
+def init_converter(log_level: str) -> None:
+    """ Initializer of the FIT conversion processes. """
+    configure_worker_logger(log_level)
+    reset_worker_metrics()
+
+
+def convert_to_fit(activities_folder: str,
+                   activity: str,
+                   fit_folder: str,
+                   simplify_tolerance: float = 0) -> Tuple[Optional[Path], Dict[str, Any]]:
+    """ Converts a workout to FIT. It is executed by the conversion processes,
+    so the parsing of the tracks does not compete for the GIL with the
+    uploads.
+
+    Returns:
+        Path, dict: path to the FIT file, None if it could not be converted,
+        and the metrics of the process.
+    """
+    with metrics.time('fit_conversion_seconds'):
+        fit_path = convert_activity(activities_folder, activity, fit_folder, simplify_tolerance)
+    metrics.increment('fit_conversions' if fit_path else 'fit_conversions_failed')
+    return fit_path, metrics.pop()
+
+
+def process_activity(client: Client,
+                     activities_folder: str,
+                     activity: str,
+                     rate_limiter: Union[RateLimiter, AccountRateLimiter],
+                     compressed_folder: Optional[str] = None,
+                     simplified_folder: Optional[str] = None,
+                     simplify_tolerance: float = 0,
+                     fit_conversion: Optional[Future] = None) -> UploadResult:
+    """ Uploads a single workout. It is executed by the workers of the upload
+    pool, so the parsing of the JSON and the preprocessing of the TCX overlap
+    with the uploads in flight. If the workout is being converted to FIT, the
+    FIT file is uploaded instead of the TCX once the conversion finishes.
 
     Args:
-        path: path to the folder containing the activities.
-        config: path to the configuration file.
+        client (Client): configured Strava client.
+        activities_folder (str): path to the workouts folder or export archive.
+        activity (str): name of the workout files without extension.
+        rate_limiter (RateLimiter): rate limiter shared by the workers of the
+         athlete.
+        compressed_folder (str): folder where the TCX is compressed before the
+         upload. None to upload it without compression.
+        simplified_folder (str): folder where the simplified TCX is saved.
+         None to upload all the trackpoints.
+        simplify_tolerance (float): distance tolerance in meters used to
+         simplify the track.
+        fit_conversion (Future): conversion of the workout to FIT, from
+         `convert_to_fit`. None to upload the TCX.
 
     Returns:
+        UploadResult: result of the upload.
+    """
+    logger.debug('Processing workout file `{}`', activity)
+
+    # Load json first to obtain the data that will be sent along the tcx
+    with metrics.time('read_header_seconds'):
+        activity_data = retrieve_json_header(activities_folder, activity)
+        endomondo_activity_type = get_activity_type(activity_data)
+
+    # Get strava required data and upload
+    with metrics.time('transform_seconds'):
+        strava_activity_type = transform_activity(endomondo_activity_type)
+
+    source_folder, extension = activities_folder, 'tcx'
+    fit_path = None
+    if fit_conversion:
+        # The track was simplified during the conversion
+        with metrics.time('fit_wait_seconds'):
+            fit_path, conversion_metrics = fit_conversion.result()
+        metrics.merge(conversion_metrics)
+    if fit_path:
+        source_folder, extension = str(fit_path.parent), get_variant_extension('fit', simplify_tolerance)
+    elif simplified_folder:
+        with metrics.time('simplify_seconds'):
+            if simplify_activity(activities_folder, activity, simplified_folder, simplify_tolerance):
+                source_folder, extension = simplified_folder, get_variant_extension('tcx', simplify_tolerance)
+
+    if compressed_folder:
+        with metrics.time('compress_seconds'):
+            compressed_file_path = compress_activity(source_folder, activity, compressed_folder, extension)
+        activity_file = open(compressed_file_path, 'rb')
+        data_type = get_data_type(compressed_file_path)
+    else:
+        activity_file = open_activity_file(source_folder, activity, extension)
+        data_type = extension
 
+    with activity_file:
+        # Includes the time waiting for other workers that are sleeping on the limit
+        with metrics.time('rate_limit_wait_seconds'):
+            rate_limiter.acquire()
+        with metrics.time('upload_seconds'):
+            return upload_activity(client=client,
+                                   activity_type=strava_activity_type,
+                                   activity_file=activity_file,
+                                   data_type=data_type,
+                                   activity_name=activity)
+
+
+def import_legacy_state(manifest: Manifest, activity_index: ActivityIndex) -> None:
+    """ Imports the last processed activity saved by previous versions in
+    `config/last_processed.txt`. The activities from that one on are set as
+    uploaded in the manifest, which is only done when the manifest is empty.
+
+    Args:
+        manifest (Manifest): migration manifest.
+        activity_index (ActivityIndex): index of the activities of the export.
     """
-    app_config = init_app(config)
-    client = get_strava_client(app_config)
+    legacy_file_path = Path(CONFIG_PATH, LEGACY_PROCESSED_FILE_NAME)
+    if not legacy_file_path.is_file() or not manifest.is_empty():
+        return
 
-    activities_folder = retrieve_activities_path(path, app_config)
-    activity_files = get_activity_files_names(activities_folder)
+    with open(legacy_file_path, 'r') as file:
+        last_processed = file.read().strip()
+
+    if not last_processed:
+        return
+
+    logger.info('Importing the last processed activity `{}` into the migration manifest.', last_processed)
+    comp_last = get_activity_timestamp(last_processed)
+    if comp_last is None:
+        logger.warning('The last processed activity `{}` is not a date. It cannot be imported.', last_processed)
+        return
+    manifest.mark_many_uploaded(activity for activity in activity_index
+                                if (activity_index.get_timestamp(activity) or float('-inf')) >= comp_last)
 
-    # Create processed and error folder in activities path
-    processed_path = check_folder(Path(activities_folder, 'processed'))
-    error_path = check_folder(Path(activities_folder, 'error'))
 
-    # Control processed activities to avoid repetition
-    processed_activities_file_path = Path(CONFIG_PATH, 'last_processed.txt')
-    if processed_activities_file_path.is_file():
-        processed_file = open(processed_activities_file_path, 'r')
-        last_processed = processed_file.read()
+def move_activity_files(activities_folder: str, activity: str, destination_path: str) -> None:
+    """ Moves the JSON and TCX files of the activity to the destination folder.
+    The missing files, like the TCX of some quarantined workouts, are ignored.
+
+    Args:
+        activities_folder (str): path to the folder containing the activities.
+        activity (str): name of the workout files without extension.
+        destination_path (str): destination folder.
+    """
+    with metrics.time('move_files_seconds'):
+        for extension in ('tcx', 'json'):
+            source_path = Path(activities_folder, f'{activity}.{extension}')
+            if source_path.is_file():
+                shutil.move(source_path, Path(destination_path, f'{activity}.{extension}'))
+
+
+def skip_duplicated_activities(manifest: Manifest,
+                               activities_folder: str,
+                               activity_files: List[str],
+                               duplicated_path: Optional[str],
+                               processed_path: Optional[str] = None) -> None:
+    """ Finds the duplicated workouts of the export and sets them as skipped in
+    the manifest, so they do not spend requests. From each group of
+    duplicates, the one already uploaded or, otherwise, the first one in
+    upload order is kept. Only the workouts pending, uploaded or waiting for
+    a retry are compared, so a workout is never skipped in favor of one that
+    was skipped or failed. The uploaded workouts already moved to the
+    processed folder are compared from there.
+
+    Args:
+        manifest (Manifest): migration manifest.
+        activities_folder (str): path to the workouts folder or export archive.
+        activity_files (list): names of the activities of the export.
+        duplicated_path (str): folder for the duplicated workouts. None to
+         keep the files in place.
+        processed_path (str): folder of the uploaded workouts. None if they
+         are kept in place.
+    """
+    uploaded_activities = manifest.get_names(UPLOADED, SUBMITTED)
+    processed_activities = manifest.get_processed()
+    retried_activities = set(manifest.get_retries())
+    candidates = [activity for activity in activity_files
+                  if activity not in processed_activities or activity in uploaded_activities
+                  or activity in retried_activities]
+    moved_activities = sorted(activity for activity in uploaded_activities.difference(activity_files)
+                              if processed_path and Path(processed_path, f'{activity}.json').is_file())
+    priority = moved_activities + sorted(candidates, key=lambda activity: activity not in uploaded_activities)
+
+    with metrics.time('fingerprints_seconds'):
+        fingerprints = build_fingerprints(activities_folder, candidates)
+        if moved_activities:
+            fingerprints.update(build_fingerprints(processed_path, moved_activities))
+    for duplicate, original in find_duplicates(fingerprints, priority).items():
+        if duplicate in processed_activities:
+            continue
+        logger.info('Activity `{}` is a duplicate of `{}`. Skipping.', duplicate, original)
+        manifest.mark_skipped(duplicate, DUPLICATE)
+        events.log('skipped', activity=duplicate, export=activities_folder, reason=DUPLICATE, original=original)
+        if duplicated_path:
+            move_activity_files(activities_folder, duplicate, duplicated_path)
+    manifest.commit()
+
+
+def quarantine_invalid_activities(manifest: Manifest,
+                                  activities_folder: str,
+                                  activity_files: List[str],
+                                  quarantine_path: Optional[str],
+                                  fit: bool = False) -> None:
+    """ Validates the pending workouts of the export and sets the ones that
+    Strava would reject as skipped in the manifest, with the class of the
+    error as reason, so they do not spend requests.
+
+    Args:
+        manifest (Manifest): migration manifest.
+        activities_folder (str): path to the workouts folder or export archive.
+        activity_files (list): names of the activities of the export.
+        quarantine_path (str): folder for the invalid workouts. None to keep
+         the files in place.
+        fit (bool): the workouts are uploaded as FIT, so the ones without a
+         valid TCX are converted from the points of the JSON.
+    """
+    processed_activities = manifest.get_processed()
+    with metrics.time('preflight_seconds'):
+        errors = validate_activities(activities_folder, [activity for activity in activity_files
+                                                         if activity not in processed_activities], fit=fit)
+    for activity, error in errors.items():
+        logger.info('Activity `{}` cannot be uploaded: {}. Skipping.', activity, error)
+        manifest.mark_skipped(activity, error)
+        events.log('skipped', activity=activity, export=activities_folder, reason=error)
+        if quarantine_path:
+            move_activity_files(activities_folder, activity, quarantine_path)
+    metrics.increment('preflight_quarantined', len(errors))
+    manifest.commit()
+
+
+def reconcile_existing_activities(manifest: Manifest,
+                                  activities_folder: str,
+                                  activity_files: List[str],
+                                  client: Client,
+                                  rate_limiter: Union[RateLimiter, AccountRateLimiter],
+                                  existing_path: Optional[str]) -> None:
+    """ Finds the pending workouts that the athlete already has in Strava,
+    such as the ones synced before the migration, and sets them as skipped in
+    the manifest, so they do not spend an upload each. The activities of the
+    athlete are listed in the range of dates of the pending workouts, 200 per
+    request, and matched with them by the time they overlap.
+
+    Args:
+        manifest (Manifest): migration manifest.
+        activities_folder (str): path to the workouts folder or export archive.
+        activity_files (list): names of the activities of the export.
+        client (Client): Strava client authorized by the athlete.
+        rate_limiter (RateLimiter): rate budget of the athlete.
+        existing_path (str): folder for the workouts already in Strava. None
+         to keep the files in place.
+    """
+    processed_activities = manifest.get_processed()
+    pending_activities = [activity for activity in activity_files if activity not in processed_activities]
+    if not pending_activities:
+        return
+
+    with metrics.time('fingerprints_seconds'):
+        fingerprints = build_fingerprints(activities_folder, pending_activities)
+    start_times = [fingerprint['start_time'] for fingerprint in fingerprints.values()
+                   if fingerprint['start_time'] is not None]
+    if not start_times:
+        return
+
+    granted_scopes = get_granted_scopes(client)
+    if granted_scopes is not None and not granted_scopes & set(READ_SCOPES):
+        logger.error('The athlete did not grant the permission to read the activities (`{}`), so the export '
+                     'cannot be reconciled. Execute `request_auth.py --reconcile` again to authorize it.', AUTH_READ_SCOPE)
+        return
+
+    remote_index = RemoteIndex(get_export_file_path(activities_folder, REMOTE_INDEX_FILE_NAME))
+    try:
+        with metrics.time('reconcile_seconds'):
+            remote_index.update(client, rate_limiter, min(start_times), max(start_times))
+    except exc.RateLimitExceeded:
+        logger.warning('The rate limit was reached while listing the Strava activities. '
+                       'The workouts will be reconciled in the next execution.')
+        return
+    except exc.AccessUnauthorized:
+        logger.error('Strava rejected the listing of the activities, so the export cannot be reconciled. The '
+                     'token may lack the permission to read them (`{}`): execute `request_auth.py --reconcile` '
+                     'again to authorize it.', AUTH_READ_SCOPE)
+        return
+    except (exc.Fault, requests.RequestException) as error:
+        logger.error('The Strava activities could not be listed, the workouts are not reconciled: {}', error)
+        return
+
+    reconciled_number = 0
+    for activity, fingerprint in fingerprints.items():
+        if fingerprint['start_time'] is None:
+            continue
+        activity_id = remote_index.find_match(fingerprint['start_time'], fingerprint['duration_s'])
+        if activity_id is None:
+            continue
+        logger.info('Activity `{}` already exists in Strava as activity {}. Skipping.', activity, activity_id)
+        manifest.mark_skipped(activity, EXISTING_ACTIVITY)
+        events.log('skipped', activity=activity, export=activities_folder, reason=EXISTING_ACTIVITY,
+                   strava_id=activity_id)
+        if existing_path:
+            move_activity_files(activities_folder, activity, existing_path)
+        reconciled_number += 1
+    metrics.increment('reconciled_activities', reconciled_number)
+    logger.info('{} activities already exist in Strava.', reconciled_number)
+    manifest.commit()
+
+
+def register_result(manifest: Manifest,
+                    activities_folder: str,
+                    activity: str,
+                    result: UploadResult,
+                    processed_path: Optional[str],
+                    error_path: Optional[str],
+                    poller: Optional[UploadPoller] = None,
+                    retry_queue: Optional[RetryQueue] = None,
+                    max_retries: int = 0) -> None:
+    """ Stores the result of an upload in the manifest and, if the folders are
+    set, moves the files to the processed or error folder. If the poller is
+    set, the successful submissions are only stored as submitted until the
+    poller checks how Strava processed them. If the retry queue is set, the
+    uploads failed with a transient error are scheduled to be retried with
+    an exponential backoff, keeping their files in place, until they reach
+    the maximum number of retries.
+
+    Args:
+        manifest (Manifest): migration manifest.
+        activities_folder (str): path to the folder containing the activities.
+        activity (str): name of the workout files without extension.
+        result (UploadResult): result of the upload.
+        processed_path (str): folder for the uploaded workouts. None to keep
+         the files in place.
+        error_path (str): folder for the workouts that could not be uploaded.
+         None to keep the files in place.
+        poller (UploadPoller): poller that checks the status of the uploads.
+        retry_queue (RetryQueue): queue of the uploads to retry.
+        max_retries (int): maximum number of retries of an upload.
+    """
+    if result.success and poller:
+        metrics.increment('uploads_submitted')
+        manifest.mark_submitted(activity, result.upload_id)
+        events.log('submitted', activity=activity, export=activities_folder, upload_id=result.upload_id)
+        poller.add(activity, result.upload_id)
+        return
+
+    if result.success:
+        metrics.increment('uploads_succeeded')
+        manifest.mark_uploaded(activity, result.upload_id)
+        events.log('uploaded', activity=activity, export=activities_folder, upload_id=result.upload_id)
+        destination_path = processed_path
+
     else:
-        last_processed = None
-
-    # LOOOOOOOOP
-    start_time = time.time()
-    requests = 0
-    for activity in tqdm(activity_files):
-        # Check if the activity has been previously processed
-        if last_processed:
-            logger.debug('Checking activity `{}` against last processed `{}`.', activity, last_processed)
-            comp_last = mktime(strptime(last_processed, "%Y-%m-%d %H:%M:%S.%f"))
-            comp_now = mktime(strptime(activity, "%Y-%m-%d %H:%M:%S.%f"))
-            if comp_last <= comp_now:
-                logger.info('Activity {} was already processed. Skipping', activity)
+        metrics.increment('uploads_failed')
+        retries = manifest.get_retry_count(activity)
+        if retry_queue is not None and is_transient_error(result.error_class) and retries < max_retries:
+            next_attempt = time.time() + get_retry_delay(retries)
+            logger.info('The upload of `{}` failed with a transient error, {}. Retrying it in {:0.0f} seconds.',
+                        activity, result.error_class, next_attempt - time.time())
+            metrics.increment('uploads_retried')
+            manifest.mark_failed(activity, result.error_class, next_attempt)
+            retry_queue.push(activity, next_attempt)
+            events.log('retry', activity=activity, export=activities_folder, upload_id=result.upload_id,
+                       error=result.error_class, retries=retries + 1, next_attempt=round(next_attempt))
+            return
+        manifest.mark_failed(activity, result.error_class)
+        events.log('failed', activity=activity, export=activities_folder, upload_id=result.upload_id,
+                   error=result.error_class)
+        destination_path = error_path
+
+    if destination_path:
+        move_activity_files(activities_folder, activity, destination_path)
+
+
+class UploadOptions(NamedTuple):
+    """ Options of the upload, shared by all the exports of a batch. """
+    move_files: bool
+    compress: bool
+    simplify_tolerance: float
+    skip_duplicates: bool
+    poll_uploads: bool
+    daemon: bool
+    fit: bool
+    preflight: bool
+    max_retries: int
+    reconcile: bool
+
+
+def get_upload_options(app_config: ConfigParser,
+                       move_files: Optional[bool] = None,
+                       compress: Optional[bool] = None,
+                       simplify_tolerance: Optional[float] = None,
+                       skip_duplicates: Optional[bool] = None,
+                       poll_uploads: Optional[bool] = None,
+                       daemon: Optional[bool] = None,
+                       fit: Optional[bool] = None,
+                       preflight: Optional[bool] = None,
+                       max_retries: Optional[int] = None,
+                       reconcile: Optional[bool] = None) -> UploadOptions:
+    """ Retrieves the options of the upload. The arguments take preference
+    over the values in the configuration file, that should be under the
+    "upload" section.
+
+    Args:
+        app_config (ConfigParser): app configuration.
+        move_files (bool): command line argument that could be set.
+        compress (bool): command line argument that could be set.
+        simplify_tolerance (float): command line argument that could be set.
+        skip_duplicates (bool): command line argument that could be set.
+        poll_uploads (bool): command line argument that could be set.
+        daemon (bool): command line argument that could be set.
+        fit (bool): command line argument that could be set.
+        preflight (bool): command line argument that could be set.
+        max_retries (int): command line argument that could be set.
+        reconcile (bool): command line argument that could be set.
+
+    Returns:
+        UploadOptions: options of the upload.
+    """
+    if move_files is None:
+        move_files = app_config.getboolean(UPLOAD, MOVE_FILES, fallback=FALLBACK_MOVE_FILES)
+    if compress is None:
+        compress = app_config.getboolean(UPLOAD, COMPRESS, fallback=FALLBACK_COMPRESS)
+    if skip_duplicates is None:
+        skip_duplicates = app_config.getboolean(UPLOAD, SKIP_DUPLICATES, fallback=FALLBACK_SKIP_DUPLICATES)
+    if poll_uploads is None:
+        poll_uploads = app_config.getboolean(UPLOAD, POLL_UPLOADS, fallback=FALLBACK_POLL_UPLOADS)
+    if daemon is None:
+        daemon = app_config.getboolean(UPLOAD, DAEMON, fallback=FALLBACK_DAEMON)
+    if fit is None:
+        fit = app_config.getboolean(UPLOAD, FIT, fallback=FALLBACK_FIT)
+    if preflight is None:
+        preflight = app_config.getboolean(UPLOAD, PREFLIGHT, fallback=FALLBACK_PREFLIGHT)
+    if max_retries is None:
+        max_retries = app_config.getint(UPLOAD, MAX_RETRIES, fallback=FALLBACK_MAX_RETRIES)
+    if reconcile is None:
+        reconcile = app_config.getboolean(UPLOAD, RECONCILE, fallback=FALLBACK_RECONCILE)
+    if simplify_tolerance is None:
+        simplify_tolerance = app_config.getfloat(UPLOAD, SIMPLIFY_TOLERANCE,
+                                                 fallback=FALLBACK_SIMPLIFY_TOLERANCE)
+    return UploadOptions(move_files, compress, simplify_tolerance, skip_duplicates, poll_uploads, daemon, fit,
+                         preflight, max_retries, reconcile)
+
+
+class Migration:
+    """ Upload of the export of an athlete. It keeps the manifest, the
+    folders and the upload poller of the export, and hands its pending
+    activities to an upload pool that can be shared with the migrations of
+    other athletes.
+
+    The instance is a context manager that prepares the export when entering
+    and closes the manifest when exiting.
+    """
+
+    def __init__(self,
+                 name: str,
+                 activities_folder: str,
+                 client: Client,
+                 rate_limiter: Union[RateLimiter, AccountRateLimiter],
+                 options: UploadOptions,
+                 import_legacy: bool = False):
+        """
+        Args:
+            name (str): name of the athlete, used in the logs.
+            activities_folder (str): path to the workouts folder or export archive.
+            client (Client): Strava client authorized by the athlete.
+            rate_limiter (RateLimiter): rate budget of the athlete.
+            options (UploadOptions): options of the upload.
+            import_legacy (bool): import the last processed activity saved by
+             previous versions.
+        """
+        self.name = name
+        self.activities_folder = activities_folder
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.options = options
+        self.import_legacy = import_legacy
+        self.in_flight: Dict[Future, str] = dict()
+        self.pending_number = 0
+        self.manifest: Optional[Manifest] = None
+        self.poller: Optional[UploadPoller] = None
+        self.processed_path = self.error_path = self.duplicated_path = self.quarantine_path = None
+        self.existing_path = None
+        self.compressed_path = self.simplified_path = self.fit_path = None
+        self._pending_activities: Iterator[str] = iter(())
+        self._requeued: Deque[str] = deque()
+        self.retry_queue = RetryQueue()
+
+    def __enter__(self) -> 'Migration':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """ Creates the folders of the export, opens its manifest and finds
+        the activities pending to be uploaded.
+        """
+        activities_folder = self.activities_folder
+        with metrics.time('list_files_seconds'):
+            activity_index = get_activity_index(activities_folder)
+        move_files = self.options.move_files
+        if move_files and is_export_archive(activities_folder):
+            logger.info('The activities are read from the export archive, so they will not be moved.')
+            move_files = False
+
+        # Create processed and error folder in activities path
+        if move_files:
+            self.processed_path = check_folder(Path(activities_folder, 'processed'))
+            self.error_path = check_folder(Path(activities_folder, 'error'))
+            self.duplicated_path = check_folder(Path(activities_folder, 'duplicated')) \
+                if self.options.skip_duplicates else None
+            self.quarantine_path = check_folder(Path(activities_folder, 'quarantine')) \
+                if self.options.preflight else None
+            self.existing_path = check_folder(Path(activities_folder, 'existing')) \
+                if self.options.reconcile else None
+        if self.options.compress:
+            self.compressed_path = check_folder(get_export_file_path(activities_folder, 'compressed'))
+        if self.options.simplify_tolerance > 0:
+            self.simplified_path = check_folder(get_export_file_path(activities_folder, 'simplified'))
+        if self.options.fit:
+            self.fit_path = check_folder(get_export_file_path(activities_folder, 'fit'))
+
+        self.manifest = Manifest(get_export_file_path(activities_folder, MANIFEST_FILE_NAME))
+        # Control processed activities to avoid repetition
+        if self.import_legacy:
+            import_legacy_state(self.manifest, activity_index)
+        # The invalid workouts are skipped first, so they are not kept as the original of a duplicate
+        if self.options.preflight:
+            quarantine_invalid_activities(self.manifest, activities_folder, list(activity_index),
+                                          self.quarantine_path, self.options.fit)
+        if self.options.skip_duplicates:
+            skip_duplicated_activities(self.manifest, activities_folder, list(activity_index),
+                                       self.duplicated_path, self.processed_path)
+        if self.options.reconcile:
+            reconcile_existing_activities(self.manifest, activities_folder, list(activity_index), self.client,
+                                          self.rate_limiter, self.existing_path)
+        processed_activities = self.manifest.get_processed()
+        # The pending activities are yielded lazily, so the uploads start at once
+        processed_number = sum(1 for activity in processed_activities if activity in activity_index)
+        self.pending_number = len(activity_index) - processed_number
+        self._pending_activities = (activity for activity in activity_index
+                                    if activity not in processed_activities)
+        logger.info('`{}`: {} activities were already processed. {} pending.',
+                    self.name, processed_number, self.pending_number)
+
+        # The failures of previous versions with transient errors are also retried
+        if self.options.max_retries > 0:
+            self.manifest.schedule_retries(TRANSIENT_ERRORS, self.options.max_retries)
+            self.retry_queue = RetryQueue(self.manifest.get_retries())
+            if self.retry_queue:
+                logger.info('`{}`: {} failed activities will be retried.', self.name, len(self.retry_queue))
+
+        # Check again the uploads submitted in previous executions
+        if self.options.poll_uploads:
+            self.poller = UploadPoller(self.client, self.rate_limiter, wait_reset=self.options.daemon)
+            for activity, (upload_id, submitted_at) in self.manifest.get_submitted().items():
+                self.poller.add(activity, upload_id, submitted_at)
+
+    def _pop_retry(self) -> Optional[str]:
+        """ Obtains the next activity whose retry is due. Its files are moved
+        back from the error folder if they were moved there by a previous
+        version.
+        """
+        activity = self.retry_queue.pop_due()
+        if activity is None:
+            return None
+
+        self.pending_number += 1
+        if self.error_path and not Path(self.activities_folder, f'{activity}.json').exists():
+            move_activity_files(self.error_path, activity, self.activities_folder)
+        logger.debug('Retrying workout `{}`.', activity)
+        return activity
+
+    def submit(self,
+               executor: ThreadPoolExecutor,
+               converter: Optional[ProcessPoolExecutor] = None) -> Optional[Future]:
+        """ Submits the next pending activity to the upload pool. The
+        activities stopped by the rate limit go first, then the retries that
+        are due. If the activities are uploaded as FIT, the conversion is
+        submitted at the same time, so it is done by the time a worker is
+        free to upload it.
+
+        Args:
+            executor (ThreadPoolExecutor): upload pool.
+            converter (ProcessPoolExecutor): FIT conversion pool, needed if
+             the activities are uploaded as FIT.
+
+        Returns:
+            Future: upload of the activity, None if there are no pending
+            activities left nor retries due.
+        """
+        activity = self._requeued.popleft() if self._requeued else \
+            self._pop_retry() or next(self._pending_activities, None)
+        if activity is None:
+            return None
+
+        logger.debug('Submitting workout `{}`.', activity)
+        fit_conversion = converter.submit(convert_to_fit, self.activities_folder, activity, self.fit_path,
+                                          self.options.simplify_tolerance) if self.fit_path else None
+        future = executor.submit(process_activity, self.client, self.activities_folder,
+                                 activity, self.rate_limiter, self.compressed_path,
+                                 self.simplified_path, self.options.simplify_tolerance, fit_conversion)
+        self.in_flight[future] = activity
+        return future
+
+    def store_result(self, future: Future) -> None:
+        """ Stores the result of a finished upload.
+
+        Raises:
+            RateLimitExceeded: if the upload was stopped by the daily limit.
+             The activity remains pending and is submitted again.
+        """
+        activity = self.in_flight.pop(future)
+        try:
+            result = future.result()
+        except exc.RateLimitExceeded:
+            self._requeued.append(activity)
+            raise
+        except (OSError, ValueError) as error:
+            # The files of the workout cannot be read, so sending it again would fail too
+            logger.error('The workout `{}` could not be read: {}', activity, error)
+            result = UploadResult(success=False, error_class=error.__class__.__name__)
+        self.register_result(activity, result, self.poller)
+
+    def register_result(self, activity: str, result: UploadResult, poller: Optional[UploadPoller] = None) -> None:
+        """ Stores the result of an upload of the export, scheduling its
+        retry if it failed with a transient error.
+        """
+        register_result(self.manifest, self.activities_folder, activity, result, self.processed_path,
+                        self.error_path, poller, self.retry_queue if self.options.max_retries > 0 else None,
+                        self.options.max_retries)
+
+    def store_poll_results(self, timeout: Optional[float] = None) -> None:
+        """ Stores the uploads resolved by the poller.
+
+        Args:
+            timeout (float): seconds to wait for the first result. By default,
+             it does not wait.
+        """
+        for activity, result in self.poller.get_results(timeout) if self.poller else []:
+            self.register_result(activity, result)
+
+    @property
+    def next_attempt(self) -> Optional[float]:
+        """ Timestamp when the migration has an activity to submit again: now
+        if an activity was stopped by the rate limit, otherwise the next
+        retry. None if there are none.
+        """
+        if self._requeued:
+            return time.time()
+        return self.retry_queue.next_attempt if self.retry_queue else None
+
+    @property
+    def polling(self) -> bool:
+        """ Checks if the poller is still checking uploads. """
+        return self.poller is not None and self.poller.pending > 0 and self.poller.running
+
+    def stop_polling(self) -> None:
+        """ Stops the poller and stores the uploads resolved meanwhile. The
+        rest remain submitted and are checked in the next execution.
+        """
+        if self.poller:
+            self.poller.close()
+            self.store_poll_results()
+
+    def close(self) -> None:
+        """ Stops the poller and closes the manifest. """
+        self.stop_polling()
+        if self.manifest:
+            self.manifest.close()
+
+
+def run_migrations(migrations: List[Migration],
+                   workers: int,
+                   application_limiter: RateLimiter,
+                   daemon: bool = False,
+                   log_level: str = FALLBACK_LOG_LEVEL) -> None:
+    """ Uploads the pending activities of the migrations with a single pool of
+    workers, while the main thread stores the results in their manifests as
+    soon as they are ready.
+
+    The migrations take turns to submit their activities, so all of them
+    advance at the same pace. A migration only submits an activity if its
+    budget and the one of the application have room for it besides the
+    uploads in flight, so no athlete goes over their budget while the rest
+    use the requests left. When every budget of the 15 minutes window is
+    exhausted, it waits until the window is reset. The migrations whose daily
+    budget is exhausted are stopped, and all of them if it is the one of the
+    application, unless running as a daemon, that waits until the next day.
+
+    The uploads failed with a transient error are submitted again once their
+    retry is due. When only retries are left, a daemon waits for them, while
+    otherwise they are left for the next execution.
+
+    The progress bar shows the finish time estimated with the rate limits,
+    as the speed of the uploads does not consider the time sleeping. If any
+    migration uploads FIT files, the workouts are converted in a pool of
+    processes as soon as they are submitted.
+
+    Args:
+        migrations (list): opened migrations.
+        workers (int): number of concurrent uploads.
+        application_limiter (RateLimiter): rate limiter of the application.
+        daemon (bool): wait until the daily limits are reset instead of
+         stopping.
+        log_level (str): log level of the FIT conversion processes.
+    """
+    in_flight: Dict[Future, Migration] = dict()
+    waiting = deque(migrations)
+    stopped: Set[Migration] = set()
+    progress_bar = tqdm(total=sum(migration.pending_number for migration in migrations),
+                        bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}, {rate_fmt}{postfix}]')
+    requests_per_activity = max(get_requests_per_activity(migration.options.poll_uploads)
+                                for migration in migrations) if migrations else 1
+    start = time.monotonic()
+    sleep_end = sleep_seconds = last_estimation = 0.0
+
+    def get_next_migration() -> Optional[Migration]:
+        # Next migration in turn whose budget has room for one more upload
+        if application_limiter.remaining() <= len(in_flight):
+            return None
+        for _ in range(len(waiting)):
+            migration = waiting[0]
+            waiting.rotate(-1)
+            if migration.rate_limiter.remaining() > len(migration.in_flight):
+                return migration
+        return None
+
+    def stop_migration(migration: Migration) -> None:
+        logger.warning('The daily budget of `{}` has been reached. Its remaining activities will be '
+                       'uploaded in the next execution. Usage: {}.', migration.name,
+                       migration.rate_limiter.usage())
+        stopped.add(migration)
+        if migration in waiting:
+            waiting.remove(migration)
+
+    def get_retrying() -> List[Migration]:
+        # Migrations out of turn waiting for their retries or for the activities stopped by the rate limit
+        return [migration for migration in migrations
+                if migration.next_attempt is not None and migration not in waiting and migration not in stopped]
+
+    def resume_retries() -> None:
+        # The migrations with retries due take turns again
+        now = time.time()
+        for migration in get_retrying():
+            if migration.next_attempt <= now:
+                waiting.append(migration)
+
+    def wait_retries() -> None:
+        # Only retries are left, they are waited while storing the uploads resolved meanwhile
+        nonlocal sleep_seconds
+        next_attempt = min(migration.next_attempt for migration in get_retrying())
+        seconds = min(max(next_attempt - time.time(), 0), POLL_RESULTS_INTERVAL)
+        time.sleep(seconds)
+        sleep_seconds += seconds
+
+    def update_estimation() -> None:
+        # The speed of the uploads is measured without the time sleeping
+        nonlocal last_estimation
+        if time.monotonic() - last_estimation < PROGRESS_ETA_INTERVAL:
+            return
+        last_estimation = time.monotonic()
+        upload_seconds = last_estimation - start - sleep_seconds
+        requests_per_second = progress_bar.n * requests_per_activity / upload_seconds \
+            if progress_bar.n and upload_seconds > 0 else None
+        plan = plan_migration((progress_bar.total - progress_bar.n) * requests_per_activity,
+                              application_limiter.usage(), requests_per_second)
+        progress_bar.set_postfix_str(f'finish {plan.finish_date}', refresh=False)
+
+    def store_results(futures: Iterable[Future]) -> None:
+        for future in futures:
+            migration = in_flight.pop(future)
+            try:
+                migration.store_result(future)
+            except exc.RateLimitExceeded:
+                if daemon:
+                    # The activity is submitted again once the budgets allow it
+                    if migration not in waiting and migration not in stopped:
+                        waiting.append(migration)
+                    continue
+                if application_limiter.remaining_today() == 0:
+                    raise
+                stop_migration(migration)
                 continue
-            # We are processing older workouts, so it is not necessary to check everytime
+            progress_bar.update()
+        update_estimation()
+        metrics.save(force=False)
+
+    def store_poll_results(timeout: Optional[float] = None) -> None:
+        for migration in migrations:
+            migration.store_poll_results(timeout / len(migrations) if timeout else None)
+        metrics.save(force=False)
+
+    def wait_budgets() -> None:
+        # Nothing in flight and no migration can submit, every budget is exhausted
+        nonlocal sleep_end, sleep_seconds
+        daily_exhausted = application_limiter.remaining_today() == 0 or \
+            all(migration.rate_limiter.remaining_today() == 0 for migration in waiting)
+        if daily_exhausted and not daemon:
+            if application_limiter.remaining_today() == 0:
+                raise exc.RateLimitExceeded('Daily rate limit exceeded.', limit=application_limiter.long_limit)
+            for migration in list(waiting):
+                stop_migration(migration)
+            return
+        if not daemon:
+            for migration in [migration for migration in waiting
+                              if migration.rate_limiter.remaining_today() == 0]:
+                stop_migration(migration)
+
+        if time.time() >= sleep_end:
+            if daily_exhausted:
+                remaining_time = max(application_limiter.seconds_to_long_reset(), 0)
+                logger.warning('The daily limit has been reached. Sleeping until it is reset in {:0.0f} '
+                               'hours, {:0.0f} minutes.', *divmod(remaining_time / 60, 60))
             else:
-                logger.debug('Processing older workouts.')
-                last_processed = None
+                remaining_time = max(application_limiter.seconds_to_short_reset(), 0)
+                logger.warning('The budgets of the 15 minutes window have been exhausted. Sleeping for '
+                               '{:0.0f} minutes, {:0.1f} seconds.', *divmod(remaining_time, 60))
+            metrics.increment('rate_limit_sleeps')
+            metrics.observe('rate_limit_sleep_seconds', remaining_time)
+            sleep_end = time.time() + remaining_time
+        # The uploads resolved meanwhile are stored while sleeping
+        seconds = min(max(sleep_end - time.time(), 0), POLL_RESULTS_INTERVAL)
+        time.sleep(seconds)
+        sleep_seconds += seconds
 
-        logger.debug('Processing workout file `{}`', activity)
-        start_time, requests = handle_rate_limit(start_time, requests)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # The processes are spawned, forking them once the log and poller threads run may copy held locks
+    converter = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'),
+                                    initializer=init_converter, initargs=(log_level,)) \
+        if any(migration.fit_path for migration in migrations) else None
+    try:
+        while waiting or in_flight or (daemon and get_retrying()):
+            resume_retries()
+            # Keep a bounded number of workouts waiting so the queue does not grow
+            while len(in_flight) < 2 * workers:
+                migration = get_next_migration()
+                if migration is None:
+                    break
+                future = migration.submit(executor, converter)
+                if future is None:
+                    waiting.remove(migration)
+                else:
+                    in_flight[future] = migration
+            # The retries submitted are added to the total
+            progress_bar.total = sum(migration.pending_number for migration in migrations)
 
-        # Load json first to obtain the data that will be sent along the tcx
-        activity_data = retrieve_json_data(activities_folder, activity)
-        endomondo_activity_type = get_activity_type(activity_data)
+            if in_flight:
+                done, _ = wait(in_flight, timeout=POLL_RESULTS_INTERVAL, return_when=FIRST_COMPLETED)
+                store_results(done)
+            elif waiting:
+                wait_budgets()
+            elif daemon:
+                wait_retries()
+            store_poll_results()
 
-        # Get strava required data and upload
-        strava_activity_type = transform_activity(endomondo_activity_type)
-        tcx_file_path = Path(activities_folder, f'{activity}.tcx')
-        correct_upload = upload_activity(client=client,
-                                         activity_type=strava_activity_type,
-                                         file_path=tcx_file_path)
-
-        if correct_upload:
-            # Save last processed in case of interruption
-            with open(processed_activities_file_path, 'w') as file:
-                logger.trace('Writing last processed activity `{}`.', activity)
-                file.write(activity)
-
-            # Copy the file to the processed path
-            shutil.move(tcx_file_path,
-                        Path(processed_path, f'{activity}.tcx'))
-            shutil.move(Path(activities_folder, f'{activity}.json'),
-                        Path(processed_path, f'{activity}.json'))
-
-        else:
-            # Copy the file to the error path
-            shutil.move(tcx_file_path,
-                        Path(error_path, f'{activity}.tcx'))
-            shutil.move(Path(activities_folder, f'{activity}.json'),
-                        Path(error_path, f'{activity}.json'))
+        pending_uploads = sum(migration.poller.pending for migration in migrations if migration.poller)
+        if pending_uploads:
+            logger.info('Waiting for Strava to process {} uploads.', pending_uploads)
+        while any(migration.polling for migration in migrations):
+            store_poll_results(POLL_RESULTS_INTERVAL)
+        retries_number = sum(len(migration.retry_queue) for migration in migrations)
+        if retries_number:
+            logger.info('{} failed uploads will be retried in the next execution.', retries_number)
+
+    except exc.RateLimitExceeded:
+        for future in in_flight:
+            future.cancel()
+        logger.warning('Stopping the upload as the API rate limit has been exceeded. '
+                       'Run the script again once the limits are reset, or with `--daemon` to wait '
+                       'for them. Usage: {}.', application_limiter.usage())
+
+    except BaseException:
+        # Do not start new uploads if one of them failed or the user stopped the run
+        for future in in_flight:
+            future.cancel()
+        raise
+
+    finally:
+        executor.shutdown(wait=True)
+        if converter:
+            converter.shutdown(wait=True)
+        # Store the uploads that finished while stopping, so they are not repeated
+        for future in [future for future in list(in_flight)
+                       if not future.cancelled() and future.exception() is None]:
+            in_flight.pop(future).store_result(future)
+            progress_bar.update()
+        for migration in migrations:
+            migration.stop_polling()
+        progress_bar.close()
+        metrics.save()
+
+
+def upload(path: str = None,
+           config: str = CONFIG_FILE_PATH,
+           workers: int = None,
+           move_files: bool = None,
+           compress: bool = None,
+           simplify_tolerance: float = None,
+           skip_duplicates: bool = None,
+           poll_uploads: bool = None,
+           daemon: bool = None,
+           fit: bool = None,
+           preflight: bool = None,
+           max_retries: int = None,
+           reconcile: bool = None):
+    """ Uploads the workouts of the export folder to Strava. Several uploads
+    are kept in flight by a pool of workers that share the rate budget, while
+    the main thread stores the results in the migration manifest as soon as
+    they are ready. The status of the submitted uploads is checked in the
+    background, so the errors found while Strava processes the files, such as
+    duplicates, are also stored.
+
+    Args:
+        path: path to the folder containing the activities or to the ZIP
+         archive of the export.
+        config: path to the configuration file.
+        workers: number of concurrent uploads. By default, the one set in the
+         configuration file, or four if it is not set.
+        move_files: move the workouts to the `processed` and `error` folders
+         after the upload. By default, the one set in the configuration file.
+        compress: upload the TCX files compressed with gzip. The compressed
+         files are kept in the `compressed` folder beside the export. By
+         default, the one set in the configuration file.
+        simplify_tolerance: distance in meters that the simplified track can
+         deviate from the original one. The simplified files are kept in the
+         `simplified` folder beside the export. Zero to upload all the
+         trackpoints. By default, the one set in the configuration file.
+        skip_duplicates: detect the duplicated workouts of the export and do
+         not upload them. By default, the one set in the configuration file.
+        poll_uploads: check the status of the uploads. Otherwise, the uploads
+         are set as successful once submitted. By default, the one set in the
+         configuration file.
+        daemon: keep running when the daily limit is reached, sleeping until
+         it is reset, until all the workouts are uploaded. By default, the
+         one set in the configuration file.
+        fit: convert the workouts to FIT before uploading them. The FIT files
+         are kept in the `fit` folder beside the export. By default, the one
+         set in the configuration file.
+        preflight: validate the workouts before uploading them and skip the
+         ones that Strava would reject, moving them to the `quarantine`
+         folder. By default, the one set in the configuration file.
+        max_retries: times that an upload failed with a transient error, such
+         as a network error, is retried. The permanent errors are never
+         retried. By default, the one set in the configuration file.
+        reconcile: list the activities that the athlete already has in
+         Strava and skip the workouts that overlap with them, moving them to
+         the `existing` folder. By default, the one set in the configuration
+         file.
+    """
+    app_config = init_app(config)
+    rate_limiter = RateLimiter(Path(check_folder(CONFIG_PATH), RATE_LIMIT_FILE_NAME))
+    workers = get_number_of_workers(workers, app_config)
+    client = get_strava_client(app_config, rate_limiter, workers)
+    options = get_upload_options(app_config, move_files, compress, simplify_tolerance,
+                                 skip_duplicates, poll_uploads, daemon, fit, preflight, max_retries,
+                                 reconcile)
+    activities_folder = retrieve_activities_path(path, app_config)
+
+    with Migration('default', activities_folder, client, rate_limiter, options, import_legacy=True) as migration:
+        run_migrations([migration], workers, rate_limiter, options.daemon,
+                       app_config.get(SYSTEM, LOG_LEVEL, fallback=FALLBACK_LOG_LEVEL))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+utils/activity_index.py
+=================
+Sorted index of the activities of the export. The workouts of the Endomondo
+export are named with their start time, which is parsed once when the index
+is built. The index is cached, so the names of large exports are not parsed
+and sorted again while the workouts do not change.
+"""
+import calendar
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from utils.export_archive import is_export_archive, get_export_archive
+from utils.file_cache import FileCache
+
+ACTIVITY_NAME = re.compile(r'^(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?$')
+
+
+def get_activity_timestamp(activity: str) -> Optional[float]:
+    """ Parses the start time from the name of the activity, such as
+    `2020-11-22 10:00:00.0`. The time is read as UTC, it is only used to sort
+    and compare the activities.
+
+    Args:
+        activity (str): name of the activity.
+
+    Returns:
+        float: timestamp of the activity, None if the name is not a date.
+    """
+    match = ACTIVITY_NAME.match(activity)
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second = (int(value) for value in match.groups()[:6])
+    fraction = match.group(7)
+    timestamp = calendar.timegm((year, month, day, hour, minute, second, 0, 0, 0))
+    return timestamp + float(f'0.{fraction}') if fraction else timestamp
+
+
+class ActivityIndex:
+    """ Names of the activities of the export sorted from the most recent to
+    the oldest one. The activities whose name is not a date go at the end.
+
+    The index is built by listing the folder with `os.scandir`, or from the
+    members of the ZIP archive, and is saved in the cache with the hash of the
+    names of the activity files. The rest of files of the folder, such as the
+    manifest or the folders where the workouts are moved, do not change it.
+    When the activities change, the start time of the ones already known is
+    reused, so only the new names are parsed.
+    """
+
+    def __init__(self, activities_folder: str, extension: str = 'json', cache_path: Optional[Path] = None):
+        """
+        Args:
+            activities_folder (str): path to the workouts folder or export archive.
+            extension (str): extension of the activity files, without dot.
+            cache_path (Path): path to the cache of the indexes. None to not
+             cache it.
+        """
+        self.activities_folder = activities_folder
+        self.extension = extension
+        self._entries: List[Tuple[str, Optional[float]]] = list()
+        self._timestamps: Dict[str, Optional[float]] = dict()
+        self._build(FileCache(cache_path) if cache_path else None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return (activity for activity, _ in self._entries)
+
+    def __contains__(self, activity: str) -> bool:
+        return activity in self._timestamps
+
+    def get_timestamp(self, activity: str) -> Optional[float]:
+        """ Obtains the start time of an activity parsed from its name.
+
+        Returns:
+            float: timestamp of the activity, None if the name is not a date.
+        """
+        return self._timestamps.get(activity)
+
+    def _list_activities(self) -> Iterator[str]:
+        """ Lists the names of the activity files, without extension. """
+        if is_export_archive(self.activities_folder):
+            yield from get_export_archive(self.activities_folder).get_activity_names(self.extension)
+            return
+
+        suffix = f'.{self.extension}'
+        with os.scandir(self.activities_folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(suffix) and entry.is_file():
+                    yield entry.name[:-len(suffix)]
+
+    def _get_signature(self, activities: List[str]) -> Dict[str, Any]:
+        """ Obtains the signature of the index from the names of the activities. """
+        digest = hashlib.blake2b(digest_size=16)
+        for activity in sorted(activities):
+            digest.update(activity.encode())
+            digest.update(b'\0')
+        return {'activities': len(activities), 'digest': digest.hexdigest(), 'extension': self.extension}
+
+    def _build(self, cache: Optional[FileCache]) -> None:
+        """ Loads the index from the cache or builds it again. """
+        folder_path = Path(self.activities_folder)
+        activities = list(self._list_activities())
+        signature = self._get_signature(activities)
+        if cache:
+            entries = cache.get(folder_path, signature)
+            if entries is not None:
+                self._set_entries(entries)
+                logger.debug('Index of `{}` loaded from the cache.', self.activities_folder)
+                return
+
+        # Reuse the start times of the previous index, if any
+        previous = cache.get_any(folder_path) if cache else None
+        known_timestamps = dict(previous) if previous else dict()
+        entries = [(activity, known_timestamps[activity] if activity in known_timestamps
+                    else get_activity_timestamp(activity))
+                   for activity in activities]
+        entries.sort(key=lambda entry: (entry[1] is not None, entry[1] or 0, entry[0]), reverse=True)
+        self._set_entries(entries)
+
+        if cache:
+            cache.set(folder_path, entries, signature)
+            cache.save()
+        logger.debug('Index of `{}` built with {} activities.', self.activities_folder, len(entries))
+
+    def _set_entries(self, entries: List[Tuple[str, Optional[float]]]) -> None:
+        self._entries = [(activity, timestamp) for activity, timestamp in entries]
+        self._timestamps = dict(self._entries)
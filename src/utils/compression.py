@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+utils/compression.py
+=================
+Utility class to compress the activity files before uploading them.
+"""
+import gzip
+import os
+import shutil
+from pathlib import Path
+
+from loguru import logger
+
+from utils.constants import COMPRESSION_LEVEL
+from utils.files_handler import open_activity_file, get_activity_file_mtime
+
+
+def compress_activity(activities_folder: str,
+                      activity: str,
+                      output_folder: str,
+                      extension: str = 'tcx') -> Path:
+    """ Compresses the activity file with gzip in the output folder. The file
+    is streamed, so it is never fully loaded in memory, and it is only
+    compressed again if the source is newer than the compressed one. The
+    compressed file is named after its source, so the files compressed from
+    a simplified track or a FIT file are not mixed up with the rest.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activity (str): name of the activity.
+        output_folder (str): folder where the compressed files are saved.
+        extension (str): extension of the file to compress, including the
+         variant, such as `5m.tcx` for the simplified ones.
+
+    Returns:
+        Path: path to the compressed file.
+    """
+    compressed_path = Path(output_folder, f'{activity}.{extension}.gz')
+    if compressed_path.is_file() and \
+            compressed_path.stat().st_mtime >= get_activity_file_mtime(activities_folder, activity, extension):
+        logger.trace('Using the compressed file `{}`.', compressed_path)
+        return compressed_path
+
+    # Write to a temporal file so an interrupted compression is never used
+    temporal_path = compressed_path.with_name(f'{compressed_path.name}.tmp')
+    with open_activity_file(activities_folder, activity, extension) as source, \
+            gzip.open(temporal_path, 'wb', COMPRESSION_LEVEL) as destination:
+        shutil.copyfileobj(source, destination)
+    os.replace(temporal_path, compressed_path)
+
+    logger.debug('Compressed `{}.{}` to {} bytes.', activity, extension, compressed_path.stat().st_size)
+    return compressed_path
@@ -5,22 +5,65 @@ utils/config_handler.py
 Utility class to configure the logging system.
 """
 import sys
+import time
 from configparser import ConfigParser
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
 
 from loguru import logger
 
-from utils.constants import FALLBACK_FILE_NAME, FALLBACK_LOG_LEVEL, FALLBACK_WORKING_FOLDER
+from utils.constants import FALLBACK_FILE_NAME, FALLBACK_LOG_LEVEL, FALLBACK_WORKING_FOLDER, \
+    FALLBACK_LOG_ENQUEUE, FALLBACK_EVENTS_LOG, FALLBACK_LOG_VERBOSE_RATE, EVENTS_FILE_NAME
+from utils.events import events, is_event
 from utils.files_handler import generate_output_directory_string, check_folder
-from utils.parameters import SYSTEM, FILE_NAME, LOG_LEVEL, PATH
+from utils.log_writer import QueuedSink
+from utils.metrics import configure_metrics
+from utils.parameters import SYSTEM, FILE_NAME, LOG_LEVEL, PATH, METRICS_TEXTFILE, LOG_ENQUEUE, EVENTS_LOG, \
+    LOG_VERBOSE_RATE
 
 FORMAT = "<green>{time:YYMMDD-HHmmss.SS}</green>|<level>{level:.1}</level>|<cyan>{name}</cyan>:" \
          "<cyan>{function}</cyan>:<cyan>{line}</cyan>|<level>{message}</level>"
 ERROR_LEVEL = 'ERROR'
+VERBOSE_LEVEL = 'DEBUG'
+
+
+class LogFilter:
+    """ Filter of the console and file sinks. It leaves out the events, that
+    have their own log, and, if a rate is set, the messages of DEBUG level and
+    below written from the same line of the code more than `verbose_rate`
+    times in a second, so the verbose messages of the upload loop cannot
+    flood the logs. Each sink needs its own filter.
+    """
+
+    def __init__(self, verbose_rate: int = 0):
+        """
+        Args:
+            verbose_rate (int): messages per second of DEBUG level and below
+             written from each line. 0 for no limit.
+        """
+        self.verbose_rate = verbose_rate
+        self._verbose_level = logger.level(VERBOSE_LEVEL).no
+        # Second and number of messages in it of each line of the code
+        self._windows: Dict[Tuple[str, int], List[int]] = dict()
+
+    def __call__(self, record: Dict[str, Any]) -> bool:
+        if is_event(record):
+            return False
+        if not self.verbose_rate or record['level'].no > self._verbose_level:
+            return True
+
+        second = int(time.monotonic())
+        window = self._windows.setdefault((record['name'], record['line']), [second, 0])
+        if window[0] != second:
+            window[0], window[1] = second, 0
+        window[1] += 1
+        return window[1] <= self.verbose_rate
 
 
 def init_app(config_path: str) -> ConfigParser:
     """ Initializes the application creating a unique folder for the logs and
-    setting up the logging configuration.
+    setting up the logging configuration. The metrics of the run are saved in
+    the same folder.
 
     Args:
         config_path: path to the configuration file. By default it will be
@@ -40,7 +83,11 @@ def init_app(config_path: str) -> ConfigParser:
     # Configure working folder and logs
     working_path = generate_output_directory_string(working_path)
     check_folder(working_path)
-    configure_logger(working_path, file_name, log_level)
+    configure_logger(working_path, file_name, log_level,
+                     enqueue=config.getboolean(SYSTEM, LOG_ENQUEUE, fallback=FALLBACK_LOG_ENQUEUE),
+                     events_log=config.getboolean(SYSTEM, EVENTS_LOG, fallback=FALLBACK_EVENTS_LOG),
+                     verbose_rate=config.getint(SYSTEM, LOG_VERBOSE_RATE, fallback=FALLBACK_LOG_VERBOSE_RATE))
+    configure_metrics(working_path, config.get(SYSTEM, METRICS_TEXTFILE, fallback=None))
 
     # Set the system path as the working path
     config.set(SYSTEM, PATH, working_path)
@@ -51,7 +98,10 @@ def init_app(config_path: str) -> ConfigParser:
 
 def configure_logger(working_path: str,
                      file_name: str,
-                     level: str) -> None:
+                     level: str,
+                     enqueue: bool = FALLBACK_LOG_ENQUEUE,
+                     events_log: bool = FALLBACK_EVENTS_LOG,
+                     verbose_rate: int = FALLBACK_LOG_VERBOSE_RATE) -> None:
     """ Configure the loggers that will be used. It generates a file logger and
     a console logger where all the logs will go and also a error file logger where
     only the errors will go.
@@ -61,11 +111,38 @@ def configure_logger(working_path: str,
          saved. The error log file will be added error in the name.
         file_name (str): File name where the logs will be saved.
         level (str): Log level of the general logger.
+        enqueue (bool): hand the messages to a background thread that writes
+         them, so the threads logging do not wait for the console and files.
+        events_log (bool): write the outcome of every activity in
+         `events.jsonl`, in the working path.
+        verbose_rate (int): messages per second of DEBUG level and below
+         written from each line of the code. 0 for no limit.
     """
     # Remove console logger
     logger.remove()
     # Create new loggers: console, file and error file
-    logger.add(sys.stdout, level=level, format=FORMAT)
-    logger.add(f'{working_path}/{file_name}.log', level=level, format=FORMAT)
-    logger.add(f'{working_path}/{file_name}_error.log', level=ERROR_LEVEL, format=FORMAT)
+    colorize = sys.stdout.isatty()
+    sinks = [(sys.stdout, level, LogFilter(verbose_rate)),
+             (f'{working_path}/{file_name}.log', level, LogFilter(verbose_rate)),
+             (f'{working_path}/{file_name}_error.log', ERROR_LEVEL, LogFilter())]
+    for sink, sink_level, sink_filter in sinks:
+        if enqueue:
+            stream = sink if sink is sys.stdout else open(sink, 'a', encoding='utf-8')
+            logger.add(QueuedSink(stream, close=stream is not sink), level=sink_level, format=FORMAT,
+                       filter=sink_filter, colorize=colorize and sink is sys.stdout)
+        else:
+            logger.add(sink, level=sink_level, format=FORMAT, filter=sink_filter)
+    events.configure(Path(working_path, EVENTS_FILE_NAME) if events_log else None, enqueue)
     logger.info('Logging system initialized. Level: {}. Folder: {}.', level, working_path)
+
+
+def configure_worker_logger(level: str) -> None:
+    """ Configure the console logger of a spawned worker process, that
+    starts with the default logger instead of the ones of the main process.
+
+    Args:
+        level (str): Log level of the general logger.
+    """
+    logger.remove()
+    logger.add(sys.stdout, level=level, format=FORMAT, filter=LogFilter(),
+               colorize=sys.stdout.isatty())
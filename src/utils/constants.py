@@ -1,10 +1,158 @@
+import os
+from pathlib import Path
+
+# Project folder, resolved from the sources so the commands can run from any folder
+PROJECT_PATH_VARIABLE = 'ENDOMONDO_STRAVA_HOME'
+PROJECT_PATH = Path(os.environ.get(PROJECT_PATH_VARIABLE) or Path(__file__).resolve().parents[2])
+
 # System constants
 FALLBACK_LOG_LEVEL = 'INFO'
 FALLBACK_FILE_NAME = 'endomondo_strava_importer'
-FALLBACK_WORKING_FOLDER = '../logs'
+FALLBACK_WORKING_FOLDER = str(Path(PROJECT_PATH, 'logs'))
 FALLBACK_PORT = 5000
+# Seconds to wait for the authorization in the browser
+FALLBACK_AUTH_TIMEOUT = 5 * 60
+AUTH_REQUEST_TIMEOUT = 10
+AUTH_CALLBACK_PATH = '/authorization'
+AUTH_SCOPE = 'activity:write'
+# Needed to list the activities of the athlete, including the private ones, to reconcile the export
+AUTH_READ_SCOPE = 'activity:read_all'
+READ_SCOPES = ('activity:read', AUTH_READ_SCOPE)
+# Write the logs from a background thread so the uploads do not wait for them
+FALLBACK_LOG_ENQUEUE = True
+FALLBACK_EVENTS_LOG = False
+EVENTS_FILE_NAME = 'events.jsonl'
+# Messages per second of DEBUG level and below written from each line of the code, 0 for no limit
+FALLBACK_LOG_VERBOSE_RATE = 0
 
 # Temporary folders
-CONFIG_PATH = '../config/'
+CONFIG_PATH = str(Path(PROJECT_PATH, 'config'))
+CONFIG_FILE_PATH = str(Path(CONFIG_PATH, 'config.ini'))
+ACCOUNTS_FILE_PATH = str(Path(CONFIG_PATH, 'accounts.ini'))
 CODE_ID_FILE_NAME = 'code_id.txt'
 TOKEN_FILE_NAME = 'token.json'
+# Seconds before the expiration when the access token is refreshed
+TOKEN_REFRESH_MARGIN = 15 * 60
+RATE_LIMIT_FILE_NAME = 'rate_limit.json'
+ACCOUNT_RATE_LIMIT_FILE_NAME = 'rate_limit_{}.json'
+ACCOUNT_TOKEN_FILE_NAME = 'token_{}.json'
+LEGACY_PROCESSED_FILE_NAME = 'last_processed.txt'
+ANALYZER_CACHE_FILE_NAME = 'analyzer_cache.json'
+FINGERPRINTS_CACHE_FILE_NAME = 'fingerprints_cache.json'
+ACTIVITY_INDEX_FILE_NAME = 'activity_index.json'
+PREFLIGHT_CACHE_FILE_NAME = 'preflight_cache.json'
+PREFLIGHT_REPORT_FILE_NAME = 'preflight_report.json'
+
+# Upload
+FALLBACK_WORKERS = 4
+FALLBACK_MOVE_FILES = True
+FALLBACK_COMPRESS = False
+COMPRESSION_LEVEL = 6
+FALLBACK_SIMPLIFY_TOLERANCE = 0.0
+FALLBACK_SKIP_DUPLICATES = False
+FALLBACK_FIT = False
+FALLBACK_PREFLIGHT = False
+FALLBACK_RECONCILE = False
+MANIFEST_FILE_NAME = 'migration_manifest.sqlite'
+MANIFEST_BATCH_SIZE = 50
+MANIFEST_BATCH_SECONDS = 5
+
+# Tracks
+EARTH_RADIUS = 6371008.8
+MAX_TRACKPOINT_INTERVAL = 30
+
+# Duplicates
+TRACK_HASH_POINTS = 16
+TRACK_HASH_DECIMALS = 3
+DUPLICATE_START_TOLERANCE = 60
+DUPLICATE_RELATIVE_TOLERANCE = 0.05
+DUPLICATE_DURATION_TOLERANCE = 60
+DUPLICATE_DISTANCE_TOLERANCE = 0.1
+
+# Reconciliation with the activities already in Strava
+REMOTE_INDEX_FILE_NAME = 'remote_activities.json'
+# Activities per request, the maximum allowed by the API
+REMOTE_PAGE_SIZE = 200
+REMOTE_INDEX_MAX_AGE = 24 * 60 * 60
+# Margin added to the dates of the export when listing the activities
+REMOTE_RANGE_MARGIN = 24 * 60 * 60
+# Part of the shortest activity that must overlap with the other one
+RECONCILE_MIN_OVERLAP = 0.5
+
+# Analyzer
+ANALYZER_CHUNKS_PER_WORKER = 4
+
+# Pre-flight validation, a plausible start time is between 2000-01-01 and the next day
+EARLIEST_START_TIME = 946684800
+LATEST_START_MARGIN = 24 * 60 * 60
+
+# Workout store and statistics
+WORKOUT_STORE_FILE_NAME = 'workout_store.npz'
+STATISTICS_FILE_NAME = 'workout_statistics.json'
+# Below this speed in m/s or with a longer gap in seconds between points, the athlete is not moving
+MOVING_MIN_SPEED = 0.5
+MOVING_MAX_INTERVAL = 60
+FALLBACK_MAX_HEART_RATE = 190
+# Upper limits of the heart rate zones as fraction of the maximum, the last zone has no limit
+HEART_RATE_ZONES = (0.6, 0.7, 0.8, 0.9)
+
+# Upload status polling
+FALLBACK_POLL_UPLOADS = True
+POLL_INITIAL_INTERVAL = 10
+POLL_BACKOFF_FACTOR = 2
+POLL_MAX_INTERVAL = 120
+POLL_TIMEOUT = 60 * 60
+POLL_RESULTS_INTERVAL = 1
+
+# Daemon mode and planning
+FALLBACK_DAEMON = False
+# Status checks expected for each upload, most are processed before the first one
+PLAN_STATUS_CHECKS_PER_UPLOAD = 1
+# Seconds between the updates of the estimated finish time in the progress bar
+PROGRESS_ETA_INTERVAL = 10
+
+# Error classes
+DUPLICATE = 'duplicate'
+INVALID_JSON = 'invalid_json'
+INVALID_TCX = 'invalid_tcx'
+NO_TRACKPOINTS = 'no_trackpoints'
+IMPLAUSIBLE_START_TIME = 'implausible_start_time'
+UNMAPPED_TYPE = 'unmapped_type'
+EXISTING_ACTIVITY = 'existing_activity'
+PROCESSING_TIMEOUT = 'ProcessingTimeout'
+# Answers with a 5xx or 429 status and answers that could not be read
+SERVER_ERROR = 'ServerError'
+INVALID_RESPONSE = 'InvalidResponse'
+# Errors that can succeed if the upload is sent again: network and server errors and uploads not processed
+# in time. The rest of names are the ones saved by previous versions. The other HTTP errors, with a 4xx
+# status, are permanent
+TRANSIENT_ERRORS = ('ConnectionError', 'Timeout', SERVER_ERROR, INVALID_RESPONSE, PROCESSING_TIMEOUT,
+                    'ConnectTimeout', 'ReadTimeout', 'RetryError', 'ChunkedEncodingError', 'ProxyError', 'SSLError')
+
+# Retries of the transient errors
+FALLBACK_MAX_RETRIES = 5
+RETRY_INITIAL_DELAY = 60
+RETRY_BACKOFF_FACTOR = 4
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+# HTTP transport
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 120
+HTTP_RETRIES = 5
+HTTP_BACKOFF_FACTOR = 1
+HTTP_BACKOFF_MAX = 60
+HTTP_RETRY_STATUSES = (500, 502, 503, 504)
+# The uploads are only sent again when Strava rejected them before processing the file
+HTTP_POST_RETRY_STATUSES = (429, 503)
+# Connections kept apart from the upload workers, for the status poller
+HTTP_POOL_HEADROOM = 2
+
+# Metrics
+METRICS_FILE_NAME = 'metrics.json'
+METRICS_PREFIX = 'endomondo_strava'
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+METRICS_SAVE_INTERVAL = 60
+
+# Strava API limits
+FALLBACK_SHORT_RATE_LIMIT = 100
+FALLBACK_LONG_RATE_LIMIT = 1000
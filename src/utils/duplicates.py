@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+utils/duplicates.py
+=================
+Local index of the workouts of the export to detect the duplicated ones
+before uploading them. Each workout is identified by a fingerprint with its
+start time, duration, distance and a coarse hash of its track.
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from tqdm import tqdm
+
+from parsers.endomondo import retrieve_json_data, get_activity_summary, get_activity_points
+from utils.constants import CONFIG_PATH, FINGERPRINTS_CACHE_FILE_NAME, TRACK_HASH_POINTS, \
+    TRACK_HASH_DECIMALS, DUPLICATE_START_TOLERANCE, DUPLICATE_RELATIVE_TOLERANCE, \
+    DUPLICATE_DURATION_TOLERANCE, DUPLICATE_DISTANCE_TOLERANCE, ANALYZER_CHUNKS_PER_WORKER
+from utils.file_cache import FileCache
+from utils.files_handler import check_folder, get_activity_file_path, get_activity_file_signature
+
+
+def get_track_hash(points: List[Dict[str, Any]]) -> Optional[str]:
+    """ Computes a coarse hash of the track. A fixed number of positions,
+    evenly spaced along the track, are rounded and hashed, so the same track
+    recorded twice produces the same hash.
+
+    Args:
+        points (list): points of the workout, from `parsers.endomondo.get_activity_points`.
+
+    Returns:
+        str: hash of the track, None if the workout has no positions.
+    """
+    positions = [(point['latitude'], point['longitude']) for point in points
+                 if point.get('latitude') is not None and point.get('longitude') is not None]
+    if not positions:
+        return None
+
+    step = max(len(positions) / TRACK_HASH_POINTS, 1)
+    samples = [positions[int(index * step)] for index in range(min(TRACK_HASH_POINTS, len(positions)))]
+    samples.append(positions[-1])
+    text = ';'.join(f'{latitude:.{TRACK_HASH_DECIMALS}f},{longitude:.{TRACK_HASH_DECIMALS}f}'
+                    for latitude, longitude in samples)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def compute_fingerprint(activities_folder: str, activity: str) -> Dict[str, Any]:
+    """ Computes the fingerprint of a workout.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activity (str): name of the activity.
+
+    Returns:
+        dict: start time (as timestamp), duration in seconds, distance in
+        kilometers and hash of the track.
+    """
+    activity_data = retrieve_json_data(activities_folder, activity)
+    summary = get_activity_summary(activity_data)
+    return {
+        'start_time': summary['start_time'],
+        'duration_s': summary['duration_s'],
+        'distance_km': summary['distance_km'],
+        'track_hash': get_track_hash(get_activity_points(activity_data))
+    }
+
+
+def compute_fingerprints(activities_folder: str,
+                         activities: List[Tuple[str, Dict]]) -> List[Tuple[str, Dict, Dict]]:
+    """ Computes the fingerprints of a group of workouts. It is executed in the
+    workers of the process pool.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activities (list): name of the workouts along with the signature of
+         their JSON file for the cache.
+
+    Returns:
+        list: name, signature and fingerprint of every workout.
+    """
+    return [(activity, signature, compute_fingerprint(activities_folder, activity))
+            for activity, signature in activities]
+
+
+def build_fingerprints(activities_folder: str,
+                       activity_files: List[str],
+                       workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    """ Obtains the fingerprints of all the workouts in a single pass over the
+    export. The fingerprints are cached, so only the new or modified workouts
+    are read in later executions.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activity_files (list): names of the activities.
+        workers (int): number of processes. By default, the number of CPUs.
+
+    Returns:
+        dict: fingerprint of each activity.
+    """
+    cache = FileCache(Path(check_folder(CONFIG_PATH), FINGERPRINTS_CACHE_FILE_NAME))
+    fingerprints = dict()
+    pending_activities = list()
+
+    for activity in activity_files:
+        signature = get_activity_file_signature(activities_folder, activity, 'json')
+        fingerprint = cache.get(get_activity_file_path(activities_folder, activity, 'json'), signature)
+        if fingerprint is None:
+            pending_activities.append((activity, signature))
+        else:
+            fingerprints[activity] = fingerprint
+
+    if pending_activities:
+        logger.info('Computing the fingerprint of {} activities.', len(pending_activities))
+        workers = workers or os.cpu_count() or 1
+        chunks_number = workers * ANALYZER_CHUNKS_PER_WORKER
+        chunks = [pending_activities[index::chunks_number] for index in range(chunks_number)]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(compute_fingerprints, activities_folder, chunk)
+                       for chunk in chunks if chunk]
+            with tqdm(total=len(pending_activities)) as progress_bar:
+                for future in as_completed(futures):
+                    results = future.result()
+                    for activity, signature, fingerprint in results:
+                        fingerprints[activity] = fingerprint
+                        cache.set(get_activity_file_path(activities_folder, activity, 'json'),
+                                  fingerprint, signature)
+                    progress_bar.update(len(results))
+
+        cache.save()
+
+    return fingerprints
+
+
+def _is_close(first: Optional[float], second: Optional[float], tolerance: float) -> bool:
+    """ Checks if two values are within the absolute or relative tolerance.
+    The missing values are never close, so they cannot make a duplicate.
+    """
+    if first is None or second is None:
+        return False
+    return abs(first - second) <= max(tolerance, DUPLICATE_RELATIVE_TOLERANCE * max(abs(first), abs(second)))
+
+
+def is_duplicate(first: Dict[str, Any], second: Dict[str, Any]) -> bool:
+    """ Checks if two fingerprints belong to the same workout. They must start
+    at the same time and either have the same track or the same duration and
+    distance.
+
+    Args:
+        first (dict): fingerprint of a workout.
+        second (dict): fingerprint of another workout.
+
+    Returns:
+        bool: True if they are duplicated.
+    """
+    if first['start_time'] is None or second['start_time'] is None or \
+            abs(first['start_time'] - second['start_time']) > DUPLICATE_START_TOLERANCE:
+        return False
+
+    if first['track_hash'] and first['track_hash'] == second['track_hash']:
+        return True
+
+    return _is_close(first['duration_s'], second['duration_s'], DUPLICATE_DURATION_TOLERANCE) and \
+        _is_close(first['distance_km'], second['distance_km'], DUPLICATE_DISTANCE_TOLERANCE)
+
+
+def find_duplicates(fingerprints: Dict[str, Dict[str, Any]], priority: List[str]) -> Dict[str, str]:
+    """ Finds the duplicated workouts. The workouts are sorted by start time, so
+    each one is only compared with the ones that start close to it.
+
+    Args:
+        fingerprints (dict): fingerprint of each activity.
+        priority (list): activities sorted by preference. From each group of
+         duplicates, the first one in this list is kept.
+
+    Returns:
+        dict: the duplicated activities along with the activity kept from
+        their group.
+    """
+    rank = {activity: index for index, activity in enumerate(priority)}
+    timeline = sorted((fingerprint['start_time'], activity) for activity, fingerprint in fingerprints.items()
+                      if fingerprint['start_time'] is not None and activity in rank)
+
+    duplicates = dict()
+    for index, (start_time, activity) in enumerate(timeline):
+        if activity in duplicates:
+            continue
+
+        for next_start_time, candidate in timeline[index + 1:]:
+            if next_start_time - start_time > DUPLICATE_START_TOLERANCE:
+                break
+            if candidate in duplicates or not is_duplicate(fingerprints[activity], fingerprints[candidate]):
+                continue
+
+            original, duplicate = sorted((activity, candidate), key=rank.get)
+            duplicates[duplicate] = original
+            if duplicate == activity:
+                break
+
+    # An activity may duplicate another one that is a duplicate too, so point it to the one kept
+    for duplicate, original in duplicates.items():
+        while original in duplicates:
+            original = duplicates[original]
+        duplicates[duplicate] = original
+
+    logger.info('Found {} duplicated activities.', len(duplicates))
+    return duplicates
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+utils/events.py
+=================
+Log of the outcome of every activity in JSON Lines, one compact record per
+line, to follow or analyse the migration with other tools. The events go
+through the logger, so they are written by a background writer like the rest
+of the logs, but only to their own file.
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from utils.log_writer import QueuedSink
+
+EVENT_KEY = 'event'
+
+
+def is_event(record: Dict[str, Any]) -> bool:
+    """ Checks if a log record is an event. """
+    return EVENT_KEY in record['extra']
+
+
+class EventSink:
+    """ Sink of the logger that writes the events as JSON Lines. The record
+    is serialized in the sink, so with a queued sink the serialization is also
+    done by the background writer.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path (Path): path to the JSON Lines file.
+        """
+        self._file = open(path, 'a')
+
+    def write(self, message) -> None:
+        record = message.record
+        event = {'time': round(record['time'].timestamp(), 3), EVENT_KEY: record['extra'][EVENT_KEY]}
+        event.update(record['extra']['fields'])
+        self._file.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def stop(self) -> None:
+        self._file.close()
+
+
+class EventLog:
+    """ Writer of the events of the migration. A single instance, `events`,
+    is shared by all the modules. Until it is configured, the events are
+    discarded without going through the logger.
+    """
+
+    def __init__(self):
+        self.path: Optional[Path] = None
+        self._sink_id: Optional[int] = None
+
+    def configure(self, path: Optional[Path], enqueue: bool = False) -> None:
+        """ Sets the file where the events are written.
+
+        Args:
+            path (Path): path to the JSON Lines file. None to discard the events.
+            enqueue (bool): write the events from a background thread.
+        """
+        if self._sink_id is not None:
+            try:
+                logger.remove(self._sink_id)
+            except ValueError:
+                # Already removed along with the rest of the sinks
+                pass
+            self._sink_id = None
+        self.path = Path(path) if path else None
+        if self.path:
+            sink = EventSink(self.path)
+            self._sink_id = logger.add(QueuedSink(sink) if enqueue else sink, level=0, format='{message}',
+                                       filter=is_event)
+
+    def log(self, event: str, **fields: Any) -> None:
+        """ Writes an event.
+
+        Args:
+            event (str): name of the event, such as `uploaded` or `failed`.
+            **fields: JSON serializable fields of the event, such as the name
+             of the activity.
+        """
+        if self._sink_id is not None:
+            logger.bind(**{EVENT_KEY: event, 'fields': fields}).log('INFO', event)
+
+
+events = EventLog()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+utils/export_archive.py
+=================
+Utility class to read the Endomondo export directly from the ZIP archive,
+without extracting it.
+"""
+import os
+import zipfile
+from functools import lru_cache
+from pathlib import PurePosixPath, Path
+from threading import Lock
+from typing import Dict, IO, List, Tuple
+
+from loguru import logger
+
+WORKOUTS_FOLDER = 'workouts'
+
+
+class ExportArchive:
+    """ Endomondo export archive. The central directory of the ZIP is used as
+    the index of the activities, and each workout file is decompressed on
+    demand when it is opened.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): path to the ZIP file of the export.
+        """
+        self.path = path
+        self.zip_file = zipfile.ZipFile(path)
+        self.members: Dict[Tuple[str, str], zipfile.ZipInfo] = dict()
+
+        workout_members = list()
+        for info in self.zip_file.infolist():
+            member_path = PurePosixPath(info.filename)
+            if info.is_dir() or member_path.suffix.lower() not in ('.json', '.tcx'):
+                continue
+            in_workouts_folder = WORKOUTS_FOLDER in (part.lower() for part in member_path.parts[:-1])
+            workout_members.append((in_workouts_folder, member_path, info))
+
+        # Use only the workouts folder if the archive is the complete export
+        if any(in_workouts_folder for in_workouts_folder, _, _ in workout_members):
+            workout_members = [member for member in workout_members if member[0]]
+
+        for _, member_path, info in workout_members:
+            self.members[(member_path.stem, member_path.suffix.lower().lstrip('.'))] = info
+
+        logger.debug('Found {} workout files in the archive `{}`.', len(self.members), path)
+
+    def get_activity_names(self, extension: str = 'json') -> List[str]:
+        """ Obtains the names of the activities with a file of the given extension.
+
+        Args:
+            extension (str): extension of the files, without dot.
+
+        Returns:
+            list(str): names of the activities.
+        """
+        return [name for name, member_extension in self.members if member_extension == extension]
+
+    def get_info(self, activity: str, extension: str) -> zipfile.ZipInfo:
+        """ Obtains the information of the member of the activity file.
+
+        Raises:
+            FileNotFoundError: if the archive does not contain the file.
+        """
+        try:
+            return self.members[(activity, extension)]
+        except KeyError:
+            raise FileNotFoundError(f'The file `{activity}.{extension}` was not found in `{self.path}`.')
+
+    def open(self, activity: str, extension: str) -> IO[bytes]:
+        """ Opens the activity file as a binary stream.
+
+        Args:
+            activity (str): name of the activity.
+            extension (str): extension of the file, without dot.
+
+        Returns:
+            IO[bytes]: stream with the decompressed file.
+        """
+        return self.zip_file.open(self.get_info(activity, extension))
+
+
+_archives: Dict[Tuple[str, int], ExportArchive] = dict()
+_archives_lock = Lock()
+
+
+@lru_cache(maxsize=128)
+def is_export_archive(path: str) -> bool:
+    """ Checks if the path is a ZIP archive instead of a folder. It is called
+    for every activity, so the result is cached instead of reading the
+    archive each time.
+    """
+    return Path(path).is_file() and zipfile.is_zipfile(path)
+
+
+def get_export_archive(path: str) -> ExportArchive:
+    """ Obtains the archive of the path. The archive is only indexed once per
+    process, as the file descriptor can not be shared with the processes of a
+    pool.
+
+    Args:
+        path (str): path to the ZIP file of the export.
+
+    Returns:
+        ExportArchive: indexed archive.
+    """
+    key = (str(path), os.getpid())
+    with _archives_lock:
+        if key not in _archives:
+            _archives[key] = ExportArchive(path)
+        return _archives[key]
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+utils/file_cache.py
+=================
+Cache of values computed from files, saved on disk as a JSON file. An entry
+is valid while the signature of the file, such as its size and modification
+time, does not change, or, in the content cache, while its content does not.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from loguru import logger
+
+
+class FileCache:
+    """ Stores a value for each file, keyed by its absolute path and validated
+    with its signature, by default its size and modification time. It is
+    loaded when created and only written to disk if it has been modified.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path (Path): path to the JSON file of the cache.
+        """
+        self.path = Path(path)
+        self._entries: Dict[str, Dict[str, Any]] = dict()
+        self._modified = False
+
+        if self.path.is_file():
+            try:
+                with open(self.path, 'r') as file:
+                    self._entries = json.load(file)
+            except ValueError:
+                logger.warning('The cache `{}` could not be read. Starting from zero.', self.path)
+        logger.debug('Loaded {} entries from the cache `{}`.', len(self._entries), self.path)
+
+    @staticmethod
+    def get_key(file_path: Path) -> str:
+        """ Obtains the key of the file in the cache. """
+        return str(Path(file_path).resolve())
+
+    @staticmethod
+    def get_signature(file_path: Path) -> Dict[str, Any]:
+        """ Obtains the size and modification time of the file. """
+        stat = os.stat(file_path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def get(self, file_path: Path, signature: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """ Obtains the cached value of the file.
+
+        Args:
+            file_path (Path): path to the file.
+            signature (dict): signature of the file, if it is already known.
+
+        Returns:
+            the cached value, None if there is not a valid one.
+        """
+        entry = self._entries.get(self.get_key(file_path))
+        if entry is None:
+            return None
+
+        signature = signature or self.get_signature(file_path)
+        if entry.get('signature') != signature:
+            return None
+
+        return entry['value']
+
+    def get_any(self, file_path: Path) -> Optional[Any]:
+        """ Obtains the cached value of the file even if the file has changed
+        since, to reuse the parts that are still valid.
+
+        Args:
+            file_path (Path): path to the file.
+
+        Returns:
+            the cached value, None if there is not any.
+        """
+        entry = self._entries.get(self.get_key(file_path))
+        return entry['value'] if entry else None
+
+    def set(self, file_path: Path, value: Any, signature: Optional[Dict[str, Any]] = None) -> None:
+        """ Saves the value of the file.
+
+        Args:
+            file_path (Path): path to the file.
+            value: JSON serializable value.
+            signature (dict): signature of the file when the value was computed.
+        """
+        signature = signature or self.get_signature(file_path)
+        self._entries[self.get_key(file_path)] = {'signature': signature, 'value': value}
+        self._modified = True
+
+    @staticmethod
+    def source_exists(key: str) -> bool:
+        """ Checks if the file of an entry still exists. The files inside a
+        ZIP archive exist while the archive does.
+        """
+        path = Path(key)
+        return path.exists() or any(parent.is_file() for parent in path.parents)
+
+    def save(self) -> None:
+        """ Writes the cache to disk if it has been modified, without the
+        entries of the files that no longer exist, such as the ones moved after
+        the upload. The file is replaced atomically so an interruption does not
+        corrupt it.
+        """
+        if not self._modified:
+            return
+
+        missing_keys = [key for key in self._entries if not self.source_exists(key)]
+        for key in missing_keys:
+            del self._entries[key]
+        if missing_keys:
+            logger.debug('Removed {} entries of missing files from the cache `{}`.', len(missing_keys), self.path)
+
+        temporal_path = self.path.with_name(f'{self.path.name}.tmp')
+        with open(temporal_path, 'w') as file:
+            json.dump(self._entries, file)
+        os.replace(temporal_path, self.path)
+        self._modified = False
+        logger.debug('Saved {} entries in the cache `{}`.', len(self._entries), self.path)
+
+
+class ContentCache(FileCache):
+    """ Stores a value for the content of one or more files, keyed by its
+    hash, so the entries remain valid when the files are moved, renamed or
+    extracted again from the export archive.
+    """
+
+    def get(self, digest: str) -> Optional[Any]:
+        """ Obtains the cached value of the content.
+
+        Args:
+            digest (str): hash of the content.
+
+        Returns:
+            the cached value, None if there is not any.
+        """
+        entry = self._entries.get(digest)
+        return entry['value'] if entry else None
+
+    def set(self, digest: str, value: Any) -> None:
+        """ Saves the value of the content.
+
+        Args:
+            digest (str): hash of the content.
+            value: JSON serializable value.
+        """
+        self._entries[digest] = {'value': value}
+        self._modified = True
+
+    @staticmethod
+    def source_exists(key: str) -> bool:
+        """ The entries are not tied to a file, so they are always kept. """
+        return True
+
+    def keys(self) -> Set[str]:
+        """ Obtains the hashes of the cached contents. """
+        return set(self._entries)
@@ -10,11 +10,14 @@ import string
 from configparser import ConfigParser, NoOptionError
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List
+from typing import Any, Dict, IO, Optional, List
 
 from dateutil.tz import tz
 from loguru import logger
 
+from utils.activity_index import ActivityIndex
+from utils.constants import CONFIG_PATH, ACTIVITY_INDEX_FILE_NAME, PROJECT_PATH
+from utils.export_archive import is_export_archive, get_export_archive
 from utils.parameters import ACTIVITIES, PATH
 
 
@@ -34,6 +37,20 @@ def check_folder(path: str) -> str:
     return path
 
 
+def get_project_file_path(path: str) -> Path:
+    """ Resolves a path of the configuration, the relative ones from the
+    project folder, so they do not depend on the folder the scripts are run
+    from.
+
+    Args:
+        path (str): absolute path or relative to the project folder.
+
+    Returns:
+        Path: absolute path.
+    """
+    return Path(PROJECT_PATH, Path(path).expanduser())
+
+
 def generate_output_directory_string(working_path: str) -> str:
     """ Generates output folder string in format ``YYMMDD_HHMMSS_ABC``
     that will be appended at the end of working dir.
@@ -60,6 +77,9 @@ def retrieve_activities_path(path: Optional[str], app_config: ConfigParser) -> s
     `path` argument as first choice if it exists. Otherwise, it searches for the
     path in the configuration file, that should be under the "activities" section.
 
+    The path can be either the folder with the workouts or the ZIP archive of
+    the export, that will be read without extracting it.
+
     Args:
         path (str): command line argument that could be set.
         app_config (ConfigParser): app configuration.
@@ -96,24 +116,143 @@ def retrieve_activities_path(path: Optional[str], app_config: ConfigParser) -> s
     return activities_folder
 
 
+def get_activity_index(activities_folder: str, file_extension: str = '*.json') -> ActivityIndex:
+    """ Obtains the index of the activities found in the activities' folder,
+    sorted by recent workouts. The index is cached in the configuration folder
+    while the activities' folder does not change.
+
+    Args:
+        activities_folder (str): path where the workouts files are saved.
+        file_extension (str): extension of the files.
+
+    Returns:
+        ActivityIndex: sorted index of the activities.
+    """
+    logger.trace('Searching in `{}` all the workout files in `{}` format.',
+                 activities_folder, file_extension)
+
+    activity_index = ActivityIndex(activities_folder, file_extension.lstrip('*.'),
+                                   Path(check_folder(CONFIG_PATH), ACTIVITY_INDEX_FILE_NAME))
+    logger.info('The number of activity files found is {}.', len(activity_index))
+    return activity_index
+
+
 def get_activity_files_names(activities_folder: str, file_extension: str = '*.json') -> List[str]:
     """ Obtains the file names of all the activities found in the activities' folder.
     If the file names are dates, the method will sort the list by recent workouts.
 
     Args:
         activities_folder (str): path where the workouts files are saved.
-        file_extension (str): extension of the files. Used to perform the glob operation.
+        file_extension (str): extension of the files.
 
     Returns:
         list(str): ordered list with the names of the files found.
 
     """
-    logger.trace('Searching in `{}` all the workout files in `{}` format.',
-                 activities_folder, file_extension)
+    return list(get_activity_index(activities_folder, file_extension))
+
 
-    activity_files = Path(activities_folder).glob(file_extension)
-    activity_files = [activity.stem for activity in activity_files]
-    activity_files = sorted(activity_files, reverse=True)
+def get_export_file_path(activities_folder: str, file_name: str) -> Path:
+    """ Obtains the path of a file or folder generated by the application
+    beside the export. It is saved inside the workouts folder or, if the
+    export is a ZIP archive, next to the archive with its name as prefix.
 
-    logger.info('The number of activity files found is {}.', len(activity_files))
-    return activity_files
+    Args:
+        activities_folder (str): path where the workouts files are saved.
+        file_name (str): name of the file or folder.
+
+    Returns:
+        Path: path of the file or folder.
+    """
+    if is_export_archive(activities_folder):
+        archive_path = Path(activities_folder)
+        return Path(archive_path.parent, f'{archive_path.stem}_{file_name}')
+    return Path(activities_folder, file_name)
+
+
+def get_activity_file_path(activities_folder: str, activity: str, extension: str) -> Path:
+    """ Obtains the path of an activity file. For ZIP archives, it is the path
+    of the member inside the archive, that is only used as identifier.
+
+    Args:
+        activities_folder (str): path where the workouts files are saved.
+        activity (str): name of the activity.
+        extension (str): extension of the file, without dot.
+
+    Returns:
+        Path: path of the activity file.
+    """
+    if is_export_archive(activities_folder):
+        info = get_export_archive(activities_folder).get_info(activity, extension)
+        return Path(activities_folder, info.filename)
+    return Path(activities_folder, f'{activity}.{extension}')
+
+
+def get_activity_file_signature(activities_folder: str, activity: str, extension: str) -> Dict[str, Any]:
+    """ Obtains the values that change when an activity file is modified: the
+    size and the modification time, or the CRC for the files in ZIP archives.
+
+    Args:
+        activities_folder (str): path where the workouts files are saved.
+        activity (str): name of the activity.
+        extension (str): extension of the file, without dot.
+
+    Returns:
+        dict: signature of the file.
+    """
+    if is_export_archive(activities_folder):
+        info = get_export_archive(activities_folder).get_info(activity, extension)
+        return {'size': info.file_size, 'crc': info.CRC}
+
+    stat = os.stat(Path(activities_folder, f'{activity}.{extension}'))
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def get_variant_extension(extension: str, simplify_tolerance: float = 0) -> str:
+    """ Obtains the extension of a file derived from the export, that
+    includes the tolerance of the simplification of its track, so the files
+    generated with other tolerances are never reused.
+
+    Args:
+        extension (str): extension of the file, without dot.
+        simplify_tolerance (float): distance tolerance in meters used to
+         simplify the track, zero if it was not simplified.
+
+    Returns:
+        str: extension of the file, such as `tcx` or `5m.tcx`.
+    """
+    return f'{simplify_tolerance:g}m.{extension}' if simplify_tolerance > 0 else extension
+
+
+def get_activity_file_mtime(activities_folder: str, activity: str, extension: str) -> float:
+    """ Obtains the modification time of an activity file. For ZIP archives,
+    the one of the archive is used.
+
+    Args:
+        activities_folder (str): path where the workouts files are saved.
+        activity (str): name of the activity.
+        extension (str): extension of the file, without dot.
+
+    Returns:
+        float: modification time as timestamp.
+    """
+    if is_export_archive(activities_folder):
+        return os.stat(activities_folder).st_mtime
+    return os.stat(Path(activities_folder, f'{activity}.{extension}')).st_mtime
+
+
+def open_activity_file(activities_folder: str, activity: str, extension: str) -> IO[bytes]:
+    """ Opens an activity file as a binary stream, either from the workouts
+    folder or from the ZIP archive of the export.
+
+    Args:
+        activities_folder (str): path where the workouts files are saved.
+        activity (str): name of the activity.
+        extension (str): extension of the file, without dot.
+
+    Returns:
+        IO[bytes]: opened file.
+    """
+    if is_export_archive(activities_folder):
+        return get_export_archive(activities_folder).open(activity, extension)
+    return open(Path(activities_folder, f'{activity}.{extension}'), 'rb')
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+utils/fit_encoder.py
+=================
+Minimal encoder of the Garmin FIT format, the binary format of the activity
+files of most devices. It only writes what is needed for the activity files:
+the definition and data messages of the fields used, little endian, and the
+header and file CRCs.
+"""
+import struct
+from typing import Dict, List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+
+FIT_EPOCH = 631065600
+PROTOCOL_VERSION = 0x20
+PROFILE_VERSION = 2132
+HEADER_SIZE = 14
+DEFINITION_HEADER = 0x40
+MAX_LOCAL_TYPES = 16
+SEMICIRCLES_PER_DEGREE = 2 ** 31 / 180
+
+
+class BaseType(NamedTuple):
+    """ FIT base type of a field with the numpy type used to write it. """
+    code: int
+    dtype: str
+    invalid: int
+
+
+BASE_TYPES = {
+    'enum': BaseType(0x00, '<u1', 0xFF),
+    'uint8': BaseType(0x02, '<u1', 0xFF),
+    'uint16': BaseType(0x84, '<u2', 0xFFFF),
+    'sint32': BaseType(0x85, '<i4', 0x7FFFFFFF),
+    'uint32': BaseType(0x86, '<u4', 0xFFFFFFFF),
+    'uint32z': BaseType(0x8C, '<u4', 0x00000000)
+}
+
+
+def _get_crc_table() -> List[int]:
+    """ Table of the CRC-16 used by FIT, with the reversed 0x8005 polynomial. """
+    table = list()
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _get_crc_table()
+
+
+def fit_crc(data: bytes, crc: int = 0) -> int:
+    """ Computes the CRC of the FIT header or file.
+
+    Args:
+        data (bytes): data to check.
+        crc (int): CRC of the previous data, to compute it by parts.
+
+    Returns:
+        int: 16 bits CRC.
+    """
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def to_fit_timestamp(timestamps: Union[float, np.ndarray]) -> Union[int, np.ndarray]:
+    """ Converts Unix timestamps into FIT ones, seconds since 1989-12-31 UTC. """
+    return np.round(np.asarray(timestamps, dtype=float) - FIT_EPOCH)
+
+
+def to_semicircles(degrees: np.ndarray) -> np.ndarray:
+    """ Converts the coordinates in degrees into the semicircles of FIT. """
+    return np.round(np.asarray(degrees, dtype=float) * SEMICIRCLES_PER_DEGREE)
+
+
+def encode_values(values: Union[float, Sequence[float], np.ndarray],
+                  base_type: str,
+                  scale: float = 1,
+                  offset: float = 0) -> np.ndarray:
+    """ Converts the values of a field into its base type, applying the scale
+    and offset of the field. The missing values (NaN) and the ones out of the
+    range of the type are set as invalid.
+
+    Args:
+        values: values of the field.
+        base_type (str): name of the base type, a key of `BASE_TYPES`.
+        scale (float): scale of the field in the FIT profile.
+        offset (float): offset of the field in the FIT profile.
+
+    Returns:
+        np.ndarray: values with the type of the field.
+    """
+    fit_type = BASE_TYPES[base_type]
+    limits = np.iinfo(np.dtype(fit_type.dtype))
+    values = np.round(np.atleast_1d(np.asarray(values, dtype=float)) * scale + offset)
+    valid = ~np.isnan(values) & (values >= limits.min) & (values <= limits.max) & (values != fit_type.invalid)
+    return np.where(valid, np.nan_to_num(values), fit_type.invalid).astype(fit_type.dtype)
+
+
+class FitEncoder:
+    """ Writes the messages of a FIT file. Each call to `add_messages` writes
+    one or several messages of the same type, preceded by their definition
+    the first time that set of fields is used. The messages are encoded at
+    once as numpy records, so the thousands of trackpoints of an activity do
+    not go through Python one by one.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._local_types: Dict[Tuple, int] = dict()
+
+    def add_messages(self, message: int, fields: List[Tuple[int, str, np.ndarray]]) -> None:
+        """ Writes messages of a global message type.
+
+        Args:
+            message (int): global message number, such as 20 for the records.
+            fields (list): number, base type and values of each field, already
+             encoded with `encode_values`. All of them with the same length,
+             the number of messages.
+
+        Raises:
+            ValueError: if the values have different lengths or there are too
+             many different definitions.
+        """
+        columns = [(number, base_type, np.atleast_1d(values)) for number, base_type, values in fields]
+        lengths = {len(values) for _, _, values in columns}
+        if len(lengths) != 1:
+            raise ValueError(f'The fields of the message {message} have different lengths: {lengths}.')
+
+        local_type = self._get_local_type(message, [(number, base_type) for number, base_type, _ in columns])
+        records = np.zeros(lengths.pop(), dtype=np.dtype([('header', '<u1')] + [
+            (f'field_{number}', BASE_TYPES[base_type].dtype) for number, base_type, _ in columns]))
+        records['header'] = local_type
+        for number, _, values in columns:
+            records[f'field_{number}'] = values
+        self._data += records.tobytes()
+
+    def _get_local_type(self, message: int, fields: List[Tuple[int, str]]) -> int:
+        """ Obtains the local type of the definition, writing it if new. """
+        key = (message, tuple(fields))
+        local_type = self._local_types.get(key)
+        if local_type is not None:
+            return local_type
+
+        local_type = len(self._local_types)
+        if local_type >= MAX_LOCAL_TYPES:
+            raise ValueError(f'Only {MAX_LOCAL_TYPES} different definitions can be written.')
+        self._local_types[key] = local_type
+
+        # Reserved byte, little endian architecture, global message and fields
+        self._data += struct.pack('<BBBHB', DEFINITION_HEADER | local_type, 0, 0, message, len(fields))
+        for number, base_type in fields:
+            fit_type = BASE_TYPES[base_type]
+            self._data += struct.pack('<BBB', number, np.dtype(fit_type.dtype).itemsize, fit_type.code)
+        return local_type
+
+    def to_bytes(self) -> bytes:
+        """ Builds the FIT file with the header, the messages and the CRC. """
+        header = struct.pack('<BBHI4s', HEADER_SIZE, PROTOCOL_VERSION, PROFILE_VERSION, len(self._data), b'.FIT')
+        header += struct.pack('<H', fit_crc(header))
+        content = header + bytes(self._data)
+        return content + struct.pack('<H', fit_crc(content))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+utils/log_writer.py
+=================
+Sink of the logger that writes the messages from a background thread. The
+threads that log only format the message and put it in a queue, the console
+and the files are written by the thread, that flushes them once per batch of
+messages. Unlike the `enqueue` option of loguru, the messages are not pickled
+nor sent through a pipe, which costs the threads that log more than writing
+them to a local file.
+"""
+import os
+import queue
+import threading
+from typing import Any
+
+# Message that stops the writer thread
+_STOP = None
+
+
+class QueuedSink:
+    """ Sink that writes the messages in a background thread. The stream can
+    be a file, the console or any object with a `write` method, and its
+    `flush` and `stop` methods are called if it has them. In a process forked
+    after creating the sink, the thread does not exist, so the messages are
+    written directly. The queue and the buffer of the stream copied from the
+    parent hold messages that the parent writes, so they are never written
+    by the child, that opens again the files of the sink.
+    """
+
+    def __init__(self, stream: Any, close: bool = False):
+        """
+        Args:
+            stream: object where the messages are written.
+            close (bool): close the stream when the sink is stopped, for the
+             files opened for the sink.
+        """
+        self._stream = stream
+        self._close = close
+        self._pid = os.getpid()
+        self._forked_stream = None
+        self._forked_pid = None
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, message: str) -> None:
+        if os.getpid() == self._pid:
+            self._queue.put(message)
+        else:
+            self._write_forked(message)
+
+    def _write_forked(self, message: str) -> None:
+        """ Writes a message from a forked process, without the messages
+        queued by the parent.
+        """
+        stream = self._stream
+        if self._close:
+            if self._forked_pid != os.getpid():
+                self._forked_stream = open(self._stream.name, 'a', encoding='utf-8')
+                self._forked_pid = os.getpid()
+            stream = self._forked_stream
+        stream.write(message)
+        if hasattr(stream, 'flush'):
+            stream.flush()
+
+    def _write_batch(self, message: str) -> bool:
+        """ Writes a message and the rest of the queued ones, then flushes
+        the stream.
+
+        Returns:
+            bool: if the sink was stopped.
+        """
+        stopped = False
+        try:
+            while message is not _STOP:
+                self._stream.write(message)
+                message = self._queue.get_nowait()
+            stopped = True
+        except queue.Empty:
+            pass
+        if hasattr(self._stream, 'flush'):
+            self._stream.flush()
+        return stopped
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            message = self._queue.get()
+            stopped = message is _STOP or self._write_batch(message)
+
+    def stop(self) -> None:
+        """ Writes the pending messages and finishes the thread. Called by the
+        logger when the sink is removed, also at the exit of the program.
+        """
+        if os.getpid() != self._pid:
+            # The stream copied from the parent is left to it
+            if self._forked_stream is not None and self._forked_pid == os.getpid():
+                self._forked_stream.close()
+            return
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self._close:
+            self._stream.close()
+        elif hasattr(self._stream, 'stop'):
+            self._stream.stop()
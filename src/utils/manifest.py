@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+utils/manifest.py
+=================
+Migration manifest saved in a SQLite database. It keeps the state of every
+activity of the export so the upload can be resumed at any point.
+"""
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from loguru import logger
+
+from utils.constants import MANIFEST_BATCH_SIZE, MANIFEST_BATCH_SECONDS
+
+PENDING = 'pending'
+SUBMITTED = 'submitted'
+UPLOADED = 'uploaded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    upload_id INTEGER,
+    error_class TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    retries INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL
+);
+CREATE INDEX IF NOT EXISTS activities_state ON activities (state);
+"""
+
+# Columns added after the first version, with their definition
+_ADDED_COLUMNS = {
+    'retries': 'INTEGER NOT NULL DEFAULT 0',
+    'next_attempt': 'REAL'
+}
+
+# The retries are counted when a failure is scheduled to be retried and reset when the upload succeeds
+_UPDATE_STATE = f"""
+INSERT INTO activities (name, state, upload_id, error_class, attempts, updated_at, retries, next_attempt)
+VALUES (:name, :state, :upload_id, :error_class, 1, :updated_at, :next_attempt IS NOT NULL, :next_attempt)
+ON CONFLICT (name) DO UPDATE SET
+    state = excluded.state,
+    upload_id = COALESCE(excluded.upload_id, activities.upload_id),
+    error_class = excluded.error_class,
+    attempts = activities.attempts + 1,
+    updated_at = excluded.updated_at,
+    retries = CASE WHEN excluded.state = '{UPLOADED}' THEN 0
+                   ELSE activities.retries + excluded.retries END,
+    next_attempt = excluded.next_attempt
+"""
+
+
+class Manifest:
+    """ State of the activities of an export. Each activity is stored with its
+    state (pending, submitted, uploaded, failed or skipped), the id of the
+    Strava upload, the class of the last error and the number of attempts.
+    The failed activities whose error is transient also keep the number of
+    retries and when the next one is due.
+
+    The database uses the write-ahead log and the updates are committed in
+    batches, either every `MANIFEST_BATCH_SIZE` changes or every
+    `MANIFEST_BATCH_SECONDS` seconds. The instance can be used as a context
+    manager to commit the remaining changes when closing.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path (Path): path to the database file. Created if it does not exist.
+        """
+        self.path = Path(path)
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+        self._add_missing_columns()
+        self._connection.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+        logger.debug('Migration manifest opened in `{}`.', self.path)
+
+    def __enter__(self) -> 'Manifest':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _add_missing_columns(self) -> None:
+        """ Adds the columns missing in the manifests created by previous versions. """
+        columns = {row[1] for row in self._connection.execute('PRAGMA table_info(activities)')}
+        for column, definition in _ADDED_COLUMNS.items():
+            if column not in columns:
+                self._connection.execute(f'ALTER TABLE activities ADD COLUMN {column} {definition}')
+
+    def is_empty(self) -> bool:
+        """ Checks if any activity has been registered. """
+        return self._connection.execute('SELECT 1 FROM activities LIMIT 1').fetchone() is None
+
+    def get_state(self, name: str) -> Optional[str]:
+        """ Obtains the state of an activity.
+
+        Args:
+            name (str): name of the activity.
+
+        Returns:
+            str: state of the activity, None if it is not registered.
+        """
+        row = self._connection.execute('SELECT state FROM activities WHERE name = ?',
+                                       (name,)).fetchone()
+        return row[0] if row else None
+
+    def get_names(self, *states: str) -> Set[str]:
+        """ Obtains the names of the activities in the given states.
+
+        Args:
+            states (str): states to search.
+
+        Returns:
+            set(str): names of the activities.
+        """
+        placeholders = ', '.join('?' for _ in states)
+        rows = self._connection.execute(f'SELECT name FROM activities WHERE state IN ({placeholders})',
+                                        states)
+        return {row[0] for row in rows}
+
+    def get_processed(self) -> Set[str]:
+        """ Obtains the activities that are not pending anymore. """
+        rows = self._connection.execute('SELECT name FROM activities WHERE state != ?', (PENDING,))
+        return {row[0] for row in rows}
+
+    def get_submitted(self) -> Dict[str, Tuple[int, float]]:
+        """ Obtains the activities submitted to Strava whose upload has not
+        been checked yet.
+
+        Returns:
+            dict: upload id and submission timestamp of each activity.
+        """
+        rows = self._connection.execute('SELECT name, upload_id, updated_at FROM activities WHERE state = ?',
+                                        (SUBMITTED,))
+        return {name: (upload_id, updated_at) for name, upload_id, updated_at in rows}
+
+    def get_retries(self) -> Dict[str, float]:
+        """ Obtains the failed activities scheduled to be retried.
+
+        Returns:
+            dict: timestamp of the next attempt of each activity.
+        """
+        rows = self._connection.execute('SELECT name, next_attempt FROM activities '
+                                        'WHERE state = ? AND next_attempt IS NOT NULL', (FAILED,))
+        return {name: next_attempt for name, next_attempt in rows}
+
+    def get_retry_count(self, name: str) -> int:
+        """ Obtains the number of times that an activity has been scheduled
+        to be retried since its last successful upload.
+
+        Args:
+            name (str): name of the activity.
+
+        Returns:
+            int: number of retries.
+        """
+        row = self._connection.execute('SELECT retries FROM activities WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def schedule_retries(self, error_classes: Iterable[str], max_retries: int) -> int:
+        """ Schedules the retry of the failed activities with the given error
+        classes that are not scheduled yet and have retries left, such as the
+        ones failed in previous versions, that did not retry them.
+
+        Args:
+            error_classes (list): classes of the errors to retry.
+            max_retries (int): maximum number of retries of an activity.
+
+        Returns:
+            int: number of activities scheduled.
+        """
+        error_classes = list(error_classes)
+        placeholders = ', '.join('?' for _ in error_classes)
+        cursor = self._connection.execute(
+            f'UPDATE activities SET next_attempt = ? WHERE state = ? AND next_attempt IS NULL '
+            f'AND retries < ? AND error_class IN ({placeholders})',
+            (time.time(), FAILED, max_retries, *error_classes))
+        self.commit()
+        return cursor.rowcount
+
+    def mark_submitted(self, name: str, upload_id: int) -> None:
+        """ Sets the activity as submitted, waiting for Strava to process it.
+
+        Args:
+            name (str): name of the activity.
+            upload_id (int): id of the Strava upload.
+        """
+        self._update(name, SUBMITTED, upload_id=upload_id)
+
+    def mark_uploaded(self, name: str, upload_id: Optional[int] = None) -> None:
+        """ Sets the activity as uploaded.
+
+        Args:
+            name (str): name of the activity.
+            upload_id (int): id of the Strava upload.
+        """
+        self._update(name, UPLOADED, upload_id=upload_id)
+
+    def mark_failed(self, name: str, error_class: Optional[str] = None,
+                    next_attempt: Optional[float] = None) -> None:
+        """ Sets the activity as failed.
+
+        Args:
+            name (str): name of the activity.
+            error_class (str): class of the error that made the upload fail.
+            next_attempt (float): timestamp when the upload is retried. None
+             if the failure is permanent.
+        """
+        self._update(name, FAILED, error_class=error_class, next_attempt=next_attempt)
+
+    def mark_skipped(self, name: str, reason: str) -> None:
+        """ Sets the activity as skipped, so it is never uploaded.
+
+        Args:
+            name (str): name of the activity.
+            reason (str): reason why it is skipped, saved as error class.
+        """
+        self._update(name, SKIPPED, error_class=reason)
+
+    def mark_many_uploaded(self, names: Iterable[str]) -> None:
+        """ Sets several activities as uploaded in a single transaction. Used
+        when importing the state of previous executions.
+
+        Args:
+            names (list): names of the activities.
+        """
+        now = time.time()
+        self._connection.executemany(_UPDATE_STATE, ({'name': name, 'state': UPLOADED, 'upload_id': None,
+                                                      'error_class': None, 'updated_at': now,
+                                                      'next_attempt': None}
+                                                     for name in names))
+        self.commit()
+
+    def _update(self, name: str, state: str, upload_id: Optional[int] = None,
+                error_class: Optional[str] = None, next_attempt: Optional[float] = None) -> None:
+        """ Updates the state of an activity. The change is committed when the
+        batch is full or old enough.
+        """
+        self._connection.execute(_UPDATE_STATE, {'name': name, 'state': state, 'upload_id': upload_id,
+                                                 'error_class': error_class, 'updated_at': time.time(),
+                                                 'next_attempt': next_attempt})
+        self._uncommitted += 1
+        if self._uncommitted >= MANIFEST_BATCH_SIZE or \
+                time.monotonic() - self._last_commit >= MANIFEST_BATCH_SECONDS:
+            self.commit()
+
+    def commit(self) -> None:
+        """ Commits the pending changes. """
+        self._connection.commit()
+        logger.trace('Committed {} changes to the migration manifest.', self._uncommitted)
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        """ Commits the pending changes and closes the database. """
+        self.commit()
+        self._connection.close()
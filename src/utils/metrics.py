@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+utils/metrics.py
+=================
+Counters and histograms of the stages of the migration. They are saved as a
+JSON summary in the run folder and, optionally, in a Prometheus textfile so
+long migrations can be followed while running.
+"""
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from loguru import logger
+
+from utils.constants import METRICS_FILE_NAME, METRICS_PREFIX, METRICS_BUCKETS, METRICS_SAVE_INTERVAL
+
+
+class Histogram:
+    """ Distribution of the observed values in cumulative buckets, as the
+    Prometheus histograms, along with their count, sum, minimum and maximum.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        """ Adds a value to the distribution. """
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """ Adds the values of a histogram exported with `to_dict`. """
+        self.bucket_counts = [count + other for count, other in zip(self.bucket_counts, data['bucket_counts'])]
+        self.count += data['count']
+        self.sum += data['sum']
+        for name, function in (('min', min), ('max', max)):
+            if data[name] is not None:
+                value = getattr(self, name)
+                setattr(self, name, data[name] if value is None else function(value, data[name]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'buckets': list(self.buckets),
+            'bucket_counts': list(self.bucket_counts)
+        }
+
+
+class Metrics:
+    """ Registry of the counters and histograms of the application. A single
+    instance, `metrics`, is shared by all the modules as it is done with the
+    logger. It is thread safe, and the metrics of the worker processes are
+    sent to the main process with `pop` and added with `merge`.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, float] = dict()
+        self.histograms: Dict[str, Histogram] = dict()
+        self.json_path: Optional[Path] = None
+        self.textfile_path: Optional[Path] = None
+        self._last_save = time.monotonic()
+        self._lock = Lock()
+
+    def configure(self, json_path: Optional[Path], textfile_path: Optional[Path] = None) -> None:
+        """ Sets where the metrics are saved.
+
+        Args:
+            json_path (Path): path to the JSON summary.
+            textfile_path (Path): path to the Prometheus textfile. None to not
+             write it.
+        """
+        self.json_path = Path(json_path) if json_path else None
+        self.textfile_path = Path(textfile_path) if textfile_path else None
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """ Increments a counter. """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """ Adds a value to a histogram. """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        """ Measures the seconds spent in the block and adds them to the
+        histogram, also if the block raises an exception.
+
+        Args:
+            name (str): name of the histogram, ending in `_seconds`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Exports the counters and the histograms. """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+            }
+
+    def reset(self) -> None:
+        """ Removes all the metrics. """
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def pop(self) -> Dict[str, Any]:
+        """ Exports the metrics and resets them. Used in the worker processes
+        so every metric is sent only once to the main process.
+        """
+        data = self.to_dict()
+        self.reset()
+        return data
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """ Adds the metrics exported with `to_dict` or `pop`, for instance,
+        from a worker process.
+        """
+        with self._lock:
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram_data in data['histograms'].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram(tuple(histogram_data['buckets']))
+                histogram.merge(histogram_data)
+
+    def to_prometheus(self) -> str:
+        """ Formats the metrics with the Prometheus text format. The counters
+        end in `_total` and the histograms include the `+Inf` bucket.
+        """
+        data = self.to_dict()
+        lines = list()
+        for name, value in sorted(data['counters'].items()):
+            metric_name = f'{METRICS_PREFIX}_{name}_total'
+            lines += [f'# TYPE {metric_name} counter', f'{metric_name} {value}']
+
+        for name, histogram in sorted(data['histograms'].items()):
+            metric_name = f'{METRICS_PREFIX}_{name}'
+            lines.append(f'# TYPE {metric_name} histogram')
+            cumulative = 0
+            for bucket, count in zip(histogram['buckets'], histogram['bucket_counts']):
+                cumulative += count
+                lines.append(f'{metric_name}_bucket{{le="{bucket}"}} {cumulative}')
+            lines += [f'{metric_name}_bucket{{le="+Inf"}} {histogram["count"]}',
+                      f'{metric_name}_sum {histogram["sum"]}',
+                      f'{metric_name}_count {histogram["count"]}']
+
+        return '\n'.join(lines) + '\n'
+
+    def save(self, force: bool = True) -> None:
+        """ Writes the JSON summary and the Prometheus textfile, if they are
+        configured. The files are replaced atomically, so they can be read
+        while the migration is running.
+
+        Args:
+            force (bool): write them even if they were written less than
+             `METRICS_SAVE_INTERVAL` seconds ago.
+        """
+        if not force and time.monotonic() - self._last_save < METRICS_SAVE_INTERVAL:
+            return
+        self._last_save = time.monotonic()
+
+        files = list()
+        if self.json_path:
+            files.append((self.json_path, json.dumps(self.to_dict(), indent=4)))
+        if self.textfile_path:
+            files.append((self.textfile_path, self.to_prometheus()))
+
+        for path, content in files:
+            temporal_path = path.with_name(f'{path.name}.tmp')
+            try:
+                with open(temporal_path, 'w') as file:
+                    file.write(content)
+                os.replace(temporal_path, path)
+            except OSError:
+                logger.exception('The metrics could not be saved in `{}`.', path)
+                continue
+            logger.trace('Metrics saved in `{}`.', path)
+
+
+metrics = Metrics()
+
+
+def reset_worker_metrics() -> None:
+    """ Initializer of the worker processes, that may have inherited the
+    metrics of the main process.
+    """
+    metrics.reset()
+
+
+def configure_metrics(working_path: str, textfile_path: Optional[str] = None) -> None:
+    """ Saves the metrics of the run in its working folder and, optionally, in
+    a Prometheus textfile.
+
+    Args:
+        working_path (str): working folder of the run.
+        textfile_path (str): path to the Prometheus textfile. None to not
+         write it.
+    """
+    metrics.configure(Path(working_path, METRICS_FILE_NAME), textfile_path)
@@ -7,11 +7,16 @@
 SYSTEM = 'system'
 STRAVA = 'strava'
 ACTIVITIES = 'activities'
+UPLOAD = 'upload'
 
 # SYSTEM parameters
 FILE_NAME = 'file_name'
 LOG_LEVEL = 'logging_level'
 PORT = 'port'
+METRICS_TEXTFILE = 'metrics_textfile'
+LOG_ENQUEUE = 'log_enqueue'
+EVENTS_LOG = 'events_log'
+LOG_VERBOSE_RATE = 'log_verbose_rate'
 
 # STRAVA parameters
 CLIENT_ID = 'client_id'
@@ -19,5 +24,25 @@ SECRET = 'secret'
 TOKEN = 'token'
 USER = 'user'
 
+# ACTIVITIES parameters
+MAX_HEART_RATE = 'max_heart_rate'
+
+# UPLOAD parameters
+WORKERS = 'workers'
+MOVE_FILES = 'move_files'
+COMPRESS = 'compress'
+SIMPLIFY_TOLERANCE = 'simplify_tolerance'
+SKIP_DUPLICATES = 'skip_duplicates'
+POLL_UPLOADS = 'poll_uploads'
+DAEMON = 'daemon'
+FIT = 'fit'
+PREFLIGHT = 'preflight'
+RECONCILE = 'reconcile'
+MAX_RETRIES = 'max_retries'
+
+# ACCOUNT parameters, in the batch accounts file
+SHORT_RATE_LIMIT = 'short_limit'
+LONG_RATE_LIMIT = 'long_limit'
+
 # Shared parameters
 PATH = 'path'
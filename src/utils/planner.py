@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+utils/planner.py
+=================
+Estimation of the duration of the migration. The uploads are limited by the
+rate limits of the Strava API rather than by the upload speed, so the
+requests pending are distributed over the 15 minutes and daily windows.
+"""
+import math
+import time
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional
+
+from utils.constants import PLAN_STATUS_CHECKS_PER_UPLOAD
+from utils.rate_limiter import SHORT_WINDOW, LONG_WINDOW
+
+
+class MigrationPlan(NamedTuple):
+    """ Estimation of the requests and time needed by the migration. """
+    requests: int
+    days: int
+    finish_at: float
+
+    @property
+    def finish_date(self) -> str:
+        """ Local date and time when the migration finishes. """
+        return datetime.fromtimestamp(self.finish_at).strftime('%d-%m-%Y %H:%M')
+
+
+def get_requests_per_activity(poll_uploads: bool) -> int:
+    """ Obtains the requests needed to upload an activity: the upload and, if
+    the status of the uploads is checked, the status checks.
+
+    Args:
+        poll_uploads (bool): if the status of the uploads is checked.
+
+    Returns:
+        int: requests per activity.
+    """
+    return 1 + (PLAN_STATUS_CHECKS_PER_UPLOAD if poll_uploads else 0)
+
+
+def plan_migration(requests: int,
+                   usage: Dict[str, int],
+                   requests_per_second: Optional[float] = None,
+                   now: Optional[float] = None) -> MigrationPlan:
+    """ Estimates when the pending requests will be done. The requests are
+    done as soon as the windows allow them, from the current usage of the
+    windows on. If the speed of the uploads is known, the requests of a
+    window are also limited by the time left in it.
+
+    Args:
+        requests (int): requests pending.
+        usage (dict): usage and limits of the windows, as returned by
+         `RateLimiter.usage`.
+        requests_per_second (float): speed of the uploads. None to only
+         consider the rate limits.
+        now (float): timestamp when the requests start. By default, now.
+
+    Returns:
+        MigrationPlan: requests, days with uploads, including today, and
+        timestamp when the last request is done.
+
+    Raises:
+        ValueError: if any of the limits does not allow any request.
+    """
+    short_limit, long_limit = usage['short_limit'], usage['long_limit']
+    if short_limit <= 0 or long_limit <= 0:
+        raise ValueError(f'The rate limits do not allow any request: {short_limit}, {long_limit}.')
+
+    now = time.time() if now is None else now
+    short_window = now - now % SHORT_WINDOW
+    long_window = now - now % LONG_WINDOW
+    short_usage, long_usage = usage['short_usage'], usage['long_usage']
+    current, remaining, finish_at = now, requests, now
+    # Requests that the speed allows, the fraction left in a window is carried to the next one
+    speed_budget = 0.0
+    days = set()
+
+    while remaining > 0:
+        window_end = short_window + SHORT_WINDOW
+        available = max(min(short_limit - short_usage, long_limit - long_usage), 0)
+        carried_budget = speed_budget
+        if requests_per_second:
+            speed_budget += (window_end - current) * requests_per_second
+            available = min(available, math.floor(speed_budget))
+
+        done = min(available, remaining)
+        if done > 0:
+            remaining -= done
+            long_usage += done
+            days.add(long_window)
+            finish_at = current + max(done - carried_budget, 0) / requests_per_second \
+                if requests_per_second else current
+        if requests_per_second:
+            # The speed is not saved up while the limits stop the requests
+            speed_budget = (speed_budget - done) % 1
+
+        # Go to the next window, skipping the rest of the day if its limit is exhausted
+        if long_usage >= long_limit:
+            short_window = long_window = long_window + LONG_WINDOW
+            long_usage = 0
+        else:
+            short_window = window_end
+            if short_window >= long_window + LONG_WINDOW:
+                long_window += LONG_WINDOW
+                long_usage = 0
+        current, short_usage = short_window, 0
+
+    return MigrationPlan(requests, len(days), finish_at)
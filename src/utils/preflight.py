@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+utils/preflight.py
+=================
+Pre-flight validation of the workouts of the export, to find the ones that
+Strava would reject before spending requests on them: the ones whose JSON or
+TCX cannot be read, whose TCX has no trackpoints or an implausible start
+time, and the ones whose sport has no Strava activity type. When the workouts
+are uploaded as FIT, the ones without a valid TCX are converted from the
+points of the JSON, so they are only rejected if those have no time either.
+The workouts are inspected in a pool of processes and the result is cached by the hash of
+their files, so they are only read again when their content changes.
+"""
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from xml.etree.ElementTree import ParseError
+
+from loguru import logger
+from tqdm import tqdm
+
+from parsers.endomondo import read_json_header, get_activity_type, get_activity_points, parse_time
+from parsers.tcx import inspect_tcx
+from transform.endomondo_strava import transform_activity
+from utils.constants import CONFIG_PATH, PREFLIGHT_CACHE_FILE_NAME, ANALYZER_CHUNKS_PER_WORKER, \
+    EARLIEST_START_TIME, LATEST_START_MARGIN, INVALID_JSON, INVALID_TCX, NO_TRACKPOINTS, \
+    IMPLAUSIBLE_START_TIME, UNMAPPED_TYPE
+from utils.file_cache import ContentCache
+from utils.files_handler import check_folder, open_activity_file
+from utils.metrics import metrics, reset_worker_metrics
+
+# Hashes already in the cache, set in every worker of the process pool
+_known_digests: Set[str] = set()
+# Fact added to the cache by this version, the entries without it are inspected again
+_LATEST_FACT = 'json_trackpoints'
+
+
+def _init_worker(known_digests: Set[str]) -> None:
+    """ Initializes a worker of the process pool with the cached hashes. """
+    global _known_digests
+    _known_digests = known_digests
+    reset_worker_metrics()
+
+
+def _read_file(activities_folder: str, activity: str, extension: str) -> Optional[bytes]:
+    """ Reads an activity file, None if it does not exist. """
+    try:
+        with open_activity_file(activities_folder, activity, extension) as file:
+            return file.read()
+    except (OSError, KeyError):
+        return None
+
+
+def inspect_activity(json_data: Optional[bytes], tcx_data: Optional[bytes]) -> Dict[str, Any]:
+    """ Reads the facts of a workout needed to validate it.
+
+    Args:
+        json_data (bytes): content of the JSON file, None if it is missing.
+        tcx_data (bytes): content of the TCX file, None if it is missing.
+
+    Returns:
+        dict: Endomondo sport, number of trackpoints, start time as timestamp
+        and the class of the error if any file could not be read. If the TCX
+        has no trackpoints, also the number of points with time of the JSON
+        and the first time.
+    """
+    facts = {'sport': None, 'trackpoints': 0, 'start_time': None, 'error': None,
+             'json_trackpoints': 0, 'json_start_time': None}
+    try:
+        facts['sport'] = get_activity_type(read_json_header(io.StringIO(json_data.decode('utf-8'))))
+    except (AttributeError, ValueError):
+        facts['error'] = INVALID_JSON
+        return facts
+
+    try:
+        facts['trackpoints'], facts['start_time'] = inspect_tcx(io.BytesIO(tcx_data))
+    except ParseError:
+        facts['error'] = INVALID_TCX
+    if not facts['trackpoints']:
+        # The whole JSON is only read for the workouts that cannot be uploaded as TCX
+        try:
+            times = [parse_time(point.get('timestamp'))
+                     for point in get_activity_points(json.loads(json_data.decode('utf-8')))]
+        except (AttributeError, TypeError, ValueError):
+            times = list()
+        times = [point_time for point_time in times if point_time is not None]
+        facts['json_trackpoints'], facts['json_start_time'] = len(times), min(times, default=None)
+    return facts
+
+
+def inspect_activities(activities_folder: str,
+                       activities: List[str]) -> Tuple[List[Tuple[str, str, Optional[Dict]]], Dict]:
+    """ Hashes the files of a group of workouts and inspects the ones that are
+    not in the cache. It is executed in the workers of the process pool.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activities (list): names of the workouts.
+
+    Returns:
+        list, dict: name, hash and facts of every workout, None if they were
+        already cached, and the metrics of the worker.
+    """
+    results = list()
+    for activity in activities:
+        json_data = _read_file(activities_folder, activity, 'json')
+        tcx_data = _read_file(activities_folder, activity, 'tcx')
+        digest = hashlib.blake2b(digest_size=16)
+        for data in (json_data, tcx_data):
+            digest.update(b'\x00' if data is None else b'\x01%d\x00' % len(data))
+            digest.update(data or b'')
+        digest = digest.hexdigest()
+
+        facts = None
+        if digest not in _known_digests:
+            with metrics.time('preflight_inspect_seconds'):
+                facts = inspect_activity(json_data, tcx_data)
+        results.append((activity, digest, facts))
+
+    return results, metrics.pop()
+
+
+def get_preflight_error(facts: Dict[str, Any], now: Optional[float] = None, fit: bool = False) -> Optional[str]:
+    """ Checks if the upload of a workout can succeed. The sport is mapped
+    here instead of when inspecting it, so the cached facts remain valid when
+    the activity types are changed.
+
+    Args:
+        facts (dict): facts of the workout, from `inspect_activity`.
+        now (float): current timestamp. By default, the current time.
+        fit (bool): the workout is uploaded as FIT, so it can be converted
+         from the points of the JSON if the TCX has no trackpoints.
+
+    Returns:
+        str: class of the error that would make the upload fail, None if it
+        is valid.
+    """
+    if fit and facts['error'] != INVALID_JSON and not facts['trackpoints'] and facts.get('json_trackpoints'):
+        facts = dict(facts, error=None, trackpoints=facts['json_trackpoints'], start_time=facts['json_start_time'])
+    if facts['error']:
+        return facts['error']
+    if not facts['trackpoints']:
+        return NO_TRACKPOINTS
+    latest_start_time = (now or time.time()) + LATEST_START_MARGIN
+    if facts['start_time'] is None or not EARLIEST_START_TIME <= facts['start_time'] <= latest_start_time:
+        return IMPLAUSIBLE_START_TIME
+    if transform_activity(facts['sport']) is None:
+        return UNMAPPED_TYPE
+    return None
+
+
+def validate_activities(activities_folder: str,
+                        activity_files: List[str],
+                        workers: Optional[int] = None,
+                        fit: bool = False) -> Dict[str, str]:
+    """ Validates the workouts in a pool of processes. The facts of every
+    workout are cached by the hash of its files, so the workouts are only
+    inspected again if their content changes.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activity_files (list): names of the activities.
+        workers (int): number of processes. By default, the number of CPUs.
+        fit (bool): the workouts are uploaded as FIT.
+
+    Returns:
+        dict: class of the error of each invalid activity.
+    """
+    if not activity_files:
+        return dict()
+
+    cache = ContentCache(Path(check_folder(CONFIG_PATH), PREFLIGHT_CACHE_FILE_NAME))
+    workers = workers or os.cpu_count() or 1
+    chunks_number = workers * ANALYZER_CHUNKS_PER_WORKER
+    chunks = [activity_files[index::chunks_number] for index in range(chunks_number)]
+    errors = dict()
+    inspected_number = 0
+    now = time.time()
+
+    logger.info('Validating {} activities before uploading them.', len(activity_files))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=({digest for digest in cache.keys()
+                                        if _LATEST_FACT in cache.get(digest)},)) as executor:
+        futures = [executor.submit(inspect_activities, activities_folder, chunk) for chunk in chunks if chunk]
+        with tqdm(total=len(activity_files)) as progress_bar:
+            for future in as_completed(futures):
+                results, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                for activity, digest, facts in results:
+                    if facts is None:
+                        facts = cache.get(digest)
+                    else:
+                        cache.set(digest, facts)
+                        inspected_number += 1
+                    error = get_preflight_error(facts, now, fit)
+                    if error:
+                        errors[activity] = error
+                progress_bar.update(len(results))
+
+    cache.save()
+    metrics.increment('preflight_cache_hits', len(activity_files) - inspected_number)
+    metrics.increment('preflight_cache_misses', inspected_number)
+    logger.info('{} activities inspected, {} found in the cache. {} of them cannot be uploaded.',
+                inspected_number, len(activity_files) - inspected_number, len(errors))
+    return errors
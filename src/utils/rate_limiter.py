@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+utils/rate_limiter.py
+=================
+Rate limiter for the Strava API. It controls the 15 minutes and the daily
+windows, updates itself with the usage reported by Strava in the response
+headers and keeps its state on disk between executions. The budget of each
+athlete can also be limited inside the limits of the application.
+"""
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Mapping, Optional
+
+from loguru import logger
+
+from utils.constants import FALLBACK_SHORT_RATE_LIMIT, FALLBACK_LONG_RATE_LIMIT
+from utils.metrics import metrics
+
+SHORT_WINDOW = 60 * 15
+LONG_WINDOW = 60 * 60 * 24
+USAGE_HEADER = 'x-ratelimit-usage'
+LIMIT_HEADER = 'x-ratelimit-limit'
+
+
+def sleep_until_reset(remaining_time: float) -> None:
+    """ Sleeps until the 15 minutes window is reset.
+
+    Args:
+        remaining_time (float): seconds until the window is reset.
+    """
+    mins, secs = divmod(remaining_time, 60)
+    logger.warning('The number of allowed request per 15 minutes have '
+                   'been reached. Sleeping for {:0.0f} minutes, {:0.1f} seconds.',
+                   mins, secs)
+    metrics.increment('rate_limit_sleeps')
+    metrics.observe('rate_limit_sleep_seconds', remaining_time)
+    time.sleep(remaining_time)
+    logger.info('Waiting time elapsed. Continuing with the process.')
+
+
+class RateLimiter:
+    """ Controls the requests done to the Strava API following its two
+    windows: the 15 minutes one, that resets at the natural quarters of the
+    hour, and the daily one, that resets at midnight UTC.
+
+    Every request has to be reserved with `acquire`, that will sleep until the
+    next quarter if the 15 minutes window is exhausted and will raise
+    `RateLimitExceeded` if the daily one is. The instance is also the callable
+    that stravalib uses as rate limiter, so the counters are corrected with the
+    usage reported by Strava after every response.
+
+    The state is saved in `state_path` after every change, so a restarted
+    process continues with the same counters. The instance is thread safe.
+    """
+
+    def __init__(self,
+                 state_path: Path,
+                 short_limit: int = FALLBACK_SHORT_RATE_LIMIT,
+                 long_limit: int = FALLBACK_LONG_RATE_LIMIT,
+                 update_limits: bool = True):
+        """
+        Args:
+            state_path (Path): file where the state is persisted.
+            short_limit (int): requests allowed every 15 minutes.
+            long_limit (int): requests allowed per day.
+            update_limits (bool): replace the limits with the ones reported by
+             Strava and saved in the state. Otherwise, the given limits are
+             kept, as for the budgets of the athletes.
+        """
+        self.state_path = Path(state_path)
+        self.short_limit = short_limit
+        self.long_limit = long_limit
+        self.update_limits = update_limits
+        self.short_window = 0
+        self.short_usage = 0
+        self.long_window = 0
+        self.long_usage = 0
+        self._lock = Lock()
+        self._load()
+
+    def _load(self) -> None:
+        """ Loads the persisted state, if any. """
+        if not self.state_path.is_file():
+            logger.debug('No rate limit state found in `{}`.', self.state_path)
+            return
+
+        try:
+            with open(self.state_path, 'r') as file:
+                state = json.load(file)
+        except ValueError:
+            logger.warning('The rate limit state in `{}` could not be read. Starting from zero.',
+                           self.state_path)
+            return
+
+        self.short_window = state.get('short_window', 0)
+        self.short_usage = state.get('short_usage', 0)
+        self.long_window = state.get('long_window', 0)
+        self.long_usage = state.get('long_usage', 0)
+        if self.update_limits:
+            self.short_limit = state.get('short_limit', self.short_limit)
+            self.long_limit = state.get('long_limit', self.long_limit)
+        self._roll_windows()
+        logger.debug('Rate limit state loaded. 15 minutes usage: {}/{}. Daily usage: {}/{}.',
+                     self.short_usage, self.short_limit, self.long_usage, self.long_limit)
+
+    def _save(self) -> None:
+        """ Writes the state to a temporary file and replaces the previous one,
+        so an interrupted write never leaves a corrupted state.
+        """
+        state = {
+            'short_window': self.short_window,
+            'short_usage': self.short_usage,
+            'long_window': self.long_window,
+            'long_usage': self.long_usage,
+            'short_limit': self.short_limit,
+            'long_limit': self.long_limit
+        }
+        temporal_path = self.state_path.with_name(f'{self.state_path.name}.tmp')
+        with open(temporal_path, 'w') as file:
+            json.dump(state, file, indent=4)
+        os.replace(temporal_path, self.state_path)
+
+    def _roll_windows(self, now: Optional[float] = None) -> None:
+        """ Resets the counters of the windows that are over. """
+        now = time.time() if now is None else now
+        short_window = int(now - now % SHORT_WINDOW)
+        long_window = int(now - now % LONG_WINDOW)
+        if short_window != self.short_window:
+            self.short_window = short_window
+            self.short_usage = 0
+        if long_window != self.long_window:
+            self.long_window = long_window
+            self.long_usage = 0
+
+    def seconds_to_short_reset(self) -> float:
+        """ Seconds until the 15 minutes window is reset. """
+        return self.short_window + SHORT_WINDOW - time.time()
+
+    def seconds_to_long_reset(self) -> float:
+        """ Seconds until the daily window is reset. """
+        return self.long_window + LONG_WINDOW - time.time()
+
+    def try_acquire(self) -> float:
+        """ Reserves a request in both windows if the 15 minutes window has
+        room for it.
+
+        Returns:
+            float: 0 if the request was reserved, otherwise, the seconds until
+            the 15 minutes window is reset.
+
+        Raises:
+            RateLimitExceeded: if the daily limit has been reached.
+        """
+        with self._lock:
+            now = time.time()
+            self._roll_windows(now)
+            if self.long_usage >= self.long_limit:
+                remaining_time = self.seconds_to_long_reset()
+                logger.warning('The daily limit of {} requests has been reached. It will be '
+                               'reset in {:0.0f} minutes.', self.long_limit, remaining_time / 60)
+                metrics.increment('rate_limit_daily_exhausted')
+                # Imported here as stravalib is slow to import and most commands do not need it
+                from stravalib import exc
+                raise exc.RateLimitExceeded('Daily rate limit exceeded.',
+                                            timeout=remaining_time, limit=self.long_limit)
+
+            if self.short_usage >= self.short_limit:
+                # Measured from the same time as the window, so it is never 0
+                return self.short_window + SHORT_WINDOW - now
+
+            self.short_usage += 1
+            self.long_usage += 1
+            self._save()
+            return 0
+
+    def acquire(self) -> None:
+        """ Reserves a request in both windows. If the 15 minutes window is
+        exhausted, it sleeps until the next quarter of the hour. The lock is
+        not held while sleeping, so the rest of workers can read the usage or
+        update it, and the window is checked again once it is reset.
+
+        Raises:
+            RateLimitExceeded: if the daily limit has been reached.
+        """
+        remaining_time = self.try_acquire()
+        while remaining_time:
+            sleep_until_reset(remaining_time)
+            remaining_time = self.try_acquire()
+
+    def release(self) -> None:
+        """ Gives back a request reserved with `acquire` that was not done. """
+        with self._lock:
+            self.short_usage = max(self.short_usage - 1, 0)
+            self.long_usage = max(self.long_usage - 1, 0)
+            self._save()
+
+    def remaining(self) -> int:
+        """ Requests that can be done before any of the windows is exhausted. """
+        with self._lock:
+            self._roll_windows()
+            return max(min(self.short_limit - self.short_usage, self.long_limit - self.long_usage), 0)
+
+    def remaining_today(self) -> int:
+        """ Requests that can be done before the daily window is exhausted. """
+        with self._lock:
+            self._roll_windows()
+            return max(self.long_limit - self.long_usage, 0)
+
+    def __call__(self, response_headers: Mapping[str, str], method: str = None) -> None:
+        """ Updates the counters with the usage reported by Strava. It follows
+        the signature of the stravalib rate limiters, so it is called after
+        every response of the client.
+
+        Args:
+            response_headers (dict): headers of the response.
+            method (str): method of the request. Unused, as the usage of the
+             read requests is also included in the general headers.
+        """
+        headers = {key.lower(): value for key, value in response_headers.items()}
+        if USAGE_HEADER not in headers or LIMIT_HEADER not in headers:
+            return
+
+        try:
+            short_usage, long_usage = (int(value) for value in headers[USAGE_HEADER].split(','))
+            short_limit, long_limit = (int(value) for value in headers[LIMIT_HEADER].split(','))
+        except ValueError:
+            logger.warning('Invalid rate limit headers: {}.', response_headers)
+            return
+
+        with self._lock:
+            self._roll_windows()
+            # Local reservations of requests in flight are not yet counted by Strava
+            self.short_usage = max(self.short_usage, short_usage)
+            self.long_usage = max(self.long_usage, long_usage)
+            if self.update_limits:
+                self.short_limit = short_limit
+                self.long_limit = long_limit
+            self._save()
+
+        logger.trace('Strava rate limit usage. 15 minutes: {}/{}. Daily: {}/{}.',
+                     short_usage, short_limit, long_usage, long_limit)
+
+    def usage(self) -> Dict[str, int]:
+        """ Returns the current usage and limits of both windows. """
+        with self._lock:
+            self._roll_windows()
+            return {
+                'short_usage': self.short_usage,
+                'short_limit': self.short_limit,
+                'long_usage': self.long_usage,
+                'long_limit': self.long_limit
+            }
+
+
+class AccountRateLimiter:
+    """ Rate budget of an athlete inside the limits of the application.
+
+    Strava limits the requests of the application, that are shared by all the
+    athletes that authorized it. Every request of the athlete is reserved
+    both in their own budget and in the one of the application, and the usage
+    reported by Strava updates the application limiter. It has the interface
+    of `RateLimiter`, so the uploads and the poller use it in the same way.
+    """
+
+    def __init__(self, account: RateLimiter, application: RateLimiter):
+        """
+        Args:
+            account (RateLimiter): budget of the athlete. Its limits are not
+             updated with the ones reported by Strava.
+            application (RateLimiter): limiter of the application, shared by
+             all the athletes.
+        """
+        self.account = account
+        self.application = application
+
+    def try_acquire(self) -> float:
+        """ Reserves a request in the budget of the athlete and in the one of
+        the application if the 15 minutes window of both has room for it. The
+        reservation of the athlete is given back if the application has no
+        room, so it is not kept while waiting in a window that is over.
+
+        Returns:
+            float: 0 if the request was reserved, otherwise, the seconds until
+            the 15 minutes window is reset.
+
+        Raises:
+            RateLimitExceeded: if any of the daily limits has been reached.
+        """
+        remaining_time = self.account.try_acquire()
+        if remaining_time:
+            return remaining_time
+        try:
+            remaining_time = self.application.try_acquire()
+        except BaseException:
+            self.account.release()
+            raise
+        if remaining_time:
+            self.account.release()
+        return remaining_time
+
+    def acquire(self) -> None:
+        """ Reserves a request in the budget of the athlete and in the one of
+        the application, sleeping if the 15 minutes window of any of them is
+        exhausted.
+
+        Raises:
+            RateLimitExceeded: if any of the daily limits has been reached.
+        """
+        remaining_time = self.try_acquire()
+        while remaining_time:
+            sleep_until_reset(remaining_time)
+            remaining_time = self.try_acquire()
+
+    def remaining(self) -> int:
+        """ Requests that can be done before any of the budgets is exhausted. """
+        return min(self.account.remaining(), self.application.remaining())
+
+    def remaining_today(self) -> int:
+        """ Requests that can be done before any of the daily budgets is exhausted. """
+        return min(self.account.remaining_today(), self.application.remaining_today())
+
+    def seconds_to_short_reset(self) -> float:
+        """ Seconds until the 15 minutes window is reset, the same for both. """
+        return self.application.seconds_to_short_reset()
+
+    def __call__(self, response_headers: Mapping[str, str], method: str = None) -> None:
+        """ Updates the application limiter with the usage reported by Strava. """
+        self.application(response_headers, method)
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        """ Returns the usage and limits of the athlete and of the application. """
+        return {'account': self.account.usage(), 'application': self.application.usage()}
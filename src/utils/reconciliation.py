@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+utils/reconciliation.py
+=================
+Local index of the activities that the athlete already has in Strava, to skip
+the workouts of the export that were synced before the migration. The
+activities are listed 200 per request, so a few requests replace the uploads
+that Strava would reject as duplicates, and the index is saved beside the
+export to be reused by the next executions.
+"""
+import bisect
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+from stravalib import Client
+
+from utils.constants import REMOTE_PAGE_SIZE, REMOTE_INDEX_MAX_AGE, REMOTE_RANGE_MARGIN, \
+    RECONCILE_MIN_OVERLAP, DUPLICATE_START_TOLERANCE
+from utils.metrics import metrics
+from utils.rate_limiter import RateLimiter, AccountRateLimiter
+
+STRAVA_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Start time, elapsed seconds and id of a Strava activity
+RemoteActivity = Tuple[float, float, int]
+
+
+def parse_remote_activity(activity: Dict[str, Any]) -> Optional[RemoteActivity]:
+    """ Reads the start time and duration of an activity of the Strava API.
+
+    Args:
+        activity (dict): summary activity, from the list of activities.
+
+    Returns:
+        tuple: start time as timestamp, elapsed seconds and id, None if it has
+        no start time.
+    """
+    try:
+        start_time = datetime.strptime(activity['start_date'], STRAVA_TIME_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (start_time.replace(tzinfo=timezone.utc).timestamp(),
+            float(activity.get('elapsed_time') or 0), int(activity['id']))
+
+
+def fetch_remote_activities(client: Client,
+                            rate_limiter: Union[RateLimiter, AccountRateLimiter],
+                            after: float,
+                            before: float) -> List[RemoteActivity]:
+    """ Lists the activities of the athlete that start between two dates,
+    reserving every page in the rate budget.
+
+    Args:
+        client (Client): Strava client authorized by the athlete.
+        rate_limiter (RateLimiter): rate budget of the athlete.
+        after (float): timestamp of the earliest start time.
+        before (float): timestamp of the latest start time.
+
+    Returns:
+        list: start time, elapsed seconds and id of every activity.
+
+    Raises:
+        RateLimitExceeded: if the daily limit is reached before listing all
+         the activities.
+    """
+    activities = list()
+    page = 1
+    while True:
+        rate_limiter.acquire()
+        with metrics.time('reconcile_request_seconds'):
+            batch = client.protocol.get('/athlete/activities', after=int(after), before=int(before) + 1,
+                                        page=page, per_page=REMOTE_PAGE_SIZE)
+        metrics.increment('reconcile_requests')
+        activities.extend(activity for activity in map(parse_remote_activity, batch) if activity)
+        if len(batch) < REMOTE_PAGE_SIZE:
+            break
+        page += 1
+
+    logger.info('Listed {} activities of the athlete in {} requests.', len(activities), page)
+    return activities
+
+
+class RemoteIndex:
+    """ Activities of the athlete in Strava, sorted by start time. The index
+    is saved with the range of dates it covers and the time it was listed,
+    and it is listed again once it is older than a day or when the pending
+    workouts go beyond that range.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path (Path): path to the JSON file of the index.
+        """
+        self.path = path
+        self.after = self.before = self.listed_at = 0.0
+        self.activities: List[RemoteActivity] = list()
+        self._starts: List[float] = list()
+        self._max_duration = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        """ Loads the saved index, if any. """
+        if not self.path.is_file():
+            return
+        try:
+            with open(self.path, 'r') as file:
+                state = json.load(file)
+            self._set(state['after'], state['before'], state['listed_at'],
+                      [tuple(activity) for activity in state['activities']])
+        except (ValueError, KeyError, TypeError):
+            logger.warning('The index of Strava activities in `{}` could not be read. Listing them again.',
+                           self.path)
+
+    def _save(self) -> None:
+        """ Writes the index to a temporary file and replaces the previous one. """
+        state = {'after': self.after, 'before': self.before, 'listed_at': self.listed_at,
+                 'activities': self.activities}
+        temporal_path = self.path.with_name(f'{self.path.name}.tmp')
+        with open(temporal_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporal_path, self.path)
+
+    def _set(self, after: float, before: float, listed_at: float, activities: List[RemoteActivity]) -> None:
+        self.after, self.before, self.listed_at = after, before, listed_at
+        self.activities = sorted(activities)
+        self._starts = [start_time for start_time, _, _ in self.activities]
+        self._max_duration = max((duration for _, duration, _ in self.activities), default=0.0)
+
+    def is_valid(self, after: float, before: float) -> bool:
+        """ Checks if the index covers a range of dates and is recent. """
+        return self.after <= after and before <= self.before and \
+            time.time() - self.listed_at <= REMOTE_INDEX_MAX_AGE
+
+    def update(self,
+               client: Client,
+               rate_limiter: Union[RateLimiter, AccountRateLimiter],
+               after: float,
+               before: float) -> None:
+        """ Lists the activities of the athlete in a range of dates, widened
+        with a margin, unless the saved index already covers it.
+
+        Args:
+            client (Client): Strava client authorized by the athlete.
+            rate_limiter (RateLimiter): rate budget of the athlete.
+            after (float): timestamp of the earliest start time of the export.
+            before (float): timestamp of the latest start time of the export.
+        """
+        if self.is_valid(after, before):
+            logger.info('Using the index of {} Strava activities saved in `{}`.', len(self.activities), self.path)
+            return
+
+        after, before = after - REMOTE_RANGE_MARGIN, before + REMOTE_RANGE_MARGIN
+        listed_at = time.time()
+        self._set(after, before, listed_at, fetch_remote_activities(client, rate_limiter, after, before))
+        self._save()
+
+    def find_match(self, start_time: float, duration: Optional[float]) -> Optional[int]:
+        """ Finds the Strava activity that overlaps with a workout. They match
+        if they start at the same time or if they overlap during most of the
+        shortest one.
+
+        Args:
+            start_time (float): timestamp of the start of the workout.
+            duration (float): seconds of the workout, None if unknown.
+
+        Returns:
+            int: id of the Strava activity, None if there is no match.
+        """
+        end_time = start_time + (duration or 0)
+        # Only the activities that start before the end of the workout, and not too long before it, can overlap
+        index = bisect.bisect_right(self._starts, max(end_time, start_time + DUPLICATE_START_TOLERANCE))
+        while index > 0:
+            index -= 1
+            remote_start, remote_duration, activity_id = self.activities[index]
+            if remote_start < start_time - max(self._max_duration, DUPLICATE_START_TOLERANCE):
+                break
+            if abs(remote_start - start_time) <= DUPLICATE_START_TOLERANCE:
+                return activity_id
+            overlap = min(end_time, remote_start + remote_duration) - max(start_time, remote_start)
+            shortest = min(duration or 0, remote_duration)
+            if shortest > 0 and overlap >= RECONCILE_MIN_OVERLAP * shortest:
+                return activity_id
+        return None
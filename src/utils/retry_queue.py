@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+utils/retry_queue.py
+=================
+Retries of the uploads that failed with a transient error, such as a
+network error or an upload that Strava did not process in time. The
+permanent errors, such as duplicates or files rejected by Strava, are never
+retried, so no requests are spent sending them again.
+"""
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils.constants import TRANSIENT_ERRORS, RETRY_INITIAL_DELAY, RETRY_BACKOFF_FACTOR, RETRY_MAX_DELAY
+
+
+def is_transient_error(error_class: Optional[str]) -> bool:
+    """ Checks if an upload that failed with the error can succeed if it is
+    sent again.
+
+    Args:
+        error_class (str): class of the error, from `UploadResult`.
+
+    Returns:
+        bool: True if the error is transient.
+    """
+    return error_class in TRANSIENT_ERRORS
+
+
+def get_retry_delay(retries: int) -> float:
+    """ Obtains the seconds to wait before retrying an upload, that grow
+    exponentially with the retries already done.
+
+    Args:
+        retries (int): number of retries already done.
+
+    Returns:
+        float: seconds until the next attempt.
+    """
+    return min(RETRY_INITIAL_DELAY * RETRY_BACKOFF_FACTOR ** retries, RETRY_MAX_DELAY)
+
+
+class RetryQueue:
+    """ Activities waiting to be retried, sorted by the time of their next
+    attempt.
+    """
+
+    def __init__(self, retries: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            retries (dict): timestamp of the next attempt of each activity,
+             such as the ones scheduled in the manifest.
+        """
+        self._heap: List[Tuple[float, str]] = [(next_attempt, activity)
+                                               for activity, next_attempt in (retries or {}).items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, activity: str, next_attempt: float) -> None:
+        """ Schedules the retry of an activity.
+
+        Args:
+            activity (str): name of the activity.
+            next_attempt (float): timestamp of the next attempt.
+        """
+        heapq.heappush(self._heap, (next_attempt, activity))
+
+    def pop_due(self, now: Optional[float] = None) -> Optional[str]:
+        """ Obtains the next activity whose retry is due.
+
+        Args:
+            now (float): current timestamp. By default, the current time.
+
+        Returns:
+            str: name of the activity, None if no retry is due.
+        """
+        if self._heap and self._heap[0][0] <= (now or time.time()):
+            return heapq.heappop(self._heap)[1]
+        return None
+
+    @property
+    def next_attempt(self) -> Optional[float]:
+        """ Timestamp of the next retry, None if there are none. """
+        return self._heap[0][0] if self._heap else None
@@ -4,22 +4,135 @@ utils/strava.py
 =================
 Utility class to Strava API
 """
-import json
-import time
+import random
 from configparser import ConfigParser, NoOptionError
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, IO, NamedTuple, Optional, Set
 
+import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
 from stravalib import Client, exc
+from urllib3.util.retry import Retry
 
 from utils.parameters import SECRET
-from utils.constants import CONFIG_PATH, CODE_ID_FILE_NAME, TOKEN_FILE_NAME
+from utils.constants import CONFIG_PATH, CODE_ID_FILE_NAME, TOKEN_FILE_NAME, DUPLICATE, HTTP_CONNECT_TIMEOUT, \
+    HTTP_READ_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF_FACTOR, HTTP_BACKOFF_MAX, HTTP_RETRY_STATUSES, HTTP_POST_RETRY_STATUSES, \
+    HTTP_POOL_HEADROOM, FALLBACK_WORKERS, SERVER_ERROR, INVALID_RESPONSE
 from utils.files_handler import check_folder
+from utils.rate_limiter import RateLimiter
+from utils.token_manager import TokenManager
 from utils.parameters import STRAVA, CLIENT_ID
 
 
+class UploadResult(NamedTuple):
+    """ Result of the upload of an activity. """
+    success: bool
+    upload_id: Optional[int] = None
+    error_class: Optional[str] = None
+
+
+class JitteredRetry(Retry):
+    """ Retry policy with exponential backoff and full jitter, so the workers
+    that failed at the same time do not retry at the same time.
+
+    The uploads are retried on connection errors, when the file was not sent,
+    and on the statuses answered before processing it. After a read error or
+    other server errors Strava may have accepted the file, and sending it
+    again would be rejected as a duplicate of the uploaded activity.
+    """
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == 'POST':
+            return status_code in HTTP_POST_RETRY_STATUSES
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def is_missing_permission(response: requests.Response) -> bool:
+    """ Checks if a request was rejected because the athlete did not grant
+    a permission, such as `activity:read_permission`, which a new access token
+    does not solve.
+    """
+    try:
+        errors = response.json().get('errors') or []
+    except (ValueError, AttributeError):
+        return False
+    return any(str(error.get('field', '')).endswith('_permission') for error in errors if isinstance(error, dict))
+
+
+def get_granted_scopes(client: Client) -> Optional[Set[str]]:
+    """ Obtains the permissions granted by the athlete, saved with the token
+    by `request_auth.py`.
+
+    Args:
+        client (Client): Strava client created by `get_strava_client`.
+
+    Returns:
+        set: granted scopes, None if they are unknown, as in the tokens
+        obtained by previous versions.
+    """
+    token_manager = getattr(client.protocol.rsession, 'token_manager', None)
+    scope = token_manager.token.get('scope') if token_manager else None
+    return set(scope.split(',')) if scope is not None else None
+
+
+class StravaSession(requests.Session):
+    """ Keep-alive session for the Strava API. The connections are pooled
+    and reused by all the uploads, the transient errors are retried and every
+    request has a timeout.
+
+    If a token manager is set, the authorized requests are sent with its
+    access token, that is refreshed before it expires. A request rejected as
+    unauthorized is sent once more with a new token.
+    """
+
+    def __init__(self,
+                 pool_size: int = FALLBACK_WORKERS + HTTP_POOL_HEADROOM,
+                 token_manager: Optional[TokenManager] = None):
+        """
+        Args:
+            pool_size (int): connections kept open, at least one per
+             concurrent request.
+            token_manager (TokenManager): manager of the access token.
+        """
+        super().__init__()
+        self.token_manager = token_manager
+        # The read errors are only retried for the requests without side effects, not for the uploads
+        retry = JitteredRetry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR,
+                              backoff_max=HTTP_BACKOFF_MAX, status_forcelist=HTTP_RETRY_STATUSES,
+                              allowed_methods=frozenset({'GET'}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method: str, url: str, *args, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        authorized = self.token_manager is not None and 'Authorization' in (kwargs.get('headers') or {})
+        if authorized:
+            self._set_authorization(kwargs, self.token_manager.get_access_token())
+
+        response = super().request(method, url, *args, **kwargs)
+        if authorized and response.status_code == 401 and self.token_manager.can_refresh and \
+                not is_missing_permission(response):
+            logger.warning('The access token was rejected by Strava. Refreshing it.')
+            self._set_authorization(kwargs, self.token_manager.refresh())
+            # The files were read by the first request
+            for file in (kwargs.get('files') or {}).values():
+                if hasattr(file, 'seek'):
+                    file.seek(0)
+            response = super().request(method, url, *args, **kwargs)
+        return response
+
+    @staticmethod
+    def _set_authorization(kwargs: dict, access_token: str) -> None:
+        """ Sets the access token in the headers of the request. """
+        kwargs['headers'] = dict(kwargs['headers'], Authorization=f'Bearer {access_token}')
+
+
 def get_client_id(app_config: ConfigParser) -> int:
     """ Obtains the client ID from the configuration file.
 
@@ -99,6 +212,30 @@ def get_strava_token_from_code_id(config: ConfigParser) -> str:
         raise ValueError('No valid temporal code access found. Rerun `request_auth.py` '
                          'to obtain the temporal access.')
 
+    return exchange_code_for_token(config, code_id)['access_token']
+
+
+def exchange_code_for_token(config: ConfigParser,
+                            code_id: str,
+                            token_path: Optional[Path] = None,
+                            scope: Optional[str] = None) -> Dict[str, Any]:
+    """ Exchanges the temporal authentication code for the access token and
+    saves it in the token file. The file is replaced atomically, so an
+    interruption never leaves it corrupt.
+
+    Args:
+        config (ConfigParser): app configuration.
+        code_id (str): temporal authentication code from the authorization.
+        token_path (Path): path to the token file. By default,
+         `config/token.json`.
+        scope (str): permissions granted by the athlete, separated by
+         commas. They are saved with the token, as Strava does not return
+         them along with it.
+
+    Returns:
+        dict: token with the access token, refresh token and expiration
+        timestamp.
+    """
     client = Client()
     token = client.exchange_code_for_token(client_id=get_client_id(config),
                                            client_secret=get_secret(config),
@@ -111,129 +248,179 @@ def get_strava_token_from_code_id(config: ConfigParser) -> str:
                  token['access_token'], token['refresh_token'])
 
     # Save JSON with the response
-    save_path = Path(check_folder(CONFIG_PATH), TOKEN_FILE_NAME)
-    with open(save_path, 'w') as file:
-        logger.info('Writing token information to `{}`.', save_path)
-        json.dump(token, file, indent=4)
+    token_path = Path(token_path or Path(CONFIG_PATH, TOKEN_FILE_NAME))
+    save_path = Path(check_folder(token_path.parent), token_path.name)
+    token = dict(token)
+    if scope is not None:
+        token['scope'] = scope
+    TokenManager(save_path, get_client_id(config), get_secret(config)).save(token)
+    return token
+
+
+def get_strava_client(config: ConfigParser,
+                      rate_limiter: Optional[RateLimiter] = None,
+                      concurrency: int = FALLBACK_WORKERS,
+                      token_path: Optional[Path] = None) -> Client:
+    """ Checks the authentication token and generates the Strava client. The
+    client uses a `StravaSession`, shared by all the threads, that refreshes
+    the access token before it expires.
 
-    return token['access_token']
+    Args:
+        config (ConfigParser): app configuration.
+        rate_limiter (RateLimiter): rate limiter that will be updated with the
+         usage reported by Strava after every request.
+        concurrency (int): number of concurrent uploads, to size the
+         connection pool.
+        token_path (Path): token file of the athlete, when uploading for
+         several ones. By default, `config/token.json`, that is obtained from
+         the temporal authentication code if it does not exist.
 
+    Returns:
+        if exist, strava client configured with the authentication token.
 
-def get_strava_client(config: ConfigParser) -> Client:
-    """ Checks the authentication token and generates the Strava client.
+    Raises:
+        ValueError: if the token file of the athlete does not exist or has no
+         access token.
+    """
+    if token_path is not None:
+        token_manager = TokenManager(token_path, get_client_id(config), get_secret(config))
+        if not token_manager.token.get('access_token'):
+            raise ValueError(f'No access token found in `{token_path}`. Execute `request_auth.py` '
+                             f'with the athlete account and save the token file in that path.')
+    else:
+        token_manager = get_default_token_manager(config)
+
+    token = token_manager.get_access_token()
+
+    session = StravaSession(pool_size=concurrency + HTTP_POOL_HEADROOM, token_manager=token_manager)
+    client = Client(access_token=token, rate_limiter=rate_limiter, requests_session=session)
+    return client
+
+
+def get_default_token_manager(config: ConfigParser) -> TokenManager:
+    """ Obtains the manager of the token saved in `config/token.json`. If the
+    file does not exist or has no access token, it is obtained from the
+    temporal authentication code.
 
     Args:
         config (ConfigParser): app configuration.
 
     Returns:
-        if exist, strava client configured with the authentication token.
+        TokenManager: manager of the access token.
     """
     token_file_path = Path(check_folder(CONFIG_PATH), TOKEN_FILE_NAME)
     if token_file_path.is_file():
         logger.debug('The token info file (`config/token.json`) was found.')
-        with open(token_file_path, 'r') as file:
-            token_data = json.load(file)
-
-        token = token_data.get('access_token')
-        # If the file exists but no access token found, check against the temporary auth
-        if not token:
-            logger.warning('The token info file (`config/token.json`) was found'
-                           ' but the access token could not be read.')
-            token = get_strava_token_from_code_id(config)
-
     else:
         logger.info('The token info file (`config/token.json`) was NOT found. '
                     'Retrieving from the temporal authentication code.')
-        token = get_strava_token_from_code_id(config)
+        get_strava_token_from_code_id(config)
 
-    client = Client(access_token=token)
-    return client
+    token_manager = TokenManager(token_file_path, get_client_id(config), get_secret(config))
+    # If the file exists but no access token found, check against the temporary auth
+    if not token_manager.token.get('access_token'):
+        logger.warning('The token info file (`config/token.json`) was found'
+                       ' but the access token could not be read.')
+        get_strava_token_from_code_id(config)
+        token_manager.load()
+
+    return token_manager
+
+
+def get_data_type(file_path: Path) -> str:
+    """ Obtains the Strava data type of the activity file from its extension.
+
+    Args:
+        file_path (Path): Path to the activity file.
+
+    Returns:
+        str: Strava data type, such as `tcx` or `tcx.gz`.
+    """
+    suffixes = [suffix.lower().lstrip('.') for suffix in file_path.suffixes]
+    if suffixes and suffixes[-1] == 'gz' and len(suffixes) > 1:
+        return f'{suffixes[-2]}.gz'
+    return suffixes[-1]
 
 
-def upload_activity(client: Client, activity_type: str, file_path: Path) -> bool:
+def get_upload_error_class(error: Exception) -> str:
+    """ Obtains the class of the error of a failed upload. The uploads that
+    Strava rejects because the activity already exists are set as duplicates.
+    The errors that can succeed if the upload is sent again are classified by
+    their type and status code, so all of them are retried: the answers with
+    a 5xx or 429 status, whatever the exception raised for them, the network
+    errors and the answers that could not be read.
+
+    Args:
+        error (Exception): error raised by the upload.
+
+    Returns:
+        str: class of the error.
+    """
+    if 'duplicate of' in str(error).lower():
+        return DUPLICATE
+    response = getattr(error, 'response', None)
+    if isinstance(error, requests.HTTPError) and response is not None and \
+            (response.status_code == 429 or response.status_code >= 500):
+        return SERVER_ERROR
+    if isinstance(error, requests.Timeout):
+        return 'Timeout'
+    if isinstance(error, (requests.ConnectionError, requests.exceptions.RetryError)):
+        return 'ConnectionError'
+    if isinstance(error, (ValueError, requests.exceptions.ChunkedEncodingError,
+                          requests.exceptions.ContentDecodingError)):
+        return INVALID_RESPONSE
+    return error.__class__.__name__
+
+
+def upload_activity(client: Client,
+                    activity_type: str,
+                    activity_file: IO[bytes],
+                    data_type: str,
+                    activity_name: str) -> UploadResult:
     """ Helper method to upload the activity to Strava. This method will handle
     the different possibilities when uploading an activity.
 
     Args:
         client (Client): configured Strava client.
         activity_type (str): Strava activity string.
-        file_path (Path): Path to the `*.tcx` activity file.
+        activity_file (IO[bytes]): opened activity file.
+        data_type (str): Strava data type of the file, such as `tcx` or `tcx.gz`.
+        activity_name (str): name of the activity, used in the logs.
 
     Returns:
-        bool: True if the activity have been uploaded successfully. False otherwise.
+        UploadResult: if the activity have been uploaded successfully, along with
+        the id of the upload or the class of the error.
 
     Raises:
         RateLimitExceeded: When the API limits have been reached. Generally when
         more than 1000 petitions have been done during the day.
-        ConnectionError: When it has been impossible to connect the Strava servers.
         Exception: Unknown exceptions that will be logged in detail.
     """
     try:
-        activity_file = open(file_path, 'r')
-        client.upload_activity(
+        uploader = client.upload_activity(
             activity_file=activity_file,
-            data_type='tcx',
+            data_type=data_type,
             activity_type=activity_type,
             private=False
         )
-    except exc.ActivityUploadFailed:
-        logger.exception('Error uploading the activity `{}`.', file_path.stem)
-        return False
+    except exc.ActivityUploadFailed as error:
+        # Strava answers the uploads over the limit with a failed upload
+        if 'rate limit' in str(error).lower():
+            logger.error('The upload of `{}` was rejected by the API rate limit.', activity_name)
+            raise exc.RateLimitExceeded(str(error))
+        logger.exception('Error uploading the activity `{}`.', activity_name)
+        return UploadResult(success=False, error_class=get_upload_error_class(error))
     except exc.RateLimitExceeded:
         logger.exception('Exceeded the API rate limit.')
         raise
-    except ConnectionError:
-        logger.exception('No internet connection.')
-        raise
+    except requests.RequestException as error:
+        # The session already retried it, the activity is left for another execution
+        logger.error('The upload of `{}` failed after {} retries: {}', activity_name, HTTP_RETRIES, error)
+        return UploadResult(success=False, error_class=get_upload_error_class(error))
     except Exception:
         logger.exception('Unknown exception')
         raise
 
     # If no error return true
-    logger.debug('Activity `{}` uploaded sucessfully.', file_path.stem)
-    return True
-
-
-def handle_rate_limit(start_time: float, requests: int) -> Tuple[float, int]:
-    """ Method to handle the 15 minutes API limit. This method will check the
-    elapsed time since the first request and the number of them. Three cases
-    are possible:
-
-    - Less than 15 minutes elapsed from the first request and less than 100
-      requests -> continue.
-    - More than 15 minutes elapsed from the first request and less than 100
-      requests -> reset timer and request number to count from 0 again.
-    - Less than 15 minutes elapsed from the first request but more than 100
-      requests -> sleep until the 15 minutes block is over and reset timer
-      and request number to count from 0 again.
-
-    Args:
-        start_time (float): timestamp of the first request of the block.
-        requests (int): number of request done in the block.
-
-    Returns:
-        float, int: updated start time and number of requests following the
-                    possible cases.
-    """
-    requests += 1
-    elapsed_time = time.time() - start_time
-    if elapsed_time <= 60 * 15:
-        if requests >= 100:
-            remaining_time_stopped = 60 * 15 - elapsed_time
-            mins, secs = divmod(remaining_time_stopped, 60)
-            logger.warning('The number of allowed request per 15 minutes have'
-                           'been reached. Sleeping for {:0.0f} minutes, {:0.1f} seconds.',
-                           mins, secs)
-            time.sleep(remaining_time_stopped)
-            # Reset values. Include petition to be processed
-            logger.info('Waiting time elapsed. Continuing with the process.')
-            requests = 1
-            start_time = time.time()
-
-    else:
-        logger.debug('15 minutes have been elapsed. Resetting requests and time.')
-        # Reset values. Include petition to be processed
-        requests = 1
-        start_time = time.time()
-
-    return start_time, requests
+    logger.debug('Activity `{}` uploaded sucessfully.', activity_name)
+    return UploadResult(success=True, upload_id=uploader.upload_id)
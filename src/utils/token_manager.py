@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+utils/token_manager.py
+=================
+Manager of the Strava access token. The access tokens expire after six
+hours, so it is refreshed with the refresh token before it expires and the new
+one is saved in the token file.
+"""
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from stravalib import Client
+
+from utils.constants import TOKEN_REFRESH_MARGIN
+
+
+class TokenManager:
+    """ Keeps a valid access token for the long executions. The token is
+    refreshed `TOKEN_REFRESH_MARGIN` seconds before it expires, so no request
+    is done with an expired one.
+
+    The token file is replaced atomically every time the token is refreshed.
+    Before refreshing, the file is read again in case other execution already
+    refreshed it. The instance is thread safe, only one worker refreshes the
+    token while the rest wait for it.
+    """
+
+    def __init__(self, token_path: Path, client_id: int, client_secret: str):
+        """
+        Args:
+            token_path (Path): path to the token file, with the access token,
+             the refresh token and the expiration timestamp.
+            client_id (int): client id of the Strava application.
+            client_secret (str): secret of the Strava application.
+        """
+        self.token_path = Path(token_path)
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token: Dict[str, Any] = dict()
+        self._lock = Lock()
+        self.load()
+
+    def load(self) -> None:
+        """ Reads the token file, keeping the current token if it cannot be read. """
+        if not self.token_path.is_file():
+            return
+        try:
+            with open(self.token_path, 'r') as file:
+                self.token = json.load(file)
+        except (OSError, ValueError):
+            logger.warning('The token file `{}` could not be read.', self.token_path)
+
+    def save(self, token: Dict[str, Any]) -> None:
+        """ Sets the token and saves it in the token file. It is written to a
+        temporal file first, so an interrupted write never corrupts it.
+
+        Args:
+            token (dict): token with the access token, refresh token and
+             expiration timestamp.
+        """
+        self.token = dict(token)
+        temporal_path = self.token_path.with_name(f'{self.token_path.name}.tmp')
+        with open(temporal_path, 'w') as file:
+            json.dump(self.token, file, indent=4)
+        os.replace(temporal_path, self.token_path)
+        logger.info('Token information saved in `{}`.', self.token_path)
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        """ Timestamp when the access token expires, None if unknown. """
+        expires_at = self.token.get('expires_at')
+        return float(expires_at) if expires_at is not None else None
+
+    @property
+    def can_refresh(self) -> bool:
+        """ Checks if there is a refresh token. """
+        return bool(self.token.get('refresh_token'))
+
+    def _needs_refresh(self) -> bool:
+        """ Checks if the token expires within the refresh margin. """
+        return self.expires_at is not None and self.expires_at - time.time() < TOKEN_REFRESH_MARGIN
+
+    def get_access_token(self) -> Optional[str]:
+        """ Obtains the access token, refreshing it first if it is about to
+        expire.
+
+        Returns:
+            str: valid access token, None if there is no token.
+        """
+        with self._lock:
+            if self._needs_refresh():
+                self.load()
+                if self._needs_refresh():
+                    self._refresh()
+            return self.token.get('access_token')
+
+    def refresh(self) -> Optional[str]:
+        """ Refreshes the access token even if it has not expired, for instance,
+        if Strava rejected it.
+
+        Returns:
+            str: new access token.
+        """
+        with self._lock:
+            self._refresh()
+            return self.token.get('access_token')
+
+    def _refresh(self) -> None:
+        """ Requests a new access token with the refresh token.
+
+        Raises:
+            ValueError: if there is no refresh token.
+        """
+        refresh_token = self.token.get('refresh_token')
+        if not refresh_token:
+            raise ValueError('The token file has no refresh token. Execute `request_auth.py` '
+                             'to obtain a new one.')
+
+        logger.info('Refreshing the Strava access token.')
+        token = dict(Client().refresh_access_token(client_id=self.client_id,
+                                                   client_secret=self.client_secret,
+                                                   refresh_token=refresh_token))
+        # The refreshed token keeps the permissions granted in the authorization
+        if 'scope' in self.token:
+            token.setdefault('scope', self.token['scope'])
+        self.save(token)
+        logger.debug('Access token refreshed until {}.',
+                     time.strftime('%d-%m-%Y %H:%M:%S', time.gmtime(self.expires_at)))
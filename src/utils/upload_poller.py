@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+utils/upload_poller.py
+=================
+Background polling of the status of the uploads. Strava processes the
+uploaded files asynchronously, so an upload is only successful once its
+status has been checked.
+"""
+import queue
+import time
+from threading import Thread, Condition
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from loguru import logger
+from stravalib import Client, exc
+from stravalib.client import ActivityUploader
+
+from utils.constants import POLL_INITIAL_INTERVAL, POLL_MAX_INTERVAL, POLL_BACKOFF_FACTOR, POLL_TIMEOUT, \
+    PROCESSING_TIMEOUT
+from utils.metrics import metrics
+from utils.rate_limiter import RateLimiter, AccountRateLimiter
+from utils.strava import UploadResult, get_upload_error_class
+
+
+class PendingUpload(NamedTuple):
+    """ Upload waiting to be checked. """
+    activity: str
+    uploader: ActivityUploader
+    submitted_at: float
+    next_check: float
+    interval: float
+
+
+class UploadPoller:
+    """ Checks the status of the submitted uploads in a background thread.
+
+    Each upload is checked after `POLL_INITIAL_INTERVAL` seconds and, while
+    Strava is still processing it, the interval is multiplied by
+    `POLL_BACKOFF_FACTOR` up to `POLL_MAX_INTERVAL`. The resolved uploads are
+    not checked anymore and their results are returned by `get_results`, so
+    the main thread does the bookkeeping. Every check reserves a request in
+    the rate limiter, and the waits for the limits are interrupted when the
+    poller is closed.
+    """
+
+    def __init__(self,
+                 client: Client,
+                 rate_limiter: Union[RateLimiter, AccountRateLimiter],
+                 wait_reset: bool = False):
+        """
+        Args:
+            client (Client): configured Strava client.
+            rate_limiter (RateLimiter): rate limiter shared with the uploads.
+            wait_reset (bool): wait until the daily limit is reset when it
+             is reached. Otherwise, the poller stops.
+        """
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.wait_reset = wait_reset
+        self._pending: Dict[int, PendingUpload] = dict()
+        self._results: 'queue.Queue[Tuple[str, UploadResult]]' = queue.Queue()
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, name='upload-poller', daemon=True)
+        self._thread.start()
+
+    def add(self, activity: str, upload_id: int, submitted_at: Optional[float] = None) -> None:
+        """ Adds an upload to be checked.
+
+        Args:
+            activity (str): name of the activity.
+            upload_id (int): id of the Strava upload.
+            submitted_at (float): timestamp of the submission. By default, now.
+        """
+        now = time.time()
+        uploader = ActivityUploader(self.client, response={'id': upload_id})
+        with self._condition:
+            self._pending[upload_id] = PendingUpload(activity, uploader, submitted_at or now,
+                                                     now + POLL_INITIAL_INTERVAL, POLL_INITIAL_INTERVAL)
+            self._condition.notify()
+
+    @property
+    def pending(self) -> int:
+        """ Number of uploads that have not been resolved. """
+        with self._condition:
+            return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        """ Checks if the poller is still checking uploads. """
+        return self._thread.is_alive()
+
+    def get_results(self, timeout: Optional[float] = None) -> List[Tuple[str, UploadResult]]:
+        """ Obtains the results of the resolved uploads.
+
+        Args:
+            timeout (float): seconds to wait for the first result. By default,
+             it does not wait.
+
+        Returns:
+            list: name of the activity and result of its upload.
+        """
+        results = list()
+        try:
+            results.append(self._results.get(timeout=timeout) if timeout else self._results.get_nowait())
+            while True:
+                results.append(self._results.get_nowait())
+        except queue.Empty:
+            pass
+        return results
+
+    def close(self) -> None:
+        """ Stops the background thread. The unresolved uploads remain
+        submitted, so they can be checked again in the next execution.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        """ Loop of the background thread. """
+        while True:
+            with self._condition:
+                while not self._stopped and not self._get_due_uploads():
+                    next_check = min((upload.next_check for upload in self._pending.values()), default=None)
+                    self._condition.wait(None if next_check is None else max(next_check - time.time(), 0))
+                if self._stopped:
+                    return
+                due_uploads = self._get_due_uploads()
+
+            for upload_id, upload in due_uploads:
+                try:
+                    remaining_time = self.rate_limiter.try_acquire()
+                except exc.RateLimitExceeded as error:
+                    if not self.wait_reset:
+                        logger.warning('The rate limit has been exceeded. {} uploads will be checked in the '
+                                       'next execution.', self.pending)
+                        return
+                    logger.info('The rate limit has been exceeded. The uploads will be checked once it is reset.')
+                    with self._condition:
+                        self._condition.wait_for(lambda: self._stopped, timeout=error.timeout or POLL_MAX_INTERVAL)
+                    break
+                if remaining_time:
+                    logger.debug('The 15 minutes limit has been reached. The uploads will be checked in {:0.0f} '
+                                 'seconds.', remaining_time)
+                    with self._condition:
+                        self._condition.wait_for(lambda: self._stopped, timeout=remaining_time)
+                    break
+                self._check(upload_id, upload)
+
+    def _get_due_uploads(self) -> List[Tuple[int, PendingUpload]]:
+        """ Obtains the uploads whose check time has arrived. """
+        now = time.time()
+        return [(upload_id, upload) for upload_id, upload in self._pending.items() if upload.next_check <= now]
+
+    def _check(self, upload_id: int, upload: PendingUpload) -> None:
+        """ Checks the status of an upload and resolves it or schedules the
+        next check.
+        """
+        result = None
+        try:
+            with metrics.time('status_check_seconds'):
+                # Requested without raising for the HTTP errors, as stravalib does when polling
+                response = upload.uploader.client.protocol.get('/uploads/{upload_id}', upload_id=upload_id,
+                                                               check_for_errors=False)
+            if 'id' in response:
+                upload.uploader.update_from_response(response)
+            else:
+                # The errors of the request, such as the rate limit or an expired token, are not upload
+                # statuses, the upload is checked again later
+                message = response.get('message') or response
+                if 'rate limit' in str(message).lower():
+                    metrics.increment('status_check_rate_limited')
+                logger.warning('The status of the upload of `{}` could not be checked: {}', upload.activity, message)
+        except (exc.ActivityUploadFailed, exc.CreatedActivityDeleted) as error:
+            logger.warning('The upload of `{}` failed: {}', upload.activity, upload.uploader.error or error)
+            result = UploadResult(success=False, upload_id=upload_id,
+                                  error_class=get_upload_error_class(error))
+        except Exception:
+            # Network errors and answers that are not JSON are checked again later
+            logger.exception('Error checking the upload of `{}`.', upload.activity)
+
+        if result is None and upload.uploader.is_complete:
+            logger.debug('Activity `{}` processed by Strava as activity {}.',
+                         upload.activity, upload.uploader.activity_id)
+            result = UploadResult(success=True, upload_id=upload_id)
+
+        if result is None and time.time() - upload.submitted_at > POLL_TIMEOUT:
+            logger.warning('The upload of `{}` is still being processed after {} seconds.',
+                           upload.activity, POLL_TIMEOUT)
+            result = UploadResult(success=False, upload_id=upload_id, error_class=PROCESSING_TIMEOUT)
+
+        if result is not None:
+            metrics.observe('processing_seconds', time.time() - upload.submitted_at)
+
+        with self._condition:
+            if result is None:
+                interval = min(upload.interval * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
+                self._pending[upload_id] = upload._replace(next_check=time.time() + interval, interval=interval)
+            else:
+                del self._pending[upload_id]
+                self._results.put((upload.activity, result))
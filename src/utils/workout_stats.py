@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+utils/workout_stats.py
+=================
+Statistics of the workouts of the export computed from the workout store.
+The segments between consecutive trackpoints of all the workouts are computed
+at once, and then added up per workout and per sport and year with
+`np.bincount`, so the statistics of the whole export take a few NumPy calls.
+"""
+from typing import Any, Dict, List
+
+import numpy as np
+
+from utils.constants import EARTH_RADIUS, MOVING_MIN_SPEED, MOVING_MAX_INTERVAL, HEART_RATE_ZONES
+from utils.workout_store import WorkoutStore
+
+
+def haversine(latitude_a: np.ndarray, longitude_a: np.ndarray,
+              latitude_b: np.ndarray, longitude_b: np.ndarray) -> np.ndarray:
+    """ Computes the great circle distance between two series of points.
+
+    Args:
+        latitude_a (np.ndarray): latitude in degrees of the first points.
+        longitude_a (np.ndarray): longitude in degrees of the first points.
+        latitude_b (np.ndarray): latitude in degrees of the second points.
+        longitude_b (np.ndarray): longitude in degrees of the second points.
+
+    Returns:
+        np.ndarray: distance in meters between every pair of points, NaN if
+        any of them has no position.
+    """
+    latitude_a, longitude_a, latitude_b, longitude_b = (np.radians(values) for values in
+                                                        (latitude_a, longitude_a, latitude_b, longitude_b))
+    a = np.sin((latitude_b - latitude_a) / 2) ** 2 + \
+        np.cos(latitude_a) * np.cos(latitude_b) * np.sin((longitude_b - longitude_a) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def get_heart_rate_zones(heart_rate: np.ndarray, max_heart_rate: float) -> np.ndarray:
+    """ Obtains the zone of every heart rate value, from 0 to the number of
+    limits in `HEART_RATE_ZONES`.
+
+    Args:
+        heart_rate (np.ndarray): heart rate in beats per minute.
+        max_heart_rate (float): maximum heart rate of the athlete.
+
+    Returns:
+        np.ndarray: zone of every value.
+    """
+    return np.digitize(heart_rate / max_heart_rate, HEART_RATE_ZONES)
+
+
+def compute_workout_stats(store: WorkoutStore, max_heart_rate: float) -> Dict[str, np.ndarray]:
+    """ Computes the statistics of every workout of the store. The distance
+    is the sum of the segments between trackpoints, the moving time the sum
+    of the segments faster than `MOVING_MIN_SPEED`, and the elevation gain
+    the sum of the climbs. The time of each segment counts for the heart rate
+    zone of its first point. The segments with gaps longer than
+    `MOVING_MAX_INTERVAL` are not counted. The workouts without track use the
+    distance and duration of their summary.
+
+    Args:
+        store (WorkoutStore): workout store.
+        max_heart_rate (float): maximum heart rate of the athlete.
+
+    Returns:
+        dict: distance in meters, moving time and elevation gain in meters of
+        every workout, and the seconds in every heart rate zone as a matrix
+        with a row per workout.
+    """
+    workouts_number = len(store)
+    track = store.track
+    counts = np.diff(store.offsets)
+    # Workout of the first point of every segment, the segments between two workouts are discarded
+    point_workout = np.repeat(np.arange(workouts_number), counts)
+    workout = point_workout[:-1]
+    same_workout = workout == point_workout[1:]
+
+    distance = haversine(track['latitude'][:-1], track['longitude'][:-1],
+                         track['latitude'][1:], track['longitude'][1:])
+    interval = np.diff(track['time'])
+    valid_interval = same_workout & (interval > 0) & (interval <= MOVING_MAX_INTERVAL)
+    distance = np.where(same_workout & ~np.isnan(distance), distance, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        moving = valid_interval & (distance / interval >= MOVING_MIN_SPEED)
+    climb = np.diff(track['altitude'])
+    climb = np.where(same_workout & (climb > 0), climb, 0)
+
+    def add_up(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(workout, weights=weights, minlength=workouts_number)
+
+    track_distance = add_up(distance)
+    moving_time = add_up(np.where(moving, interval, 0))
+    has_track = track_distance > 0
+    zones_number = len(HEART_RATE_ZONES) + 1
+    has_heart_rate = valid_interval & ~np.isnan(track['heart_rate'][:-1])
+    zones = get_heart_rate_zones(track['heart_rate'][:-1], max_heart_rate)
+    zone_seconds = np.bincount(workout[has_heart_rate] * zones_number + zones[has_heart_rate],
+                               weights=interval[has_heart_rate], minlength=workouts_number * zones_number)
+
+    return {
+        'distance_m': np.where(has_track, track_distance, np.nan_to_num(store.summary['distance_km']) * 1000),
+        'moving_time_s': np.where(has_track, moving_time, np.nan_to_num(store.summary['duration_s'])),
+        'elevation_gain_m': add_up(climb),
+        'heart_rate_zones_s': zone_seconds.reshape(workouts_number, zones_number)
+    }
+
+
+def aggregate_stats(store: WorkoutStore, workout_stats: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """ Adds up the statistics of the workouts per sport and year.
+
+    Args:
+        store (WorkoutStore): workout store.
+        workout_stats (dict): statistics of every workout, from `compute_workout_stats`.
+
+    Returns:
+        list(dict): sport, year, number of workouts, distance in kilometers,
+        moving time in hours, elevation gain in meters and hours in every
+        heart rate zone, sorted by year and sport. The year is None for the
+        workouts without start time.
+    """
+    start_time = store.summary['start_time']
+    has_start = ~np.isnan(start_time)
+    years = np.zeros(len(store), dtype=np.int64)
+    years[has_start] = start_time[has_start].astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+    groups, group = np.unique(np.rec.fromarrays([years, store.sports], names='year,sport'), return_inverse=True)
+    group = group.reshape(-1)
+
+    def add_up(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(group, weights=weights, minlength=len(groups))
+
+    workouts = add_up(np.ones(len(store)))
+    distance = add_up(workout_stats['distance_m'])
+    moving_time = add_up(workout_stats['moving_time_s'])
+    elevation_gain = add_up(workout_stats['elevation_gain_m'])
+    zones = np.stack([add_up(column) for column in workout_stats['heart_rate_zones_s'].T], axis=1) \
+        if len(store) else np.zeros((0, len(HEART_RATE_ZONES) + 1))
+
+    return [{
+        'sport': str(groups[index].sport),
+        'year': int(groups[index].year) or None,
+        'workouts': int(workouts[index]),
+        'distance_km': round(float(distance[index]) / 1000, 2),
+        'moving_time_h': round(float(moving_time[index]) / 3600, 2),
+        'elevation_gain_m': round(float(elevation_gain[index]), 1),
+        'heart_rate_zones_h': [round(float(seconds) / 3600, 2) for seconds in zones[index]]
+    } for index in range(len(groups))]
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+utils/workout_store.py
+=================
+Columnar copy of the workouts of the export, saved as NumPy arrays in a
+`.npz` file beside the export. The summary of the workouts is kept in one
+array per field and the trackpoints of all of them are concatenated, with the
+offset where each workout starts, so the statistics are computed over the
+whole export with vectorized operations instead of parsing the JSON files.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from tqdm import tqdm
+
+from parsers.endomondo import retrieve_json_data, get_activity_summary, get_activity_points, get_points_arrays
+from utils.constants import ANALYZER_CHUNKS_PER_WORKER
+from utils.files_handler import get_activity_file_signature
+
+SUMMARY_FIELDS = ('start_time', 'duration_s', 'distance_km')
+TRACK_FIELDS = ('time', 'latitude', 'longitude', 'altitude', 'heart_rate')
+
+
+def _get_signature_values(signature: Dict[str, Any]) -> Tuple[int, int]:
+    """ Obtains the size and the modification time, or the CRC inside an
+    export archive, of the signature of a file.
+    """
+    return signature['size'], signature.get('mtime', signature.get('crc'))
+
+
+def read_workouts(activities_folder: str,
+                  activities: List[Tuple[str, Dict]]) -> List[Tuple[str, Dict, Dict, Dict]]:
+    """ Reads the summary and the track of a group of workouts. It is executed
+    in the workers of the process pool.
+
+    Args:
+        activities_folder (str): path to the workouts folder or export archive.
+        activities (list): name of the workouts along with the signature of
+         their JSON file.
+
+    Returns:
+        list: name, signature, summary and arrays of the track of every
+        workout. The workouts that could not be read are left out.
+    """
+    workouts = list()
+    for activity, signature in activities:
+        try:
+            activity_data = retrieve_json_data(activities_folder, activity)
+        except (OSError, ValueError):
+            logger.warning('The workout `{}` could not be read. It is left out of the store.', activity)
+            continue
+        arrays = get_points_arrays(get_activity_points(activity_data))
+        workouts.append((activity, signature, get_activity_summary(activity_data),
+                         {field: arrays[field] for field in TRACK_FIELDS}))
+    return workouts
+
+
+class WorkoutStore:
+    """ Summaries and trackpoints of the workouts of an export. The workouts
+    are identified by the signature of their JSON file, so only the new or
+    modified ones are read when the store is updated.
+
+    Attributes:
+        names (np.ndarray): name of every workout.
+        sports (np.ndarray): Endomondo sport of every workout.
+        summary (dict): start time (as timestamp), duration in seconds and
+         distance in kilometers of every workout, NaN if missing.
+        offsets (np.ndarray): position of the first trackpoint of every
+         workout, with the total number of trackpoints at the end.
+        track (dict): time (as timestamp), latitude, longitude, altitude and
+         heart rate of all the trackpoints, NaN if missing.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path (Path): path to the `.npz` file of the store. It is loaded if
+             it exists.
+        """
+        self.path = Path(path)
+        self._set_columns({})
+        self._modified = False
+
+        if self.path.is_file():
+            try:
+                with np.load(self.path, allow_pickle=False) as data:
+                    self._set_columns({name: data[name] for name in data.files})
+            except (OSError, ValueError, KeyError):
+                logger.warning('The workout store `{}` could not be read. Starting from zero.', self.path)
+                self._set_columns({})
+        logger.debug('Loaded {} workouts from the store `{}`.', len(self), self.path)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _set_columns(self, columns: Dict[str, np.ndarray]) -> None:
+        """ Sets the arrays of the store, empty if they are missing. """
+        self.names = columns.get('names', np.array([], dtype=str))
+        self.sports = columns.get('sports', np.array([], dtype=str))
+        self._sizes = columns.get('sizes', np.array([], dtype=np.int64))
+        self._stamps = columns.get('stamps', np.array([], dtype=np.int64))
+        self.summary = {field: columns.get(field, np.array([], dtype=float)) for field in SUMMARY_FIELDS}
+        self.offsets = columns.get('offsets', np.zeros(1, dtype=np.int64))
+        self.track = {field: columns.get(f'track_{field}', np.array([], dtype=float)) for field in TRACK_FIELDS}
+
+    def get_track(self, index: int) -> Dict[str, np.ndarray]:
+        """ Obtains the trackpoints of a workout.
+
+        Args:
+            index (int): position of the workout in the store.
+
+        Returns:
+            dict: arrays of the trackpoints of the workout.
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return {field: values[start:end] for field, values in self.track.items()}
+
+    def update(self, activities_folder: str, activities: Iterable[str], workers: Optional[int] = None) -> int:
+        """ Updates the store with the workouts of the export. The workouts
+        whose JSON file has not changed are kept, the removed ones are dropped
+        and the new or modified ones are read in a pool of processes.
+
+        Args:
+            activities_folder (str): path to the workouts folder or export archive.
+            activities (iterable): names of the activities of the export.
+            workers (int): number of processes. By default, the number of CPUs.
+
+        Returns:
+            int: number of workouts read.
+        """
+        stored = {name: index for index, name in enumerate(self.names.tolist())}
+        kept, pending_activities = list(), list()
+        for activity in activities:
+            signature = get_activity_file_signature(activities_folder, activity, 'json')
+            index = stored.get(activity)
+            if index is not None and \
+                    (self._sizes[index], self._stamps[index]) == _get_signature_values(signature):
+                kept.append(index)
+            else:
+                pending_activities.append((activity, signature))
+
+        if not pending_activities and len(kept) == len(self):
+            return 0
+
+        workouts = list()
+        if pending_activities:
+            logger.info('Reading {} workouts into the store.', len(pending_activities))
+            workers = workers or os.cpu_count() or 1
+            chunks_number = workers * ANALYZER_CHUNKS_PER_WORKER
+            chunks = [pending_activities[index::chunks_number] for index in range(chunks_number)]
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(read_workouts, activities_folder, chunk) for chunk in chunks if chunk]
+                with tqdm(total=len(pending_activities)) as progress_bar:
+                    for future in as_completed(futures):
+                        results = future.result()
+                        workouts.extend(results)
+                        progress_bar.update(len(results))
+
+        self._merge(np.array(kept, dtype=np.int64), workouts)
+        self._modified = True
+        return len(pending_activities)
+
+    def _merge(self, kept: np.ndarray, workouts: List[Tuple[str, Dict, Dict, Dict]]) -> None:
+        """ Builds the arrays with the workouts kept and the ones read. """
+        counts = np.diff(self.offsets)[kept]
+        # Positions of the trackpoints of the kept workouts, without a loop per workout
+        starts = np.repeat(self.offsets[:-1][kept] - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+        kept_points = starts + np.arange(counts.sum(), dtype=np.int64)
+
+        signatures = [_get_signature_values(signature) for _, signature, _, _ in workouts]
+        columns = {
+            'names': np.concatenate((self.names[kept], np.array([workout[0] for workout in workouts], dtype=str))),
+            'sports': np.concatenate((self.sports[kept],
+                                      np.array([workout[2]['sport'] or 'OTHER' for workout in workouts],
+                                               dtype=str))),
+            'sizes': np.concatenate((self._sizes[kept], np.array([size for size, _ in signatures],
+                                                                 dtype=np.int64))),
+            'stamps': np.concatenate((self._stamps[kept], np.array([stamp for _, stamp in signatures],
+                                                                   dtype=np.int64))),
+            'offsets': np.concatenate(([0], np.cumsum(np.concatenate(
+                (counts, np.array([len(workout[3]['time']) for workout in workouts], dtype=np.int64))))))
+        }
+        for field in SUMMARY_FIELDS:
+            values = [workout[2][field] for workout in workouts]
+            columns[field] = np.concatenate((self.summary[field][kept], np.array(
+                [value if isinstance(value, (int, float)) else np.nan for value in values], dtype=float)))
+        for field in TRACK_FIELDS:
+            columns[f'track_{field}'] = np.concatenate([self.track[field][kept_points]] +
+                                                       [workout[3][field] for workout in workouts])
+        self._set_columns(columns)
+
+    def save(self) -> None:
+        """ Writes the store to disk if it has been modified. The arrays are
+        not compressed, so they are loaded at once, and the file is replaced
+        atomically so an interruption does not corrupt it.
+        """
+        if not self._modified:
+            return
+
+        temporal_path = self.path.with_name(f'{self.path.name}.tmp')
+        with open(temporal_path, 'wb') as file:
+            np.savez(file, names=self.names, sports=self.sports, sizes=self._sizes, stamps=self._stamps,
+                     offsets=self.offsets, **self.summary,
+                     **{f'track_{field}': values for field, values in self.track.items()})
+        os.replace(temporal_path, self.path)
+        self._modified = False
+        logger.debug('Saved {} workouts in the store `{}`.', len(self), self.path)
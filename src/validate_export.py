@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+validate_export.py
+=================
+Validates the workouts of the export before migrating it, to know which ones
+Strava would reject without spending any request.
+"""
+import json
+from collections import Counter
+from typing import Dict
+
+import fire
+from loguru import logger
+
+from utils.config_handler import init_app
+from utils.constants import CONFIG_FILE_PATH, PREFLIGHT_REPORT_FILE_NAME, FALLBACK_FIT
+from utils.files_handler import retrieve_activities_path, get_activity_files_names
+from utils.metrics import metrics
+from utils.parameters import SYSTEM, PATH, UPLOAD, FIT
+from utils.preflight import validate_activities
+
+
+def validate_export(path: str = None,
+                    config: str = CONFIG_FILE_PATH,
+                    workers: int = None,
+                    fit: bool = None) -> Dict[str, str]:
+    """ Generates a file with the workouts of the export that cannot be
+    uploaded and the reason. The workouts are inspected in a pool of
+    processes and the results are cached, so the next executions, including
+    the upload with `--preflight`, only read the new or modified workouts.
+
+    Args:
+        path (str): path to the folder containing the activities or to the
+         ZIP archive of the export.
+        config (str): path to the configuration file.
+        workers (int): number of processes. By default, the number of CPUs.
+        fit (bool): validate the workouts to be uploaded as FIT, that can be
+         converted from the points of the JSON if the TCX has none. By
+         default, the one set in the configuration file.
+
+    Returns:
+        dict: class of the error of each invalid activity.
+    """
+    app_config = init_app(config)
+    activities_folder = retrieve_activities_path(path, app_config)
+    if fit is None:
+        fit = app_config.getboolean(UPLOAD, FIT, fallback=FALLBACK_FIT)
+
+    with metrics.time('list_files_seconds'):
+        activity_files = get_activity_files_names(activities_folder)
+    with metrics.time('preflight_seconds'):
+        errors = validate_activities(activities_folder, activity_files, workers, fit)
+
+    for error, number in Counter(errors.values()).most_common():
+        logger.info('{}: {} activities.', error, number)
+
+    file_path = f'{app_config.get(SYSTEM, PATH)}/{PREFLIGHT_REPORT_FILE_NAME}'
+    with open(file_path, 'w') as file:
+        logger.info('Saving file with the activities that cannot be uploaded in `{}`', file_path)
+        json.dump(errors, file, indent=4)
+    metrics.save()
+    return errors
+
+
+if __name__ == '__main__':
+    fire.Fire(validate_export)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+tests/conftest.py
+=================
+Shared configuration of the tests. The modules of the application are
+imported from `src`, as the scripts do.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
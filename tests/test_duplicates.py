@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_duplicates.py
+=================
+Tests of the detection of the duplicated workouts of the export.
+"""
+from utils.duplicates import find_duplicates, get_track_hash, is_duplicate
+
+
+def get_fingerprint(start_time=1000.0, duration_s=3600.0, distance_km=10.0, track_hash=None):
+    return {'start_time': start_time, 'duration_s': duration_s, 'distance_km': distance_km,
+            'track_hash': track_hash}
+
+
+def test_same_track_is_duplicated():
+    assert is_duplicate(get_fingerprint(track_hash='a', duration_s=100),
+                        get_fingerprint(start_time=1030, track_hash='a', duration_s=5000))
+
+
+def test_same_duration_and_distance_is_duplicated():
+    assert is_duplicate(get_fingerprint(track_hash='a'),
+                        get_fingerprint(start_time=1030, duration_s=3630, distance_km=10.3, track_hash='b'))
+
+
+def test_different_start_is_not_duplicated():
+    assert not is_duplicate(get_fingerprint(track_hash='a'), get_fingerprint(start_time=1100, track_hash='a'))
+    assert not is_duplicate(get_fingerprint(start_time=None), get_fingerprint(start_time=None))
+
+
+def test_different_or_missing_summary_is_not_duplicated():
+    assert not is_duplicate(get_fingerprint(), get_fingerprint(distance_km=12))
+    assert not is_duplicate(get_fingerprint(distance_km=None), get_fingerprint(distance_km=None))
+
+
+def test_first_activity_in_priority_is_kept():
+    fingerprints = {'a': get_fingerprint(), 'b': get_fingerprint(start_time=1010),
+                    'c': get_fingerprint(start_time=990)}
+    assert find_duplicates(fingerprints, ['b', 'a', 'c']) == {'a': 'b', 'c': 'b'}
+    assert find_duplicates(fingerprints, ['c', 'b', 'a']) == {'a': 'c', 'b': 'c'}
+
+
+def test_only_activities_in_priority_are_compared():
+    fingerprints = {'a': get_fingerprint(), 'b': get_fingerprint(), 'c': get_fingerprint(start_time=None)}
+    assert find_duplicates(fingerprints, ['a', 'c']) == {}
+
+
+def test_distant_activities_are_not_duplicated():
+    fingerprints = {'a': get_fingerprint(), 'b': get_fingerprint(start_time=5000),
+                    'c': get_fingerprint(start_time=5020)}
+    assert find_duplicates(fingerprints, ['a', 'b', 'c']) == {'c': 'b'}
+
+
+def test_track_hash():
+    points = [{'latitude': 40.0 + index / 1000, 'longitude': -3.0} for index in range(100)]
+    assert get_track_hash(points) == get_track_hash([dict(point, altitude=1) for point in points])
+    assert get_track_hash(points) != get_track_hash(points[:50])
+    assert get_track_hash([{'latitude': None, 'longitude': None}]) is None
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_endomondo_parser.py
+=================
+Tests of the incremental read of the header of the Endomondo workouts.
+"""
+import io
+import json
+
+import pytest
+
+from parsers import endomondo
+from parsers.endomondo import read_json_header, get_activity_summary
+
+HEADER = [{'name': 'Morning run ' + 'x' * 100}, {'sport': 'RUNNING'},
+          {'start_time': '2020-11-21 17:43:14.0'}, {'distance_km': 10.5}, {'duration_s': 3600.0}]
+POINTS = [{'points': [[{'location': [[{'latitude': 40.0}, {'longitude': -3.0}]]},
+                       {'timestamp': 'Sat Nov 21 17:43:14 UTC 2020'}]] * 50}]
+
+
+def to_file(activity_data, indent=None):
+    return io.StringIO(json.dumps(activity_data, indent=indent))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 16 * 1024])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_elements_across_chunks(monkeypatch, chunk_size, indent):
+    monkeypatch.setattr(endomondo, 'READ_CHUNK_SIZE', chunk_size)
+    assert read_json_header(to_file(HEADER + POINTS, indent)) == HEADER
+
+
+def test_stops_when_the_fields_are_found(monkeypatch):
+    monkeypatch.setattr(endomondo, 'READ_CHUNK_SIZE', 16)
+    file = to_file([{'sport': 'RUNNING'}, {'other': 1}, {'extra': 'x' * 1000}] + POINTS)
+    assert read_json_header(file, ['sport']) == [{'sport': 'RUNNING'}]
+    assert file.tell() < 100
+
+
+def test_stops_at_the_points(monkeypatch):
+    monkeypatch.setattr(endomondo, 'READ_CHUNK_SIZE', 16)
+    file = to_file(HEADER[:2] + POINTS + [{'duration_s': 1.0}])
+    assert read_json_header(file) == HEADER[:2]
+    assert file.tell() < len(file.getvalue()) / 2
+
+
+def test_reads_until_the_end_if_fields_are_missing():
+    assert read_json_header(to_file(HEADER[:2])) == HEADER[:2]
+    assert read_json_header(io.StringIO('[]')) == []
+
+
+def test_summary_of_the_header():
+    summary = get_activity_summary(read_json_header(to_file(HEADER + POINTS)))
+    assert summary == {'sport': 'RUNNING', 'start_time': 1605980594.0, 'duration_s': 3600.0, 'distance_km': 10.5}
+
+
+@pytest.mark.parametrize('content', ['{"sport": "RUNNING"}', '[{"sport": "RUNNING"}, {"start_time": "20'])
+def test_invalid_workouts_raise(monkeypatch, content):
+    monkeypatch.setattr(endomondo, 'READ_CHUNK_SIZE', 8)
+    with pytest.raises(json.JSONDecodeError):
+        read_json_header(io.StringIO(content))
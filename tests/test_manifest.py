@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_manifest.py
+=================
+Tests of the states of the activities in the migration manifest and the
+counting of their retries.
+"""
+import pytest
+
+from utils.manifest import Manifest, SUBMITTED, UPLOADED, FAILED, SKIPPED
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        yield manifest
+
+
+def test_new_manifest_is_empty(manifest):
+    assert manifest.is_empty()
+    assert manifest.get_state('activity') is None
+    assert manifest.get_retry_count('activity') == 0
+
+
+def test_submitted_activity_is_uploaded(manifest):
+    manifest.mark_submitted('activity', 10)
+    assert manifest.get_state('activity') == SUBMITTED
+    assert manifest.get_submitted()['activity'][0] == 10
+
+    manifest.mark_uploaded('activity')
+    assert manifest.get_state('activity') == UPLOADED
+    assert manifest.get_submitted() == {}
+    # The upload id of the submission is kept
+    row = manifest._connection.execute('SELECT upload_id, attempts FROM activities').fetchone()
+    assert row == (10, 2)
+
+
+def test_names_by_state(manifest):
+    manifest.mark_uploaded('uploaded')
+    manifest.mark_failed('failed', 'ActivityUploadFailed')
+    manifest.mark_skipped('skipped', 'duplicate')
+    assert manifest.get_names(UPLOADED, SKIPPED) == {'uploaded', 'skipped'}
+    assert manifest.get_processed() == {'uploaded', 'failed', 'skipped'}
+    assert manifest.get_state('skipped') == SKIPPED
+
+
+def test_retries_are_counted_until_the_upload_succeeds(manifest):
+    manifest.mark_failed('activity', 'ConnectionError', next_attempt=100)
+    manifest.mark_failed('activity', 'ConnectionError', next_attempt=200)
+    assert manifest.get_state('activity') == FAILED
+    assert manifest.get_retry_count('activity') == 2
+    assert manifest.get_retries() == {'activity': 200}
+
+    manifest.mark_uploaded('activity', 10)
+    assert manifest.get_retry_count('activity') == 0
+    assert manifest.get_retries() == {}
+
+
+def test_permanent_failures_are_not_retried(manifest):
+    manifest.mark_failed('activity', 'ActivityUploadFailed')
+    assert manifest.get_retry_count('activity') == 0
+    assert manifest.get_retries() == {}
+
+
+def test_schedule_retries_of_previous_failures(manifest):
+    manifest.mark_failed('transient', 'ConnectionError')
+    manifest.mark_failed('permanent', 'ActivityUploadFailed')
+    manifest.mark_failed('exhausted', 'ConnectionError', next_attempt=100)
+    manifest.mark_failed('exhausted', 'ConnectionError')
+    assert manifest.schedule_retries(['ConnectionError'], max_retries=1) == 1
+    assert set(manifest.get_retries()) == {'transient'}
+
+
+def test_many_uploaded(manifest):
+    manifest.mark_failed('activity', 'ConnectionError', next_attempt=100)
+    manifest.mark_many_uploaded(['activity', 'other'])
+    assert manifest.get_names(UPLOADED) == {'activity', 'other'}
+    assert manifest.get_retries() == {}
+
+
+def test_changes_are_kept_after_closing(tmp_path):
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        manifest.mark_submitted('activity', 10)
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        assert manifest.get_state('activity') == SUBMITTED
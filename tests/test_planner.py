@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_planner.py
+=================
+Tests of the estimation of the duration of the migration.
+"""
+import pytest
+
+from utils.planner import plan_migration, get_requests_per_activity
+from utils.rate_limiter import SHORT_WINDOW, LONG_WINDOW
+
+# Midnight UTC of a day
+MIDNIGHT = 1_700_006_400
+
+
+def get_usage(short_usage=0, long_usage=0, short_limit=100, long_limit=1000):
+    return {'short_usage': short_usage, 'short_limit': short_limit,
+            'long_usage': long_usage, 'long_limit': long_limit}
+
+
+def test_no_requests():
+    plan = plan_migration(0, get_usage(), now=MIDNIGHT + 10)
+    assert (plan.requests, plan.days, plan.finish_at) == (0, 0, MIDNIGHT + 10)
+
+
+def test_requests_of_a_window_are_done_at_once():
+    plan = plan_migration(100, get_usage(), now=MIDNIGHT)
+    assert (plan.days, plan.finish_at) == (1, MIDNIGHT)
+
+
+def test_requests_over_the_short_limit_wait_for_the_next_window():
+    assert plan_migration(150, get_usage(), now=MIDNIGHT).finish_at == MIDNIGHT + SHORT_WINDOW
+    assert plan_migration(50, get_usage(short_usage=60), now=MIDNIGHT + 60).finish_at == MIDNIGHT + SHORT_WINDOW
+
+
+def test_requests_over_the_long_limit_wait_for_the_next_day():
+    plan = plan_migration(2500, get_usage(), now=MIDNIGHT)
+    assert plan.days == 3
+    assert plan.finish_at == MIDNIGHT + 2 * LONG_WINDOW + 4 * SHORT_WINDOW
+
+
+def test_exhausted_day_starts_tomorrow():
+    plan = plan_migration(1, get_usage(long_usage=1000), now=MIDNIGHT + 3600)
+    assert (plan.days, plan.finish_at) == (1, MIDNIGHT + LONG_WINDOW)
+
+
+def test_speed_limits_the_requests_of_a_window():
+    assert plan_migration(10, get_usage(), requests_per_second=1, now=MIDNIGHT).finish_at == MIDNIGHT + 10
+    # Only 50 requests fit in the last 50 seconds of the window
+    plan = plan_migration(60, get_usage(), requests_per_second=1, now=MIDNIGHT + SHORT_WINDOW - 50)
+    assert plan.finish_at == MIDNIGHT + SHORT_WINDOW + 10
+
+
+def test_limits_without_requests_raise():
+    with pytest.raises(ValueError):
+        plan_migration(10, get_usage(short_limit=0))
+
+
+def test_requests_per_activity():
+    assert get_requests_per_activity(False) == 1
+    assert get_requests_per_activity(True) > 1
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_rate_limiter.py
+=================
+Tests of the windows of the rate limiter and its update with the usage
+reported by Strava.
+"""
+from types import SimpleNamespace
+
+import pytest
+from stravalib import exc
+
+from utils import rate_limiter
+from utils.rate_limiter import RateLimiter, AccountRateLimiter, SHORT_WINDOW, LONG_WINDOW
+
+# Two minutes after midnight UTC of a day
+START_TIME = 1_700_006_400 + 120
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Replaces the time of the rate limiter with one set by the test. """
+    clock = SimpleNamespace(now=START_TIME)
+    clock.time = lambda: clock.now
+    clock.sleep = lambda seconds: setattr(clock, 'now', clock.now + seconds)
+    monkeypatch.setattr(rate_limiter, 'time', clock)
+    return clock
+
+
+def get_limiter(tmp_path, short_limit=3, long_limit=5, name='rate_limit.json', **kwargs):
+    return RateLimiter(tmp_path / name, short_limit=short_limit, long_limit=long_limit, **kwargs)
+
+
+def test_windows_start_at_natural_boundaries(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    limiter.try_acquire()
+    assert limiter.short_window % SHORT_WINDOW == 0
+    assert limiter.long_window % LONG_WINDOW == 0
+    assert limiter.seconds_to_short_reset() == SHORT_WINDOW - 120
+
+
+def test_try_acquire_waits_when_the_short_window_is_exhausted(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    assert [limiter.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_acquire() == SHORT_WINDOW - 120
+    assert limiter.usage()['short_usage'] == 3
+
+
+def test_short_window_is_reset_at_the_next_quarter(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    for _ in range(3):
+        limiter.try_acquire()
+    clock.now += limiter.try_acquire()
+    assert limiter.try_acquire() == 0
+    assert limiter.usage() == {'short_usage': 1, 'short_limit': 3, 'long_usage': 4, 'long_limit': 5}
+
+
+def test_acquire_sleeps_until_the_reset(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    for _ in range(3):
+        limiter.acquire()
+    limiter.acquire()
+    assert clock.now == START_TIME - 120 + SHORT_WINDOW
+
+
+def test_daily_limit_raises(tmp_path, clock):
+    limiter = get_limiter(tmp_path, short_limit=10, long_limit=2)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(exc.RateLimitExceeded):
+        limiter.try_acquire()
+
+    clock.now += limiter.seconds_to_long_reset()
+    assert limiter.try_acquire() == 0
+
+
+def test_release_gives_back_the_request(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    limiter.acquire()
+    limiter.release()
+    limiter.release()
+    assert limiter.remaining() == 3
+
+
+def test_state_is_persisted(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    limiter.acquire()
+    limiter.acquire()
+    assert get_limiter(tmp_path).usage()['short_usage'] == 2
+
+    clock.now += SHORT_WINDOW
+    assert get_limiter(tmp_path).usage()['short_usage'] == 0
+    assert get_limiter(tmp_path).usage()['long_usage'] == 2
+
+
+def test_headers_update_usage_and_limits(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    limiter({'X-RateLimit-Usage': '2,40', 'X-RateLimit-Limit': '200,2000'})
+    assert limiter.usage() == {'short_usage': 2, 'short_limit': 200, 'long_usage': 40, 'long_limit': 2000}
+
+
+def test_headers_do_not_lower_the_local_reservations(tmp_path, clock):
+    limiter = get_limiter(tmp_path)
+    limiter.acquire()
+    limiter.acquire()
+    limiter({'x-ratelimit-usage': '1,1', 'x-ratelimit-limit': '3,5'})
+    assert limiter.usage()['short_usage'] == 2
+    assert limiter.usage()['long_usage'] == 2
+
+
+def test_headers_keep_the_limits_of_a_budget(tmp_path, clock):
+    limiter = get_limiter(tmp_path, update_limits=False)
+    limiter({'x-ratelimit-usage': '1,1', 'x-ratelimit-limit': '200,2000'})
+    assert limiter.usage()['short_limit'] == 3
+
+
+@pytest.mark.parametrize('headers', [{}, {'x-ratelimit-usage': '1,1'},
+                                     {'x-ratelimit-usage': 'a,b', 'x-ratelimit-limit': '200,2000'}])
+def test_missing_or_invalid_headers_are_ignored(tmp_path, clock, headers):
+    limiter = get_limiter(tmp_path)
+    limiter(headers)
+    assert limiter.usage() == {'short_usage': 0, 'short_limit': 3, 'long_usage': 0, 'long_limit': 5}
+
+
+def test_account_budget_is_released_when_the_application_is_exhausted(tmp_path, clock):
+    application = get_limiter(tmp_path, short_limit=1)
+    account = AccountRateLimiter(get_limiter(tmp_path, name='account.json', update_limits=False), application)
+    assert account.try_acquire() == 0
+    assert account.try_acquire() > 0
+    assert account.account.usage()['short_usage'] == 1
+    assert application.usage()['short_usage'] == 1
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_reconciliation.py
+=================
+Tests of the index of the activities that the athlete already has in Strava
+and the match of the workouts of the export with them.
+"""
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from utils import reconciliation
+from utils.rate_limiter import RateLimiter
+from utils.reconciliation import RemoteIndex, parse_remote_activity, STRAVA_TIME_FORMAT
+
+START_TIME = 1_700_000_000
+
+
+def to_strava_activity(activity_id, start_time, elapsed_time):
+    start_date = datetime.fromtimestamp(start_time, timezone.utc).strftime(STRAVA_TIME_FORMAT)
+    return {'id': activity_id, 'start_date': start_date, 'elapsed_time': elapsed_time}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """ Client that lists the activities set in `remote_activities`, one per page. """
+    monkeypatch.setattr(reconciliation, 'REMOTE_PAGE_SIZE', 1)
+    client = SimpleNamespace(remote_activities=list(), requests=0)
+
+    def get(url, after, before, page, per_page):
+        client.requests += 1
+        return [activity for activity in client.remote_activities
+                if after <= parse_remote_activity(activity)[0] <= before][(page - 1) * per_page:page * per_page]
+
+    client.protocol = SimpleNamespace(get=get)
+    return client
+
+
+@pytest.fixture
+def index(tmp_path, client):
+    client.remote_activities = [to_strava_activity(1, START_TIME, 3600),
+                                to_strava_activity(2, START_TIME + 7200, 600),
+                                to_strava_activity(3, START_TIME + 86400, 36000)]
+    index = RemoteIndex(tmp_path / 'remote_index.json')
+    index.update(client, RateLimiter(tmp_path / 'rate_limit.json'), START_TIME, START_TIME + 86400)
+    return index
+
+
+def test_parse_remote_activity():
+    assert parse_remote_activity(to_strava_activity(1, START_TIME, 60)) == (START_TIME, 60, 1)
+    assert parse_remote_activity({'id': 1, 'start_date': None}) is None
+
+
+def test_update_lists_every_page(index, client):
+    assert [activity_id for _, _, activity_id in index.activities] == [1, 2, 3]
+    assert client.requests == 4
+
+
+def test_saved_index_is_reused(tmp_path, index, client):
+    saved_index = RemoteIndex(index.path)
+    assert saved_index.activities == index.activities
+    saved_index.update(client, RateLimiter(tmp_path / 'rate_limit.json'), START_TIME, START_TIME + 3600)
+    assert client.requests == 4
+    assert not saved_index.is_valid(START_TIME, START_TIME + 10 * 86400)
+
+
+def test_same_start_matches(index):
+    assert index.find_match(START_TIME + 30, None) == 1
+    assert index.find_match(START_TIME - 30, 10) == 1
+
+
+def test_overlap_matches(index):
+    # Half of the workout overlaps with the first activity
+    assert index.find_match(START_TIME + 1800, 3600) == 1
+    # Most of the second activity is inside the workout
+    assert index.find_match(START_TIME + 7000, 700) == 2
+    # A workout inside a long activity that started hours before
+    assert index.find_match(START_TIME + 86400 + 30000, 1200) == 3
+
+
+def test_short_overlap_does_not_match(index):
+    assert index.find_match(START_TIME + 3000, 3600) is None
+    assert index.find_match(START_TIME + 4000, None) is None
+    assert index.find_match(START_TIME - 3600, 1800) is None
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_retry_queue.py
+=================
+Tests of the backoff and the queue of the retries of the failed uploads.
+"""
+from utils.constants import RETRY_INITIAL_DELAY, RETRY_BACKOFF_FACTOR, RETRY_MAX_DELAY, SERVER_ERROR
+from utils.retry_queue import RetryQueue, get_retry_delay, is_transient_error
+
+
+def test_retry_delay_grows_exponentially():
+    assert get_retry_delay(0) == RETRY_INITIAL_DELAY
+    assert get_retry_delay(1) == RETRY_INITIAL_DELAY * RETRY_BACKOFF_FACTOR
+    assert get_retry_delay(2) == RETRY_INITIAL_DELAY * RETRY_BACKOFF_FACTOR ** 2
+
+
+def test_retry_delay_is_capped():
+    assert get_retry_delay(100) == RETRY_MAX_DELAY
+    delays = [get_retry_delay(retries) for retries in range(20)]
+    assert delays == sorted(delays)
+
+
+def test_transient_errors():
+    assert is_transient_error('ConnectionError')
+    assert is_transient_error(SERVER_ERROR)
+    assert not is_transient_error('HTTPError')
+    assert not is_transient_error('ActivityUploadFailed')
+    assert not is_transient_error(None)
+
+
+def test_retries_are_due_in_order():
+    queue = RetryQueue({'late': 300, 'early': 100})
+    queue.push('middle', 200)
+    assert len(queue) == 3
+    assert queue.next_attempt == 100
+    assert queue.pop_due(now=250) == 'early'
+    assert queue.pop_due(now=250) == 'middle'
+    assert queue.pop_due(now=250) is None
+    assert queue.next_attempt == 300
+    assert queue.pop_due(now=300) == 'late'
+    assert len(queue) == 0 and queue.next_attempt is None
+
+
+def test_retries_use_the_current_time():
+    queue = RetryQueue()
+    queue.push('past', 1)
+    queue.push('future', 2 ** 40)
+    assert queue.pop_due() == 'past'
+    assert queue.pop_due() is None
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+tests/test_tcx_simplify.py
+=================
+Tests of the selection of the trackpoints kept when the tracks are simplified.
+"""
+import numpy as np
+
+from transform.tcx_simplify import douglas_peucker, get_trackpoints_mask, project_coordinates
+from utils.constants import MAX_TRACKPOINT_INTERVAL
+
+
+def test_straight_line_keeps_the_ends():
+    points = np.column_stack((np.arange(10.0), np.zeros(10)))
+    assert douglas_peucker(points, 1).tolist() == [True] + [False] * 8 + [True]
+
+
+def test_points_beyond_the_tolerance_are_kept():
+    points = np.array([[0, 0], [1, 0.5], [2, 5], [3, 0.5], [4, 0]], dtype=float)
+    assert douglas_peucker(points, 1).tolist() == [True, False, True, False, True]
+    assert douglas_peucker(points, 0.1).tolist() == [True] * 5
+    assert douglas_peucker(points, 10).tolist() == [True, False, False, False, True]
+
+
+def test_closed_loop_keeps_the_farthest_point():
+    points = np.array([[0, 0], [5, 0], [10, 0.5], [5, 1], [0, 0]], dtype=float)
+    assert douglas_peucker(points, 2).tolist() == [True, False, True, False, True]
+
+
+def test_short_lines():
+    assert douglas_peucker(np.empty((0, 2)), 1).tolist() == []
+    assert douglas_peucker(np.zeros((1, 2)), 1).tolist() == [True]
+    assert douglas_peucker(np.zeros((2, 2)), 1).tolist() == [True, True]
+
+
+def test_projection_in_meters():
+    points = project_coordinates(np.array([0.0, 0.0, 0.001]), np.array([0.0, 0.001, 0.001]))
+    distances = np.hypot(*np.diff(points, axis=0).T)
+    assert np.allclose(distances, 111.2, atol=0.1)
+
+
+def get_arrays(latitude, longitude, time=None):
+    latitude, longitude = np.array(latitude, dtype=float), np.array(longitude, dtype=float)
+    time = np.full(len(latitude), np.nan) if time is None else np.array(time, dtype=float)
+    return {'latitude': latitude, 'longitude': longitude, 'time': time}
+
+
+def test_mask_keeps_the_points_without_position():
+    arrays = get_arrays([0, 0, np.nan, 0, 0], [0, 0.001, np.nan, 0.002, 0.003])
+    assert get_trackpoints_mask(arrays, 1).tolist() == [True, False, True, False, True]
+
+
+def test_mask_keeps_a_point_every_interval():
+    count = 4 * MAX_TRACKPOINT_INTERVAL
+    arrays = get_arrays(np.zeros(count), np.linspace(0, 0.01, count), time=1000 + np.arange(count))
+    keep = get_trackpoints_mask(arrays, 1)
+    assert np.flatnonzero(keep).tolist() == [0, *range(MAX_TRACKPOINT_INTERVAL, count, MAX_TRACKPOINT_INTERVAL),
+                                             count - 1]
+
+
+def test_mask_of_a_track_without_positions_nor_times():
+    assert get_trackpoints_mask(get_arrays([np.nan] * 3, [np.nan] * 3), 1).tolist() == [True] * 3
+    assert get_trackpoints_mask(get_arrays([], []), 1).tolist() == []